@@ -0,0 +1,368 @@
+"""Benchmark suite for shellous.
+
+Run from the repository root:
+
+```
+python -m benchmarks.bench [--quick] [--output results.json]
+python -m benchmarks.bench --compare baseline.json [--threshold 0.25]
+```
+
+Each benchmark is repeated several times; the JSON output records every
+sample along with the median. With `--compare`, the run fails (exit status 1)
+if any median is slower than the baseline by more than `--threshold`.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import shellous
+import shellous.redirect as redir
+from shellous import sh
+from shellous.forkserver import close_forkserver
+from shellous.prompt import Prompt
+from shellous.spawn import LAUNCHERS
+
+# Command that does nothing; fall back to Python where `true` is missing.
+_TRUE = ("true",) if shutil.which("true") else (sys.executable, "-c", "pass")
+
+# Python snippets run by the benchmarks. Using the Python interpreter keeps
+# the suite portable.
+_PY_WRITE = "import sys; sys.stdout.buffer.write(b'x' * {size})"
+_PY_LINES = (
+    "import sys; sys.stdout.writelines('line %d\\n' % i for i in range({count}))"
+)
+_PY_CAT = "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)"
+_PY_PROMPT = """\
+import sys
+sys.stdout.write('> ')
+sys.stdout.flush()
+for line in sys.stdin:
+    sys.stdout.write(line + '> ')
+    sys.stdout.flush()
+"""
+
+_CHUNK = b"x" * 65536
+
+
+@dataclass
+class Measurement:
+    "Timing results for one benchmark."
+
+    name: str
+    "Benchmark name."
+
+    params: dict[str, Any]
+    "Benchmark parameters."
+
+    unit: str
+    "Unit of work measured, e.g. 'spawn' or 'byte'."
+
+    ops: int
+    "Units of work done in each sample."
+
+    samples: list[float] = field(default_factory=list)
+    "Elapsed seconds of each sample."
+
+    @property
+    def key(self) -> str:
+        "Return unique key for comparing against a baseline."
+        params = ",".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.name}[{params}]"
+
+    @property
+    def median(self) -> float:
+        "Median elapsed time of the samples."
+        return statistics.median(self.samples)
+
+    def to_json(self) -> dict[str, Any]:
+        "Return JSON-compatible representation."
+        result = asdict(self)
+        result["key"] = self.key
+        result["median"] = self.median
+        result["min"] = min(self.samples)
+        result["seconds_per_op"] = self.median / self.ops
+        result["ops_per_sec"] = self.ops / self.median if self.median else None
+        return result
+
+
+BenchFn = Callable[[], Awaitable[None]]
+
+
+async def _measure(
+    name: str,
+    params: dict[str, Any],
+    unit: str,
+    ops: int,
+    func: BenchFn,
+    repeat: int,
+) -> Measurement:
+    "Run `func` once to warm up, then `repeat` more times."
+    result = Measurement(name, params, unit, ops)
+    await func()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        result.samples.append(time.perf_counter() - start)
+    _report(result)
+    return result
+
+
+def _report(result: Measurement) -> None:
+    "Print a human-readable summary to stderr."
+    rate = result.ops / result.median if result.median else 0.0
+    print(
+        f"{result.key:<50} {result.median * 1000:10.3f} ms"
+        f" {rate:14.1f} {result.unit}/s",
+        file=sys.stderr,
+    )
+
+
+async def bench_spawn(launcher: str, count: int, repeat: int) -> Measurement:
+    "Measure latency of spawning a trivial command."
+    cmd = sh(*_TRUE).set(launcher=launcher)  # type: ignore
+
+    async def _run():
+        for _ in range(count):
+            await cmd
+
+    try:
+        return await _measure(
+            "spawn", {"launcher": launcher}, "spawn", count, _run, repeat
+        )
+    finally:
+        close_forkserver()
+
+
+async def bench_copy_bytearray(size: int, repeat: int) -> Measurement:
+    "Measure throughput of `copy_bytearray` from an in-memory StreamReader."
+
+    async def _run():
+        reader = asyncio.StreamReader(limit=2**16)
+        dest = bytearray()
+        task = asyncio.create_task(redir.copy_bytearray(reader, dest))
+        for _ in range(size // len(_CHUNK)):
+            reader.feed_data(_CHUNK)
+            await asyncio.sleep(0)
+        reader.feed_eof()
+        await task
+        assert len(dest) == size
+
+    return await _measure("copy_bytearray", {}, "byte", size, _run, repeat)
+
+
+async def bench_capture(size: int, repeat: int) -> Measurement:
+    "Measure throughput of capturing a subprocess's stdout."
+    cmd = sh(sys.executable, "-c", _PY_WRITE.format(size=size))
+
+    async def _run():
+        result = await cmd.result
+        assert len(result.output_bytes) == size
+
+    return await _measure("capture", {}, "byte", size, _run, repeat)
+
+
+async def bench_lines(count: int, repeat: int) -> Measurement:
+    "Measure the rate of `async for` line iteration."
+    cmd = sh(sys.executable, "-c", _PY_LINES.format(count=count)).stdout(sh.CAPTURE)
+
+    async def _run():
+        lines = 0
+        async with cmd as run:
+            async for _ in run:
+                lines += 1
+        assert lines == count
+
+    return await _measure("async_for_lines", {}, "line", count, _run, repeat)
+
+
+async def bench_lines_batched(count: int, repeat: int) -> Measurement:
+    "Measure the rate of batched line iteration using `lines()`."
+    cmd = sh(sys.executable, "-c", _PY_LINES.format(count=count))
+
+    async def _run():
+        lines = 0
+        async for batch in cmd.lines():
+            lines += len(batch)
+        assert lines == count
+
+    return await _measure("lines_batched", {}, "line", count, _run, repeat)
+
+
+async def bench_prompt(count: int, repeat: int) -> Measurement:
+    "Measure the round-trip rate of `Prompt.send`."
+    cmd = (
+        sh(sys.executable, "-u", "-c", _PY_PROMPT).stdin(sh.CAPTURE).stdout(sh.CAPTURE)
+    )
+
+    async def _run():
+        async with cmd as run:
+            prompt = Prompt(run, "> ")
+            await prompt.receive()
+            for i in range(count):
+                assert await prompt.send(f"{i}") == f"{i}\n"
+            prompt.close()
+
+    return await _measure("prompt_send", {}, "send", count, _run, repeat)
+
+
+async def bench_pipeline(stages: int, size: int, repeat: int) -> Measurement:
+    "Measure throughput of an N-stage pipeline."
+    pipe = sh(sys.executable, "-c", _PY_WRITE.format(size=size))
+    for _ in range(stages - 1):
+        pipe = pipe | sh(sys.executable, "-c", _PY_CAT)
+
+    async def _run():
+        result = await pipe.result
+        assert len(result.output_bytes) == size
+
+    return await _measure("pipeline", {"stages": stages}, "byte", size, _run, repeat)
+
+
+async def bench_concurrency(count: int, repeat: int) -> Measurement:
+    "Measure running `count` commands concurrently."
+    # Don't use pipes, so the benchmark doesn't run out of file descriptors.
+    cmd = sh(*_TRUE).stdin(sh.DEVNULL).stdout(sh.DEVNULL).stderr(sh.DEVNULL)
+
+    async def _run():
+        # Use distinct arguments; `gather` runs identical awaitables once.
+        await asyncio.gather(*(cmd(i) for i in range(count)))
+
+    return await _measure(
+        "concurrency", {"count": count}, "command", count, _run, repeat
+    )
+
+
+async def run_all(quick: bool, only: Optional[list[str]] = None) -> list[Measurement]:
+    "Run the benchmark suite."
+    scale = 1 if quick else 10
+    repeat = 3 if quick else 5
+    mbyte = 2**20
+
+    benches: list[tuple[str, Callable[[], Awaitable[Measurement]]]] = []
+    for launcher in LAUNCHERS:
+        benches.append(
+            (
+                "spawn",
+                lambda launcher=launcher: bench_spawn(launcher, 5 * scale, repeat),
+            )
+        )
+    benches += [
+        ("copy_bytearray", lambda: bench_copy_bytearray(8 * scale * mbyte, repeat)),
+        ("capture", lambda: bench_capture(8 * scale * mbyte, repeat)),
+        ("async_for_lines", lambda: bench_lines(10000 * scale, repeat)),
+        ("lines_batched", lambda: bench_lines_batched(10000 * scale, repeat)),
+        ("prompt_send", lambda: bench_prompt(100 * scale, repeat)),
+        ("pipeline", lambda: bench_pipeline(4, 8 * scale * mbyte, repeat)),
+    ]
+    for count in (10, 100, 1000):
+        if quick and count > 100:
+            break
+        benches.append(
+            ("concurrency", lambda count=count: bench_concurrency(count, repeat))
+        )
+
+    results: list[Measurement] = []
+    for name, bench in benches:
+        if only and name not in only:
+            continue
+        results.append(await bench())
+    return results
+
+
+def compare(
+    results: list[Measurement],
+    baseline: dict[str, Any],
+    threshold: float,
+) -> list[str]:
+    "Return a list of regressions compared to the baseline results."
+    previous = {item["key"]: item["median"] for item in baseline["benchmarks"]}
+    regressions: list[str] = []
+    for result in results:
+        old = previous.get(result.key)
+        if old is not None and result.median > old * (1.0 + threshold):
+            change = (result.median / old - 1.0) * 100.0
+            regressions.append(f"{result.key}: {change:+.1f}%")
+    return regressions
+
+
+def _environment() -> dict[str, Any]:
+    "Return information about the benchmark environment."
+    return {
+        "shellous": shellous.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": sys.platform,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+    }
+
+
+def _raise_fd_limit() -> None:
+    "Raise the soft limit on open files for the concurrency benchmark."
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:  # pragma: no cover
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or hard > 8192:
+        hard = 8192
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    "Run benchmarks from the command line."
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller workloads")
+    parser.add_argument("--only", action="append", help="run named benchmark")
+    parser.add_argument("--output", help="write JSON results to file")
+    parser.add_argument("--compare", help="baseline JSON results file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="allowed slowdown versus baseline (default 0.25)",
+    )
+    args = parser.parse_args(argv)
+
+    # Don't log warnings about slow process launches.
+    logging.getLogger("shellous").setLevel(logging.ERROR)
+    _raise_fd_limit()
+    results = asyncio.run(run_all(args.quick, args.only))
+
+    report = {
+        "environment": _environment(),
+        "benchmarks": [result.to_json() for result in results],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,11 +10,14 @@ __version__ = "0.30.0"
 import sys
 import warnings
 
-from .command import AuditEventInfo, CmdContext, Command, Options
+from .command import AuditEventInfo, CmdContext, Command, CommandTemplate, Options
+from .metrics import MetricsRegistry
+from .pipe_runner import PipeRunner
 from .pipeline import Pipeline
 from .pty_util import cbreak, cooked, raw
-from .result import Result, ResultError
-from .runner import PipeRunner, Runner
+from .result import PhaseTiming, ResourceUsage, Result, ResultError
+from .runner import Runner
+from .scheduler import ConcurrencyLimiter
 
 if sys.version_info[:3] in [(3, 10, 9), (3, 11, 1)]:
     # Warn about these specific Python releases: 3.10.9 and 3.11.1
@@ -42,6 +45,7 @@ __all__ = [
     "sh",
     "CmdContext",
     "Command",
+    "CommandTemplate",
     "Options",
     "Pipeline",
     "cbreak",
@@ -49,7 +53,11 @@ __all__ = [
     "raw",
     "Result",
     "ResultError",
+    "ResourceUsage",
+    "PhaseTiming",
     "Runner",
     "PipeRunner",
     "AuditEventInfo",
+    "ConcurrencyLimiter",
+    "MetricsRegistry",
 ]
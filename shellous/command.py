@@ -6,6 +6,7 @@
 """
 
 import asyncio
+import builtins
 import collections.abc
 import dataclasses
 import enum
@@ -36,17 +37,31 @@ from typing import (
 )
 
 import shellous
+from shellous.fanout import MapItemsType, fanout
 from shellous.pty_util import PtyAdapterOrBool
 from shellous.redirect import (
+    LONG_LINES,
+    MAX_OUTPUT_ACTIONS,
     STDIN_TYPES,
     STDOUT_TYPES,
+    LongLinesT,
+    MaxOutputActionT,
     Redirect,
     StdinType,
     StdoutType,
     aiter_preflight,
 )
-from shellous.runner import Runner
-from shellous.util import EnvironmentDict, context_aenter, context_aexit
+from shellous.result import RESULT_STDERR_LIMIT
+from shellous.runner import LaunchPlan, Runner, compile_plan
+from shellous.scheduler import ConcurrencyLimiter
+from shellous.spawn import LAUNCHERS, LauncherT
+from shellous.util import (
+    WHICH_CACHE,
+    EnvironmentDict,
+    WhichCacheInfo,
+    context_aenter,
+    context_aexit,
+)
 
 
 # Sentinel used in keyword arguments to indicate that a value was not set by
@@ -129,6 +144,9 @@ class Options:  # pylint: disable=too-many-instance-attributes
     _return_result: bool = False
     "True if we should return `Result` object instead of the output text/bytes."
 
+    _return_bytes: bool = False
+    "True if we should return the output bytes instead of the output text."
+
     _catch_cancelled_error: bool = False
     "True if we should raise `ResultError` after clean up from cancelled task."
 
@@ -174,15 +192,63 @@ class Options:  # pylint: disable=too-many-instance-attributes
     coerce_arg: _CoerceArgFnT = None
     "Function called to coerce top level arguments."
 
+    launcher: LauncherT = "asyncio"
+    "Name of the process launcher used to start the subprocess."
+
+    max_concurrency: Optional[ConcurrencyLimiter] = None
+    "Limiter shared by commands that run with a concurrency limit."
+
+    priority: int = 0
+    "Priority used when waiting for a concurrency slot."
+
+    input_memfd: Union[bool, int] = False
+    "Pass bytes/str input to the process using a sealed memfd."
+
+    buffer_spill: Optional[int] = None
+    "Size at which buffered stdout moves to a temporary file."
+
+    max_output: Optional[int] = None
+    "Maximum number of bytes of output to capture."
+
+    max_output_action: MaxOutputActionT = "truncate"
+    "Action to take when output exceeds `max_output`."
+
+    error_head: int = RESULT_STDERR_LIMIT // 2
+    "Number of bytes kept from the start of buffered stderr."
+
+    error_tail: int = RESULT_STDERR_LIMIT // 2
+    "Number of bytes kept from the end of buffered stderr."
+
+    codec_offload: Optional[int] = None
+    "Size at which input/output is encoded/decoded in a worker thread."
+
+    stream_limit: int = 2**16
+    "Buffer limit in bytes for the stdout/stderr StreamReader."
+
+    long_lines: Optional[LongLinesT] = None
+    "How to handle a line that is longer than `stream_limit`."
+
     def runtime_env(self) -> Optional[dict[str, str]]:
-        "@private Return our `env` merged with the global environment."
+        """@private Return our `env` merged with the global environment.
+
+        The result is cached; the caller must not modify it.
+        """
+        if self.env:
+            return self.env.merged_env(self.inherit_env).merged
         if self.inherit_env:
-            if not self.env:
-                return None
-            return os.environ | self.env
+            return None
+        return {}
+
+    def launch_env(self) -> Optional[dict[Any, Any]]:
+        """@private Return the environment to pass to a new process.
 
+        This is the same as `runtime_env` except that on POSIX the keys and
+        values are already encoded as bytes.
+        """
         if self.env:
-            return dict(self.env)  # make copy of dict
+            return self.env.merged_env(self.inherit_env).encoded
+        if self.inherit_env:
+            return None
         return {}
 
     def set_stdin(self, input_: Any, close: bool) -> "Options":
@@ -237,6 +303,19 @@ class Options:  # pylint: disable=too-many-instance-attributes
         See `Command.set` for option reference.
         """
         kwds = {key: value for key, value in kwds.items() if value is not _UNSET}
+        if kwds.get("launcher", "asyncio") not in LAUNCHERS:
+            raise ValueError(f"unknown launcher: {kwds['launcher']!r}")
+        if kwds.get("max_output_action", "truncate") not in MAX_OUTPUT_ACTIONS:
+            raise ValueError(
+                f"unknown max_output_action: {kwds['max_output_action']!r}"
+            )
+        if kwds.get("long_lines") not in LONG_LINES:
+            raise ValueError(f"unknown long_lines: {kwds['long_lines']!r}")
+        if kwds.get("stream_limit", 1) <= 0:
+            raise ValueError("stream_limit must be positive")
+        if isinstance(kwds.get("max_concurrency"), int):
+            # Commands derived from these options share the same limiter.
+            kwds["max_concurrency"] = ConcurrencyLimiter(kwds["max_concurrency"])
         if "env" in kwds:
             # The "env" property is stored as an `EnvironmentDict`.
             new_env = kwds["env"]
@@ -260,11 +339,34 @@ class Options:  # pylint: disable=too-many-instance-attributes
         self, name: Union[str, bytes, os.PathLike[Any]]
     ) -> Optional[Union[str, bytes, os.PathLike[Any]]]:
         "@private Find the command with the given name and return its path."
+        if isinstance(name, str):
+            return WHICH_CACHE.which(name, self.path)
         return shutil.which(name, path=self.path)
 
 
-# Return type for a Command, CmdContext can be either `str` or `Result`.
-_RT = TypeVar("_RT", str, "shellous.Result")
+# Return type for a Command, CmdContext can be `str`, `bytes` or `Result`.
+_RT = TypeVar("_RT", str, bytes, "shellous.Result")
+
+
+class Placeholder(os.PathLike[str]):
+    """Placeholder for an argument in a command template.
+
+    Use `sh.ARG` to mark an argument that is bound later by a
+    `CommandTemplate`. Running a command with an unbound placeholder raises a
+    TypeError.
+    """
+
+    def __fspath__(self) -> str:
+        raise TypeError("command template argument is not bound")
+
+    def __repr__(self) -> str:
+        return "sh.ARG"
+
+    def __reduce__(self) -> str:
+        return "ARG"
+
+
+ARG = Placeholder()
 
 
 @dataclass(frozen=True)
@@ -286,6 +388,12 @@ class CmdContext(Generic[_RT]):
     BUFFER: ClassVar[Redirect] = Redirect.BUFFER
     "Redirect output to a buffer in the Result object. This is the default for stdout/stderr."
 
+    MMAP: ClassVar[Redirect] = Redirect.MMAP
+    "Redirect output to an anonymous file that is memory-mapped into the Result object."
+
+    ARG: ClassVar[Placeholder] = ARG
+    "Placeholder for an argument that is bound later. See `Command.template`."
+
     options: Options = field(default_factory=Options)
     "Default command options."
 
@@ -334,6 +442,7 @@ class CmdContext(Generic[_RT]):
         inherit_env: Unset[bool] = _UNSET,
         encoding: Unset[str] = _UNSET,
         _return_result: Unset[bool] = _UNSET,
+        _return_bytes: Unset[bool] = _UNSET,
         _catch_cancelled_error: Unset[bool] = _UNSET,
         exit_codes: Unset[Optional[Container[int]]] = _UNSET,
         timeout: Unset[Optional[float]] = _UNSET,
@@ -349,6 +458,18 @@ class CmdContext(Generic[_RT]):
         close_fds: Unset[bool] = _UNSET,
         audit_callback: Unset[_AuditFnT] = _UNSET,
         coerce_arg: Unset[_CoerceArgFnT] = _UNSET,
+        launcher: Unset[LauncherT] = _UNSET,
+        max_concurrency: Unset[Union[int, ConcurrencyLimiter, None]] = _UNSET,
+        priority: Unset[int] = _UNSET,
+        input_memfd: Unset[Union[bool, int]] = _UNSET,
+        buffer_spill: Unset[Optional[int]] = _UNSET,
+        max_output: Unset[Optional[int]] = _UNSET,
+        max_output_action: Unset[MaxOutputActionT] = _UNSET,
+        error_head: Unset[int] = _UNSET,
+        error_tail: Unset[int] = _UNSET,
+        codec_offload: Unset[Optional[int]] = _UNSET,
+        stream_limit: Unset[int] = _UNSET,
+        long_lines: Unset[Optional[LongLinesT]] = _UNSET,
     ) -> "CmdContext[_RT]":
         """Return new context with custom options set.
 
@@ -366,15 +487,33 @@ class CmdContext(Generic[_RT]):
 
     @property
     def result(self) -> "CmdContext[shellous.Result]":
-        "Set `_return_result` and `exit_codes`."
+        "Set `_return_result` and `exit_codes`, and clear `_return_bytes`."
         return cast(
             CmdContext[shellous.Result],
             self.set(
                 _return_result=True,
+                _return_bytes=False,
                 exit_codes=range(-255, 256),
             ),
         )
 
+    @property
+    def bytes(self) -> "CmdContext[builtins.bytes]":
+        """Set `_return_bytes` and clear `_return_result`.
+
+        The command returns its output as bytes, without decoding it. If
+        `result` was set, its `exit_codes` are cleared, so a non-zero exit
+        status raises a `ResultError` again.
+        """
+        return cast(
+            CmdContext[bytes],
+            self.set(
+                _return_bytes=True,
+                _return_result=False,
+                exit_codes=_bytes_exit_codes(self.options),
+            ),
+        )
+
     def find_command(self, name: str) -> Optional[Path]:
         """Find the command with the given name and return its filesystem path.
 
@@ -389,6 +528,37 @@ class CmdContext(Generic[_RT]):
             return None
         return Path(result)
 
+    @staticmethod
+    def find_command_cache_info() -> WhichCacheInfo:
+        """Return statistics for the cache used to find commands.
+
+        The cache is shared by `find_command` and by all commands that need to
+        locate their executable in the search path. A cached result remains
+        valid until one of the directories it depends on is modified.
+        """
+        return WHICH_CACHE.cache_info()
+
+    @staticmethod
+    def map(
+        cmd: "Union[Command[Any], CommandTemplate[Any]]",
+        items: MapItemsType,
+        *,
+        limit: int = 8,
+        ordered: bool = True,
+        fail_fast: bool = True,
+    ) -> AsyncIterator[Any]:
+        """Run a command or template for each item, with bounded concurrency.
+
+        ```
+        grep = sh("grep", "-c", sh.ARG, "file").template()
+        async for count in sh.map(grep, patterns, limit=4):
+            print(count)
+        ```
+
+        See `Command.map` and `CommandTemplate.map` for details.
+        """
+        return cmd.map(items, limit=limit, ordered=ordered, fail_fast=fail_fast)
+
 
 @dataclass(frozen=True)
 class Command(Generic[_RT]):
@@ -420,6 +590,45 @@ class Command(Generic[_RT]):
         if len(self.args) == 0:
             raise ValueError("Command must include program name")
 
+    def __getstate__(self) -> dict[str, Any]:
+        "Don't pickle the launch plan; it's specific to this process."
+        return {"args": self.args, "options": self.options}
+
+    @property
+    def launch_plan(self) -> Optional[LaunchPlan]:
+        "@private Return the launch plan if the command was compiled."
+        return self.__dict__.get("_launch_plan")
+
+    def compile(self) -> "Command[_RT]":
+        """Return a copy of the command with a precomputed launch plan.
+
+        A compiled command does not repeat argument preparation, executable
+        lookup, or redirect classification each time it runs. The executable
+        is located when `compile` is called; if it isn't found, it is looked up
+        each time the command runs, as usual.
+
+        A command derived from a compiled one, e.g. by calling `set`, `env` or
+        `result`, is also compiled. It keeps the same launch plan unless its
+        arguments, `path`, redirections, `pty` or `encoding` change.
+        """
+        cmd: Command[_RT] = Command(self.args, self.options)
+        object.__setattr__(cmd, "_launch_plan", compile_plan(cmd))
+        return cmd
+
+    def _derive(
+        self,
+        args: "tuple[Any, ...]",
+        options: Options,
+    ) -> "Command[_RT]":
+        "Return new command with `args` and `options`, compiled if self is."
+        cmd: Command[_RT] = Command(args, options)
+        plan = self.launch_plan
+        if plan is not None:
+            if args is not self.args or _plan_changed(self.options, options):
+                plan = compile_plan(cmd)
+            object.__setattr__(cmd, "_launch_plan", plan)
+        return cmd
+
     @property
     def name(self) -> str:
         """Returns the name of the program being run.
@@ -437,7 +646,7 @@ class Command(Generic[_RT]):
     def stdin(self, input_: Any, *, close: bool = False) -> "Command[_RT]":
         "Pass `input` to command's standard input."
         new_options = self.options.set_stdin(input_, close)
-        return Command(self.args, new_options)
+        return self._derive(self.args, new_options)
 
     def stdout(
         self,
@@ -448,7 +657,7 @@ class Command(Generic[_RT]):
     ) -> "Command[_RT]":
         "Redirect standard output to `output`."
         new_options = self.options.set_stdout(output, append, close)
-        return Command(self.args, new_options)
+        return self._derive(self.args, new_options)
 
     def stderr(
         self,
@@ -459,7 +668,7 @@ class Command(Generic[_RT]):
     ) -> "Command[_RT]":
         "Redirect standard error to `error`."
         new_options = self.options.set_stderr(error, append, close)
-        return Command(self.args, new_options)
+        return self._derive(self.args, new_options)
 
     def env(self, **kwds: Any) -> "Command[_RT]":
         """Return new command with augmented environment.
@@ -471,7 +680,7 @@ class Command(Generic[_RT]):
         To clear the environment, use the `cmd.set(env={})` method.
         """
         new_options = self.options.add_env(kwds)
-        return Command(self.args, new_options)
+        return self._derive(self.args, new_options)
 
     def set(  # pylint: disable=unused-argument, too-many-locals
         self,
@@ -481,6 +690,7 @@ class Command(Generic[_RT]):
         inherit_env: Unset[bool] = _UNSET,
         encoding: Unset[str] = _UNSET,
         _return_result: Unset[bool] = _UNSET,
+        _return_bytes: Unset[bool] = _UNSET,
         _catch_cancelled_error: Unset[bool] = _UNSET,
         exit_codes: Unset[Optional[Container[int]]] = _UNSET,
         timeout: Unset[Optional[float]] = _UNSET,
@@ -496,6 +706,18 @@ class Command(Generic[_RT]):
         close_fds: Unset[bool] = _UNSET,
         audit_callback: Unset[_AuditFnT] = _UNSET,
         coerce_arg: Unset[_CoerceArgFnT] = _UNSET,
+        launcher: Unset[LauncherT] = _UNSET,
+        max_concurrency: Unset[Union[int, ConcurrencyLimiter, None]] = _UNSET,
+        priority: Unset[int] = _UNSET,
+        input_memfd: Unset[Union[bool, int]] = _UNSET,
+        buffer_spill: Unset[Optional[int]] = _UNSET,
+        max_output: Unset[Optional[int]] = _UNSET,
+        max_output_action: Unset[MaxOutputActionT] = _UNSET,
+        error_head: Unset[int] = _UNSET,
+        error_tail: Unset[int] = _UNSET,
+        codec_offload: Unset[Optional[int]] = _UNSET,
+        stream_limit: Unset[int] = _UNSET,
+        long_lines: Unset[Optional[LongLinesT]] = _UNSET,
     ) -> "Command[_RT]":
         """Return new command with custom options set.
 
@@ -528,6 +750,10 @@ class Command(Generic[_RT]):
         When True, return a `Result` object instead of the standard output.
         Private API -- use the `result` modifier instead.
 
+        **_return_bytes** (bool) default=False<br>
+        When True, return the standard output as bytes instead of text.
+        Private API -- use the `bytes` modifier instead.
+
         **_catch_cancelled_error** (bool) default=False<br>
         When True, raise a `ResultError` when the command is cancelled.
         Private API -- used internally by PipeRunner.
@@ -619,19 +845,107 @@ class Command(Generic[_RT]):
 
         The primary use case for `audit_callback` is measuring how long each
         command takes to run and exporting this information to a metrics
-        framework like Prometheus.
+        framework like Prometheus. `shellous.MetricsRegistry` is an audit
+        callback that aggregates these metrics per command name.
 
         **coerce_arg** (Callable(arg) | None) default=None<br>
         Specify a function to call on each command line argument. This function
         can specify how to coerce unsupported argument types (e.g. dict) to
         a sequence of strings. This function should return the original value
         unchanged if there is no conversion needed.
+
+        **launcher** (str) default="asyncio"<br>
+        Name of the process launcher used to start the subprocess. The default
+        "asyncio" launcher uses `asyncio.create_subprocess_exec`. The
+        "posix_spawn" launcher calls `os.posix_spawn` directly, which avoids
+        the cost of `fork()` in a parent process with a large memory footprint.
+        If the command needs a feature that `posix_spawn` can't provide
+        (`pty`, `pass_fds`, `close_fds`), or the platform doesn't support it,
+        shellous falls back to the "asyncio" launcher. The "forkserver"
+        launcher asks a small helper process, started once per event loop, to
+        launch the subprocess; it supports `pass_fds` and `close_fds`, but
+        falls back to "asyncio" for `pty`.
+
+        **max_concurrency** (int | ConcurrencyLimiter | None) default=None<br>
+        Limit the number of commands that run at the same time. Setting an int
+        creates a `ConcurrencyLimiter` that is shared by every command derived
+        from the result. A command waits for a slot before it allocates any
+        file descriptors or launches its process, and releases the slot when
+        the process exits. Time spent waiting doesn't count toward `timeout`.
+
+        **priority** (int) default=0<br>
+        Priority of the command when it waits for a slot from
+        `max_concurrency`. Commands with a higher priority are started first.
+        Commands with the same priority start in FIFO order.
+
+        **input_memfd** (bool | int) default=False<br>
+        Pass `bytes` or `str` input to the subprocess as a sealed, read-only
+        memory file (`memfd_create`) instead of writing it to a pipe. The child
+        gets a seekable stdin, and shellous doesn't need a task to write the
+        input. Set to True to always use a memfd, or set an int to use a memfd
+        only when the input is at least that many bytes. This option is ignored
+        on platforms without `memfd_create` (Linux only) and when `pty` is set.
+
+        **buffer_spill** (int | None) default=None<br>
+        Maximum number of bytes of standard output that `sh.BUFFER` keeps in
+        memory. When the output grows past this size, it moves to an unlinked
+        temporary file, and the rest of the output is appended to the file.
+        The Result's `output_bytes` is then a read-only memoryview of the
+        memory-mapped file, so its pages are only loaded when they are read.
+        None means the output is always kept in memory, and `output_bytes` is
+        `bytes`.
+
+        **max_output** (int | None) default=None<br>
+        Maximum number of bytes of output that `sh.BUFFER` captures from
+        standard output. Captured standard error is also limited to this size,
+        when it is smaller than `error_head` plus `error_tail`. When the output
+        grows past this size, the rest is handled according to
+        `max_output_action`, and the Result's `truncated` attribute is True.
+        None means there is no limit.
+
+        **max_output_action** (str) default="truncate"<br>
+        Action to take when captured output exceeds `max_output`. With
+        "truncate", shellous keeps reading the output to the end and discards
+        it. With "cancel", shellous sends `cancel_signal` to the process right
+        away, so the command usually fails with a `ResultError`.
+
+        **error_head** (int) default=512<br>
+        Number of bytes from the start of standard error that `sh.BUFFER`
+        keeps in the Result's `error_bytes`.
+
+        **error_tail** (int) default=512<br>
+        Number of bytes from the end of standard error that `sh.BUFFER` keeps
+        in the Result's `error_bytes`, after the `error_head` bytes. Output in
+        between is discarded. The Result's `error_size` is the total number
+        of bytes written to standard error.
+
+        **codec_offload** (int | None) default=None<br>
+        Encode `str` input and decode the output string in a worker thread
+        (`asyncio.to_thread`) when they are at least this many characters or
+        bytes. This keeps a large encode or decode from blocking other tasks on
+        the event loop. None means encoding and decoding always run on the
+        event loop. See also `Result.aoutput`.
+
+        **stream_limit** (int) default=65536<br>
+        Buffer limit in bytes for the `asyncio.StreamReader` that reads stdout
+        or stderr (or a pty). A line, record or `Prompt` response longer than
+        the limit is handled according to `long_lines`.
+
+        **long_lines** ("split" | "truncate" | "buffer" | None) default=None<br>
+        How to handle a line that is longer than `stream_limit` when iterating
+        over output lines (including `lines()` batches) or records, or reading
+        a `Prompt` response. "split"
+        returns the line in pieces of `stream_limit` bytes. "truncate" keeps
+        the first `stream_limit` bytes of the line and the line ending, and
+        discards the rest. "buffer" reads the whole line, however long it is.
+        None raises a `ValueError` when iterating over lines, and buffers when
+        reading a `Prompt` response.
         """
         kwargs = locals()
         del kwargs["self"]
         if not encoding:
             raise TypeError("invalid encoding")
-        return Command(self.args, self.options.set(kwargs))
+        return self._derive(self.args, self.options.set(kwargs))
 
     def _replace_args(self, new_args: Sequence[Any]) -> "Command[_RT]":
         """Return new command with arguments replaced by `new_args`.
@@ -641,7 +955,7 @@ class Command(Generic[_RT]):
         """
         assert new_args
         assert new_args[0] is self.args[0]
-        return Command(tuple(new_args), self.options)
+        return self._derive(tuple(new_args), self.options)
 
     def coro(
         self,
@@ -681,12 +995,123 @@ class Command(Generic[_RT]):
             async for line in run:
                 yield line
 
+    def lines(self, *, batch: Optional[int] = None) -> AsyncIterator[list[str]]:
+        """Return async iterator over lists of output lines.
+
+        Each list contains at most `batch` lines. If `batch` is None, each list
+        contains all of the complete lines that were read at once.
+
+        ```
+        async for lines in cmd.lines(batch=1000):
+            process(lines)
+        ```
+        """
+        return aiter_preflight(self)._readlines_batched(batch)
+
+    async def _readlines_batched(
+        self,
+        batch: Optional[int],
+    ) -> AsyncIterator[list[str]]:
+        "Async generator to iterate over lists of lines."
+        async with Runner(self) as run:
+            async for lines in run.iter_lines_batched(batch):
+                yield lines
+
+    def records(
+        self,
+        sep: builtins.bytes = b"\n",
+    ) -> AsyncIterator[builtins.bytes]:
+        """Return async iterator over `sep`-terminated records of output.
+
+        Records are bytes and are not decoded. Use `sep=b"\\0"` for the output
+        of `find -print0`.
+
+        ```
+        async for line in cmd.records():
+            sys.stdout.buffer.write(line)
+        ```
+        """
+        return aiter_preflight(self)._readrecords(sep)
+
+    async def _readrecords(self, sep: builtins.bytes) -> AsyncIterator[builtins.bytes]:
+        "Async generator to iterate over records."
+        async with Runner(self) as run:
+            async for record in run.iter_records(sep):
+                yield record
+
+    def chunks(self, size: int = 8192) -> AsyncIterator[builtins.bytes]:
+        """Return async iterator over fixed-size chunks of output.
+
+        Chunks are bytes and are not decoded. Each chunk is `size` bytes,
+        except possibly the last one.
+        """
+        return aiter_preflight(self)._readchunks(size)
+
+    async def _readchunks(self, size: int) -> AsyncIterator[builtins.bytes]:
+        "Async generator to iterate over chunks."
+        async with Runner(self) as run:
+            async for chunk in run.iter_chunks(size):
+                yield chunk
+
     def __call__(self, *args: Any) -> "Command[_RT]":
         "Apply more arguments to the end of the command."
         if not args:
             return self
         new_args = self.args + coerce(args, self.options.coerce_arg)
-        return Command(new_args, self.options)
+        return self._derive(new_args, self.options)
+
+    def template(self) -> "CommandTemplate[_RT]":
+        """Return a template that binds values to the `sh.ARG` placeholders.
+
+        ```
+        grep = sh("grep", sh.ARG, "file").template()
+        result = await grep("pattern")
+        ```
+
+        The other arguments are coerced once, when the command is created.
+        Bound values are passed through `coerce_arg` like the arguments of
+        `Command.__call__`; a str or bytes value skips the list flattening.
+        """
+        return CommandTemplate(self)
+
+    def map(
+        self,
+        items: MapItemsType,
+        *,
+        limit: int = 8,
+        ordered: bool = True,
+        fail_fast: bool = True,
+        stdin: bool = False,
+    ) -> AsyncIterator[Any]:
+        """Run the command once for each item and yield the results.
+
+        Each item is appended to the command's arguments. If `stdin` is True,
+        each item is used as the command's standard input instead. `items`
+        may be an iterable or an async iterable.
+
+        ```
+        async for result in sh("wc", "-l").map(files, limit=4):
+            print(result)
+        ```
+
+        At most `limit` commands run at the same time. If `ordered` is True,
+        results are yielded in the same order as `items`; otherwise, they are
+        yielded as they complete. If `fail_fast` is True, the first error
+        cancels the remaining commands and is raised; otherwise, exceptions
+        are yielded in place of results. Outstanding commands are cancelled
+        if the iteration stops early.
+        """
+        if stdin:
+            make_cmd: Callable[[Any], Command[_RT]] = self.stdin
+        else:
+            make_cmd = self
+        return fanout(
+            make_cmd,
+            items,
+            limit=limit,
+            ordered=ordered,
+            fail_fast=fail_fast,
+        )
 
     def __str__(self) -> str:
         """Return string representation for command.
@@ -711,6 +1136,13 @@ class Command(Generic[_RT]):
     ) -> "shellous.Pipeline[shellous.Result]":
         ...  # pragma: no cover
 
+    @overload
+    def __or__(
+        self,
+        rhs: "Command[builtins.bytes]",
+    ) -> "shellous.Pipeline[builtins.bytes]":
+        ...  # pragma: no cover
+
     def __or__(self, rhs: Any) -> Any:
         "Bitwise or operator is used to build pipelines."
         if isinstance(rhs, STDOUT_TYPES):
@@ -738,12 +1170,123 @@ class Command(Generic[_RT]):
 
     @property
     def result(self) -> "Command[shellous.Result]":
-        "Set `_return_result` and `exit_codes`."
+        "Set `_return_result` and `exit_codes`, and clear `_return_bytes`."
         return cast(
             Command[shellous.Result],
-            self.set(_return_result=True, exit_codes=range(-255, 256)),
+            self.set(
+                _return_result=True,
+                _return_bytes=False,
+                exit_codes=range(-255, 256),
+            ),
         )
 
+    @property
+    def bytes(self) -> "Command[builtins.bytes]":
+        """Set `_return_bytes` and clear `_return_result`.
+
+        The command returns its output as bytes, without decoding it. Output
+        captured in a memory-mapped file (see `Redirect.MMAP` and
+        `buffer_spill`) is copied into bytes; use `.result` to access the
+        mapping without a copy.
+
+        If `result` was set, its `exit_codes` are cleared, so a non-zero exit
+        status raises a `ResultError` again, like `cmd.bytes`.
+        """
+        return cast(
+            Command[bytes],
+            self.set(
+                _return_bytes=True,
+                _return_result=False,
+                exit_codes=_bytes_exit_codes(self.options),
+            ),
+        )
+
+
+class CommandTemplate(Generic[_RT]):
+    """A command with placeholder arguments.
+
+    Calling the template with one value per placeholder returns a new
+    `Command`. Create a template using `Command.template`.
+    """
+
+    __slots__ = ("_segments", "_options")
+
+    _segments: tuple[tuple[Any, ...], ...]
+    _options: Options
+
+    def __init__(self, command: Command[_RT]):
+        args = command.args
+        slots = [i for i, arg in enumerate(args) if arg is ARG]
+        if not slots:
+            raise ValueError("command template must include a placeholder")
+
+        starts = [0] + [i + 1 for i in slots]
+        ends = [*slots, len(args)]
+        self._segments = tuple(args[i:j] for i, j in zip(starts, ends))
+        self._options = command.options
+
+    @property
+    def arity(self) -> int:
+        "Number of placeholders in the template."
+        return len(self._segments) - 1
+
+    def __call__(self, *values: Any) -> Command[_RT]:
+        "Return a new command with `values` bound to the placeholders."
+        segments = self._segments
+        if len(values) != len(segments) - 1:
+            raise TypeError(
+                f"command template expects {len(segments) - 1} arguments, "
+                f"got {len(values)}"
+            )
+
+        coerce_arg = self._options.coerce_arg
+        args = segments[0]
+        for value, segment in zip(values, segments[1:]):
+            if coerce_arg is not None:
+                value = coerce_arg(value)
+            if isinstance(value, (str, bytes)):
+                args += (value,)
+            else:
+                args += coerce((value,), None)
+            args += segment
+
+        return Command(args, self._options)
+
+    def map(
+        self,
+        items: MapItemsType,
+        *,
+        limit: int = 8,
+        ordered: bool = True,
+        fail_fast: bool = True,
+    ) -> AsyncIterator[Any]:
+        """Bind each item to the template, run it, and yield the results.
+
+        If the template has more than one placeholder, each item must be a
+        tuple of values. See `Command.map` for the other arguments.
+        """
+        if self.arity == 1:
+            make_cmd: Callable[[Any], Command[_RT]] = self
+        else:
+            make_cmd = self._bind_tuple
+        return fanout(
+            make_cmd,
+            items,
+            limit=limit,
+            ordered=ordered,
+            fail_fast=fail_fast,
+        )
+
+    def _bind_tuple(self, values: tuple[Any, ...]) -> Command[_RT]:
+        "Bind a tuple of values to the placeholders."
+        return self(*values)
+
+    def __repr__(self) -> str:
+        args = self._segments[0]
+        for segment in self._segments[1:]:
+            args += (ARG, *segment)
+        return f"CommandTemplate(args={args!r})"
+
 
 def coerce(args: Iterable[Any], coerce_arg: _CoerceArgFnT) -> tuple[Any, ...]:
     """Flatten lists and coerce arguments to string/bytes.
@@ -782,3 +1325,22 @@ def coerce(args: Iterable[Any], coerce_arg: _CoerceArgFnT) -> tuple[Any, ...]:
         else:
             result.append(str(arg))
     return tuple(result)
+
+
+def _bytes_exit_codes(options: Options) -> Optional[Container[int]]:
+    "Return the `exit_codes` for the `bytes` modifier; undo those of `result`."
+    if options._return_result:  # pyright: ignore[reportPrivateUsage]
+        return None
+    return options.exit_codes
+
+
+def _plan_changed(old: Options, new: Options) -> bool:
+    "Return true if `new` options need a different launch plan than `old`."
+    return (
+        old.path != new.path
+        or old.input is not new.input
+        or old.output is not new.output
+        or old.error is not new.error
+        or old.pty is not new.pty
+        or old.encoding != new.encoding
+    )
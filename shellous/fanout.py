@@ -0,0 +1,137 @@
+"Implements the bounded fan-out used by `Command.map` and `CmdContext.map`."
+
+import asyncio
+import collections
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Union,
+)
+
+from shellous.harvest import harvest_results
+from shellous.log import LOG_DETAIL, LOGGER
+
+_DEFAULT_LIMIT = 8
+
+MapItemsType = Union[Iterable[Any], AsyncIterable[Any]]
+
+
+async def fanout(
+    make_cmd: Callable[[Any], Any],
+    items: MapItemsType,
+    *,
+    limit: int = _DEFAULT_LIMIT,
+    ordered: bool = True,
+    fail_fast: bool = True,
+) -> AsyncIterator[Any]:
+    """Run a command for each item and yield the results.
+
+    At most `limit` commands are outstanding at a time. If `ordered` is True,
+    results are yielded in the same order as `items`; otherwise, they are
+    yielded as they complete.
+
+    If `fail_fast` is True, the first command that raises an exception
+    cancels all other commands, and the exception is re-raised. Otherwise,
+    exception objects are yielded in place of results.
+
+    If the iteration is stopped early, or the caller is cancelled, all
+    outstanding commands are cancelled and consumed, using `harvest_results`.
+    """
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    source = _iter_items(items)
+    window: collections.deque[asyncio.Task[Any]] = collections.deque()
+
+    try:
+        async for item in source:
+            window.append(asyncio.create_task(make_cmd(item).coro()))
+            while len(window) >= limit:
+                for task in await _wait_done(window, ordered, fail_fast):
+                    yield _task_result(task, fail_fast)
+
+        while window:
+            for task in await _wait_done(window, ordered, fail_fast):
+                yield _task_result(task, fail_fast)
+
+    finally:
+        if window:
+            if LOG_DETAIL:
+                LOGGER.debug("fanout cancelling %d commands", len(window))
+            for task in window:
+                task.cancel()
+            await harvest_results(*window)
+        await source.aclose()
+
+
+async def _iter_items(items: MapItemsType) -> AsyncGenerator[Any, None]:
+    "Iterate over the items, whether they are sync or async."
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _wait_done(
+    window: "collections.deque[asyncio.Task[Any]]",
+    ordered: bool,
+    fail_fast: bool,
+) -> list[asyncio.Task[Any]]:
+    "Wait for tasks to finish, then remove and return the ones to yield."
+    if ordered:
+        while not window[0].done():
+            if fail_fast:
+                # Wake up when any task finishes, so an error fails fast.
+                pending = [task for task in window if not task.done()]
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                _raise_error(window)
+            else:
+                await asyncio.wait([window[0]])
+    elif not any(task.done() for task in window):
+        await asyncio.wait(window, return_when=asyncio.FIRST_COMPLETED)
+
+    if fail_fast:
+        _raise_error(window)
+
+    return _take_done(window, ordered)
+
+
+def _raise_error(window: "collections.deque[asyncio.Task[Any]]") -> None:
+    "Raise the exception from the first failed task in the window."
+    for task in window:
+        if task.done() and not task.cancelled() and task.exception():
+            raise task.exception()  # type: ignore
+
+
+def _take_done(
+    window: "collections.deque[asyncio.Task[Any]]",
+    ordered: bool,
+) -> list[asyncio.Task[Any]]:
+    "Remove and return the done tasks that are ready to be yielded."
+    done: list[asyncio.Task[Any]] = []
+    if ordered:
+        while window and window[0].done():
+            done.append(window.popleft())
+    else:
+        done = [task for task in window if task.done()]
+        for task in done:
+            window.remove(task)
+    return done
+
+
+def _task_result(task: asyncio.Task[Any], fail_fast: bool) -> Any:
+    "Return the result of a finished task."
+    if task.cancelled():
+        if fail_fast:
+            raise asyncio.CancelledError()
+        return asyncio.CancelledError()
+    ex = task.exception()
+    if ex is not None:
+        return ex
+    return task.result()
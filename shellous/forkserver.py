@@ -0,0 +1,548 @@
+"""Implements the "forkserver" process launcher.
+
+The fork server is a small helper process started once per event loop. The
+parent sends each launch request over a unix socket, passing the child's
+standard file descriptors using SCM_RIGHTS. The helper starts the child using
+`os.posix_spawn`, reaps it, and reports its exit status back to the parent.
+
+The cost of launching a child no longer depends on the memory footprint of the
+parent process.
+"""
+
+import asyncio
+import collections
+import itertools
+import os
+import pickle
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import weakref
+from asyncio.subprocess import Process
+from typing import Any, Callable, Optional
+
+from shellous import spawn
+from shellous.log import LOG_DETAIL, LOGGER
+from shellous.util import environ_data, pop_rusage, record_rusage
+
+# Each message is a 4-byte length followed by a pickled tuple.
+_HEADER = struct.Struct("!I")
+
+# Maximum number of file descriptors passed with a launch request.
+_MAX_FDS = 256
+
+# Exit status reported when the fork server exits unexpectedly.
+_LOST_STATUS = 255
+
+# Python code run by the helper process.
+_BOOTSTRAP = (
+    "import sys; sys.path.insert(0, sys.argv[1]); "
+    "from shellous.forkserver import main; main(int(sys.argv[2]))"
+)
+
+_SERVERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, ForkServer]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def can_forkserver(kwd_args: dict[str, Any]) -> bool:
+    """Return true if the process described by `kwd_args` can be launched by
+    the fork server.
+
+    The fork server cannot run a `preexec_fn` or start a new session. A pty
+    always requires a `preexec_fn`. The child only inherits the standard fd's
+    and `pass_fds`, so `close_fds` is always satisfied.
+    """
+    if sys.platform == "win32" or not hasattr(os, "posix_spawn"):
+        return False  # pragma: no cover
+
+    return not (
+        kwd_args.get("preexec_fn") is not None or kwd_args.get("start_new_session")
+    )
+
+
+class ForkServer:
+    "Client for the fork server helper process."
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        parent_sock, child_sock = socket.socketpair()
+        with child_sock:
+            package_dir = os.path.dirname(os.path.dirname(__file__))
+            # The helper is closed by `_close_helper`.
+            self._helper = subprocess.Popen(  # pylint: disable=consider-using-with
+                [
+                    sys.executable,
+                    "-I",
+                    "-c",
+                    _BOOTSTRAP,
+                    package_dir,
+                    str(child_sock.fileno()),
+                ],
+                stdin=subprocess.DEVNULL,
+                pass_fds=[child_sock.fileno()],
+            )
+
+        parent_sock.setblocking(False)
+        self._loop = loop
+        self._sock = parent_sock
+        self._buffer = bytearray()
+        self._outgoing: collections.deque[
+            tuple[memoryview, list[int]]
+        ] = collections.deque()
+        self._writing = False
+        self._request_ids = itertools.count(1)
+        self._waiters: dict[int, asyncio.Future[int]] = {}
+        self._exit_handlers: dict[int, Callable[[int], None]] = {}
+        self._exits: dict[int, int] = {}
+        self._closed = False
+
+        loop.add_reader(parent_sock.fileno(), self._read_ready, loop)
+        self._finalizer = weakref.finalize(
+            loop, _close_helper, parent_sock, self._helper
+        )
+
+        if LOG_DETAIL:
+            LOGGER.debug("ForkServer started pid=%r", self._helper.pid)
+
+    @property
+    def pid(self) -> int:
+        "Process ID of the helper process."
+        return self._helper.pid
+
+    async def spawn(
+        self,
+        args: list[Any],
+        env: Optional[dict[Any, Any]],
+        sources: list[Any],
+        pass_fds: list[int],
+    ) -> int:
+        """Ask the helper to launch a process and return its pid.
+
+        `sources` is the list returned by `spawn.open_stdio`.
+        """
+        if self._closed:
+            raise RuntimeError("fork server is closed")
+
+        actions: list[tuple[int, int]] = []
+        fds: list[int] = []
+        for target, source in enumerate(sources):
+            if source is None:
+                source = target  # inherit parent's fd explicitly
+            if source in (subprocess.DEVNULL, subprocess.STDOUT):
+                actions.append((target, source))
+            else:
+                actions.append((target, len(fds)))
+                fds.append(source)
+
+        for fdesc in pass_fds:
+            actions.append((fdesc, len(fds)))
+            fds.append(fdesc)
+
+        if len(fds) > _MAX_FDS:
+            raise ValueError("too many file descriptors for fork server")
+
+        argv = [os.fsdecode(arg) for arg in args]
+        if env is None:
+            env = environ_data()
+
+        request_id = next(self._request_ids)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[request_id] = waiter
+        self._send(("spawn", request_id, argv, env, actions), fds)
+
+        try:
+            return await waiter
+        finally:
+            self._waiters.pop(request_id, None)
+
+    def watch(self, pid: int, callback: Callable[[int], None]) -> None:
+        "Call `callback(status)` when the process exits."
+        status = self._exits.pop(pid, None)
+        if status is not None:
+            callback(status)
+        else:
+            self._exit_handlers[pid] = callback
+
+    def send_signal(self, pid: int, sig: int) -> None:
+        "Ask the helper to send a signal to one of its children."
+        if not self._closed:
+            self._send(("signal", pid, sig))
+
+    def close(self) -> None:
+        """Close the connection to the helper process and wait for it to exit.
+
+        Children that are still running are not reaped by the parent.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._shutdown()
+
+    def _shutdown(self) -> None:
+        "Stop reading and writing, close the helper and fail pending requests."
+        self._loop.remove_reader(self._sock.fileno())
+        if self._writing:
+            self._loop.remove_writer(self._sock.fileno())
+            self._writing = False
+        self._outgoing.clear()
+        self._finalizer()
+        self._fail_all()
+
+    def _send(self, msg: tuple[Any, ...], fds: Optional[list[int]] = None) -> None:
+        """Send a message to the helper process.
+
+        The socket is non-blocking. Data that can't be sent right away is
+        queued and sent when the socket is writable, so a large message or a
+        slow helper doesn't block the event loop.
+        """
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        # The fd's are sent along with the header.
+        self._outgoing.append((memoryview(_HEADER.pack(len(data))), fds or []))
+        self._outgoing.append((memoryview(data), []))
+        if not self._writing:
+            self._write_ready()
+
+    def _write_ready(self) -> None:
+        "Send as much queued data as the socket will accept."
+        outgoing = self._outgoing
+        try:
+            while outgoing:
+                data, fds = outgoing[0]
+                if fds:
+                    sent = socket.send_fds(self._sock, [data], fds)
+                else:
+                    sent = self._sock.send(data)
+                if sent < len(data):
+                    # Any fd's were sent with the first part of the data.
+                    outgoing[0] = (data[sent:], [])
+                else:
+                    outgoing.popleft()
+        except BlockingIOError:
+            pass
+        except ConnectionError:  # pragma: no cover
+            # The helper exited; `_read_ready` will see EOF.
+            outgoing.clear()
+
+        if outgoing and not self._writing:
+            self._loop.add_writer(self._sock.fileno(), self._write_ready)
+            self._writing = True
+        elif not outgoing and self._writing:
+            self._loop.remove_writer(self._sock.fileno())
+            self._writing = False
+
+    def _read_ready(self, loop: asyncio.AbstractEventLoop) -> None:
+        "Called by the event loop when the helper sends us a message."
+        try:
+            data = self._sock.recv(65536)
+        except BlockingIOError:  # pragma: no cover
+            return
+        except ConnectionError:  # pragma: no cover
+            data = b""
+
+        if not data:
+            LOGGER.error("ForkServer helper exited unexpectedly")
+            self._closed = True
+            _SERVERS.pop(loop, None)
+            self._shutdown()
+            return
+
+        buf = self._buffer
+        buf += data
+        while len(buf) >= _HEADER.size:
+            (size,) = _HEADER.unpack_from(buf)
+            end = _HEADER.size + size
+            if len(buf) < end:
+                break
+            msg = pickle.loads(buf[_HEADER.size : end])
+            del buf[:end]
+            self._dispatch(msg)
+
+    def _dispatch(self, msg: tuple[Any, ...]) -> None:
+        "Handle a message from the helper process."
+        if msg[0] == "exited":
+            _, pid, status, rusage = msg
+            if rusage is not None:
+                record_rusage(pid, rusage)
+            handler = self._exit_handlers.pop(pid, None)
+            if handler is not None:
+                handler(status)
+            else:
+                self._exits[pid] = status
+            return
+
+        _, request_id, value = msg
+        waiter = self._waiters.get(request_id)
+        if waiter is None or waiter.done():
+            # The caller was cancelled. Don't leave the process running.
+            if msg[0] == "spawned":
+                self.send_signal(value, signal.SIGKILL)
+                self._exit_handlers[value] = _discard_rusage(value)
+        elif msg[0] == "spawned":
+            waiter.set_result(value)
+        else:
+            waiter.set_exception(value)
+
+    def _fail_all(self) -> None:
+        "Report all pending requests and running processes as failed."
+        for waiter in self._waiters.values():
+            if not waiter.done():
+                waiter.set_exception(RuntimeError("fork server exited"))
+        handlers = list(self._exit_handlers.values())
+        self._exit_handlers.clear()
+        for handler in handlers:
+            handler(_LOST_STATUS)
+
+
+def _discard_rusage(pid: int) -> Callable[[int], None]:
+    "Return an exit handler that discards the resource usage of `pid`."
+
+    def _exited(_status: int) -> None:
+        pop_rusage(pid)
+
+    return _exited
+
+
+def _close_helper(sock: socket.socket, helper: "subprocess.Popen[bytes]") -> None:
+    "Close our end of the socket; the helper exits when it reads EOF."
+    sock.close()
+    helper.wait()
+
+
+def get_forkserver() -> ForkServer:
+    "Return the fork server for the running event loop, starting it if needed."
+    loop = asyncio.get_running_loop()
+    server = _SERVERS.get(loop)
+    if server is None:
+        server = ForkServer(loop)
+        _SERVERS[loop] = server
+    return server
+
+
+def close_forkserver() -> None:
+    "Shut down the fork server for the running event loop, if there is one."
+    server = _SERVERS.pop(asyncio.get_running_loop(), None)
+    if server is not None:
+        server.close()
+
+
+class _ForkServerProcess(spawn.SpawnedProcess):
+    "Popen look-alike for a process launched by the fork server."
+
+    def __init__(self, pid: int, files: list[Any], server: ForkServer):
+        super().__init__(pid, files)
+        self._server = server
+
+    def send_signal(self, sig: int) -> None:
+        "Send a signal to the process if it has not been reaped."
+        if self.returncode is None:
+            self._server.send_signal(self.pid, sig)
+
+    def watch(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        transport: spawn.SpawnTransport,
+    ) -> None:
+        "Arrange for `transport` to be notified when the process exits."
+
+        def _exited(status: int) -> None:
+            loop.call_soon(
+                transport._process_exited,  # pyright: ignore[reportPrivateUsage]
+                status,
+            )
+
+        self._server.watch(self.pid, _exited)
+
+
+async def create_subprocess_forkserver(
+    *args: Any,
+    stdin: Any = None,
+    stdout: Any = None,
+    stderr: Any = None,
+    env: Optional[dict[Any, Any]] = None,
+    pass_fds: Any = (),
+    sinks: Optional[spawn.SinkMap] = None,
+    limit: int = spawn.DEFAULT_LIMIT,
+    **_kwds: Any,
+) -> Process:
+    """Launch a process using the fork server.
+
+    This is a drop-in replacement for `asyncio.create_subprocess_exec` when
+    `can_forkserver` returns True for the keyword arguments.
+    """
+    server = get_forkserver()
+
+    async def _launch(sources: list[Any], files: list[Any]) -> _ForkServerProcess:
+        pid = await server.spawn(list(args), env, sources, list(pass_fds))
+        if LOG_DETAIL:
+            LOGGER.debug("forkserver spawn %r pid=%r", args[0], pid)
+        return _ForkServerProcess(pid, files, server)
+
+    return await spawn.launch_process(
+        _launch, list(args), (stdin, stdout, stderr), sinks, limit
+    )
+
+
+def main(fdesc: int) -> None:
+    "Run the fork server helper process, communicating over socket `fdesc`."
+    # Ctrl-C is handled by the parent process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    with socket.socket(fileno=fdesc) as sock:
+        _Helper(sock).serve()
+
+
+def _ignore_signal(_signum: int, _frame: Any) -> None:
+    "Signal handler that does nothing; SIGCHLD only wakes up `select`."
+
+
+class _Helper:
+    "Implements the fork server helper process."
+
+    def __init__(self, sock: socket.socket):
+        self._sock = sock
+        self._children: set[int] = set()
+        self._outgoing = bytearray()
+
+    def serve(self) -> None:
+        "Handle requests until the parent closes the socket."
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        os.set_blocking(wakeup_write, False)
+        signal.set_wakeup_fd(wakeup_write)
+        signal.signal(signal.SIGCHLD, _ignore_signal)
+
+        while True:
+            wlist = [self._sock] if self._outgoing else []
+            readable, writable, _ = select.select([self._sock, wakeup_read], wlist, [])
+
+            if wakeup_read in readable:
+                try:
+                    os.read(wakeup_read, 512)
+                except BlockingIOError:  # pragma: no cover
+                    pass
+                self._reap_children()
+
+            if self._sock in readable:
+                request = self._recv()
+                if request is None:
+                    break
+                self._handle(*request)
+
+            if writable or self._outgoing:
+                self._flush()
+
+    def _recv(self) -> Optional[tuple[tuple[Any, ...], list[int]]]:
+        "Read the next request and any file descriptors sent with it."
+        header, fds, _flags, _addr = socket.recv_fds(self._sock, _HEADER.size, _MAX_FDS)
+        if not header:
+            return None
+        while len(header) < _HEADER.size:  # pragma: no cover
+            header += self._recv_exactly(_HEADER.size - len(header))
+        (size,) = _HEADER.unpack(header)
+        return pickle.loads(self._recv_exactly(size)), fds
+
+    def _recv_exactly(self, size: int) -> bytes:
+        "Read exactly `size` bytes from the socket."
+        chunks: list[bytes] = []
+        while size > 0:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                raise EOFError("fork server socket closed")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _handle(self, msg: tuple[Any, ...], fds: list[int]) -> None:
+        "Handle a request from the parent."
+        if msg[0] == "spawn":
+            _, request_id, argv, env, actions = msg
+            try:
+                pid = self._spawn(argv, env, actions, fds)
+            except Exception as ex:  # pylint: disable=broad-except
+                self._reply(("error", request_id, ex))
+            else:
+                self._children.add(pid)
+                self._reply(("spawned", request_id, pid))
+
+        elif msg[0] == "signal":
+            _, pid, sig = msg
+            if pid in self._children:
+                os.kill(pid, sig)
+
+    def _spawn(
+        self,
+        argv: list[str],
+        env: dict[Any, Any],
+        actions: list[tuple[int, int]],
+        fds: list[int],
+    ) -> int:
+        "Launch a child process and return its pid."
+        # The helper only runs on posix platforms, where fcntl is available.
+        import fcntl  # pylint: disable=import-outside-toplevel
+
+        # Move the received fd's above every target fd so the dup2 actions
+        # can't clobber each other.
+        base = max(max(target for target, _ in actions) + 1, 3)
+        high_fds: list[int] = []
+        try:
+            for fdesc in fds:
+                high_fds.append(fcntl.fcntl(fdesc, fcntl.F_DUPFD_CLOEXEC, base))
+
+            file_actions: list[tuple[Any, ...]] = []
+            for target, source in actions:
+                if source == subprocess.DEVNULL:
+                    flags = os.O_RDONLY if target == 0 else os.O_WRONLY
+                    file_actions.append(
+                        (os.POSIX_SPAWN_OPEN, target, os.devnull, flags, 0)
+                    )
+                elif source == subprocess.STDOUT:
+                    file_actions.append((os.POSIX_SPAWN_DUP2, 1, target))
+                else:
+                    file_actions.append((os.POSIX_SPAWN_DUP2, high_fds[source], target))
+
+            return os.posix_spawn(
+                argv[0],
+                argv,
+                env,
+                file_actions=file_actions,
+                setsigdef=(*spawn.RESTORE_SIGNALS, signal.SIGINT),
+            )
+
+        finally:
+            for fdesc in fds + high_fds:
+                os.close(fdesc)
+
+    def _reap_children(self) -> None:
+        "Reap exited children and report their exit status to the parent."
+        while self._children:
+            rusage = None
+            try:
+                if hasattr(os, "wait4"):
+                    pid, status, rusage = os.wait4(-1, os.WNOHANG)
+                else:
+                    pid, status = os.waitpid(-1, os.WNOHANG)  # pragma: no cover
+            except ChildProcessError:  # pragma: no cover
+                break
+            if pid == 0:
+                break
+            self._children.discard(pid)
+            exit_code = os.waitstatus_to_exitcode(status)
+            self._reply(("exited", pid, exit_code, rusage))
+
+    def _reply(self, msg: tuple[Any, ...]) -> None:
+        "Queue a message for the parent."
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        self._outgoing += _HEADER.pack(len(data))
+        self._outgoing += data
+
+    def _flush(self) -> None:
+        "Send queued messages without blocking."
+        while self._outgoing:
+            try:
+                sent = self._sock.send(self._outgoing, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            del self._outgoing[:sent]
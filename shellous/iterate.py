@@ -0,0 +1,334 @@
+"Implements async iterators over the output of a running command."
+
+import abc
+import asyncio
+import re
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+
+from shellous.log import LOG_DETAIL, log_method
+from shellous.redirect import LongLinesT
+from shellous.util import decode_bytes, incremental_decoder
+
+if TYPE_CHECKING:
+    import shellous
+
+_CHUNK_SIZE = 8192
+_BATCH_CHUNK_SIZE = 65536
+_LINE_REGEX = re.compile(r"[^\n]*\n")
+
+
+class OutputIterator(abc.ABC):
+    """Base class to iterate over the stdout/stderr of a Runner or PipeRunner.
+
+    Subclasses implement `_iter_options` to supply the encoding and options.
+    """
+
+    stdout: Optional[asyncio.StreamReader]
+    stderr: Optional[asyncio.StreamReader]
+
+    @abc.abstractmethod
+    def _iter_options(self) -> "tuple[str, shellous.Options]":
+        "Return the encoding and options used to read the output."
+
+    async def _readlines(self) -> AsyncIterator[str]:
+        "Iterate over lines in stdout/stderr"
+        stream = self.stdout or self.stderr
+        if stream:
+            encoding, options = self._iter_options()
+            async for line in read_lines(
+                stream,
+                encoding,
+                options.stream_limit,
+                options.long_lines,
+            ):
+                yield line
+
+    async def iter_lines_batched(
+        self,
+        batch: Optional[int] = None,
+    ) -> AsyncIterator[list[str]]:
+        """Iterate over lists of lines in stdout/stderr.
+
+        Each list contains at most `batch` lines. If `batch` is None, each list
+        contains the complete lines from one read of the stream.
+        """
+        stream = self.stdout or self.stderr
+        if stream:
+            encoding, options = self._iter_options()
+            async for lines in read_line_batches(
+                stream,
+                encoding,
+                batch,
+                options.stream_limit,
+                options.long_lines,
+            ):
+                yield lines
+
+    async def iter_records(self, sep: bytes = b"\n") -> AsyncIterator[bytes]:
+        """Iterate over `sep`-terminated records in stdout/stderr.
+
+        Records are not decoded. Each record includes the trailing `sep`,
+        except possibly the last one.
+        """
+        stream = self.stdout or self.stderr
+        if stream:
+            _, options = self._iter_options()
+            async for record in read_records(
+                stream,
+                sep,
+                options.stream_limit,
+                options.long_lines,
+            ):
+                yield record
+
+    async def iter_chunks(self, size: int = 8192) -> AsyncIterator[bytes]:
+        """Iterate over fixed-size chunks of stdout/stderr.
+
+        Chunks are not decoded. Each chunk is `size` bytes, except possibly
+        the last one.
+        """
+        stream = self.stdout or self.stderr
+        if stream:
+            async for chunk in read_chunks(stream, size):
+                yield chunk
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        "Return asynchronous iterator over stdout/stderr."
+        return self._readlines()
+
+
+async def read_until(
+    source: asyncio.StreamReader,
+    sep: bytes,
+    limit: int,
+    long_lines: Optional[LongLinesT] = None,
+) -> bytes:
+    """Read from stream up to and including `sep`.
+
+    Return the partial record at EOF, or b"" if there is no more data. A record
+    longer than `limit` (the stream's limit) is handled according to
+    `long_lines`; None raises a ValueError.
+    """
+    try:
+        # Most reads complete without special handling.
+        return await source.readuntil(sep)
+    except asyncio.IncompleteReadError as ex:
+        return ex.partial
+    except asyncio.LimitOverrunError as ex:
+        if long_lines is None:
+            raise ValueError(ex.args[0]) from ex
+        if long_lines == "split":
+            return await source.read(limit)
+        if long_lines == "truncate":
+            record = await source.read(limit)
+            return record + await _skip_until(source, sep)
+        buf = bytearray(await source.read(ex.consumed))
+
+    while True:
+        try:
+            buf.extend(await source.readuntil(sep))
+        except asyncio.IncompleteReadError as ex:
+            buf.extend(ex.partial)
+        except asyncio.LimitOverrunError as ex:
+            buf.extend(await source.read(ex.consumed))
+            continue
+        return bytes(buf)
+
+
+async def _skip_until(source: asyncio.StreamReader, sep: bytes) -> bytes:
+    'Discard data from stream up to `sep`; return `sep`, or b"" at EOF.'
+    while True:
+        try:
+            await source.readuntil(sep)
+            return sep
+        except asyncio.IncompleteReadError:
+            return b""
+        except asyncio.LimitOverrunError as ex:
+            await source.read(ex.consumed)
+
+
+@log_method(LOG_DETAIL)
+async def read_lines(
+    source: asyncio.StreamReader,
+    encoding: str,
+    limit: int = 2**16,
+    long_lines: Optional[LongLinesT] = None,
+):
+    "Async iterator over lines in stream."
+    if long_lines is None:
+        async for line in source:
+            yield decode_bytes(line, encoding)
+        return
+
+    # The pieces of a split line may divide a code point.
+    decoder = incremental_decoder(encoding)
+    while True:
+        line = await read_until(source, b"\n", limit, long_lines)
+        if not line:
+            break
+        if long_lines == "truncate" and line.endswith(b"\n"):
+            # Drop the partial code point at the end of a truncated line.
+            text = decoder.decode(line[:-1]) + "\n"
+            decoder.reset()
+        else:
+            text = decoder.decode(line)
+        if text:
+            yield text
+
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+@log_method(LOG_DETAIL)
+async def read_records(
+    source: asyncio.StreamReader,
+    sep: bytes = b"\n",
+    limit: int = 2**16,
+    long_lines: Optional[LongLinesT] = None,
+):
+    """Async iterator over records in stream, without decoding.
+
+    Each record includes the trailing `sep`, except possibly the last one.
+    """
+    if not sep:
+        raise ValueError("sep must not be empty")
+    while True:
+        record = await read_until(source, sep, limit, long_lines)
+        if not record:
+            break
+        yield record
+
+
+@log_method(LOG_DETAIL)
+async def read_chunks(source: asyncio.StreamReader, size: int = _CHUNK_SIZE):
+    """Async iterator over fixed-size chunks in stream, without decoding.
+
+    Each chunk is exactly `size` bytes, except possibly the last one.
+    """
+    if size <= 0:
+        raise ValueError("size must be positive")
+    while True:
+        try:
+            yield await source.readexactly(size)
+        except asyncio.IncompleteReadError as ex:
+            if ex.partial:
+                yield ex.partial
+            break
+
+
+@log_method(LOG_DETAIL)
+async def read_line_batches(
+    source: asyncio.StreamReader,
+    encoding: str,
+    batch: Optional[int] = None,
+    limit: int = 2**16,
+    long_lines: Optional[LongLinesT] = None,
+):
+    """Async iterator over lists of lines in stream.
+
+    Each read from the stream is split into lines all at once. A list contains
+    at most `batch` lines; if `batch` is None, a list contains all the complete
+    lines from one read. Lines longer than `limit` are handled according to
+    `long_lines`, the same as `read_lines`.
+    """
+    # Each read is at most `limit` bytes, so only the first line in `pending`
+    # can be longer than the limit.
+    chunk_size = min(_BATCH_CHUNK_SIZE, limit)
+    splitter = _LineSplitter(encoding, limit, long_lines)
+
+    while data := await source.read(chunk_size):
+        lines = splitter.split(data)
+        if not lines:
+            continue
+        if batch is None:
+            yield lines
+        else:
+            for i in range(0, len(lines), batch):
+                yield lines[i : i + batch]
+
+    text = splitter.finish()
+    if text:
+        yield [text]
+
+
+class _LineSplitter:
+    "Splits the data read by `read_line_batches` into decoded lines."
+
+    __slots__ = ("limit", "long_lines", "decoder", "pending", "truncated")
+
+    def __init__(self, encoding: str, limit: int, long_lines: Optional[LongLinesT]):
+        self.limit = limit
+        self.long_lines = long_lines
+        self.decoder = incremental_decoder(encoding)
+        self.pending = bytearray()
+        self.truncated: Optional[bytes] = None
+
+    def split(self, data: bytes) -> list[str]:
+        "Add `data` and return the complete lines."
+        self.pending += data
+        lines: list[str] = []
+        if self.long_lines != "buffer":
+            # Buffered long lines are left in `pending` until complete.
+            self._split_long_lines(lines)
+
+        end = self.pending.rfind(b"\n") + 1
+        if end:
+            lines += _LINE_REGEX.findall(self.decoder.decode(self.pending[:end]))
+            del self.pending[:end]
+        return lines
+
+    def finish(self) -> str:
+        "Return the remaining text at EOF."
+        text = ""
+        if self.truncated is not None:
+            text = self.decoder.decode(self.truncated)
+            self.decoder.reset()
+        return text + self.decoder.decode(bytes(self.pending), final=True)
+
+    def _split_long_lines(self, lines: list[str]) -> None:
+        "Handle the lines longer than `limit` at the start of `pending`."
+        while self._skip_truncated(lines):
+            size = self.pending.find(b"\n")
+            found = size >= 0
+            if not found:
+                size = len(self.pending)
+            if size <= self.limit:
+                break
+            if self.long_lines == "split":
+                self._split_line(lines)
+            elif self.long_lines == "truncate":
+                self._truncate_line()
+            elif found:
+                raise ValueError("Separator is found, but chunk is longer than limit")
+            else:
+                raise ValueError("Separator is not found, and chunk exceed the limit")
+
+    def _split_line(self, lines: list[str]) -> None:
+        "Split off the first `limit` bytes of a long line."
+        text = self.decoder.decode(self.pending[: self.limit])
+        if text:
+            lines.append(text)
+        del self.pending[: self.limit]
+
+    def _truncate_line(self) -> None:
+        "Keep the first `limit` bytes of a long line; discard the rest later."
+        self.truncated = bytes(self.pending[: self.limit])
+        del self.pending[: self.limit]
+
+    def _skip_truncated(self, lines: list[str]) -> bool:
+        """Discard the rest of a truncated line, and add it to `lines`.
+
+        Return False if the end of the truncated line has not been read yet.
+        """
+        if self.truncated is None:
+            return True
+        end = self.pending.find(b"\n") + 1
+        if not end:
+            self.pending.clear()
+            return False
+        del self.pending[:end]
+        lines.append(self.decoder.decode(self.truncated) + "\n")
+        self.decoder.reset()
+        self.truncated = None
+        return True
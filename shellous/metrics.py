@@ -0,0 +1,405 @@
+"""Implements an optional metrics registry fed by `audit_callback`.
+
+```python
+metrics = MetricsRegistry()
+sh1 = sh.set(audit_callback=metrics)
+...
+print(metrics.export_prometheus())
+```
+"""
+
+import asyncio
+import bisect
+import copy
+import math
+from dataclasses import dataclass, field
+from typing import Any, Optional, Sequence
+
+import shellous
+from shellous.log import LOGGER
+
+DEFAULT_BUCKETS: tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+"Default upper bounds (in seconds) of the histogram buckets."
+
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_METRICS_PATHS = (b"/", b"/metrics")
+_HTTP_READ_TIMEOUT = 10.0
+
+
+@dataclass
+class Histogram:
+    "Histogram of observed values, using fixed bucket upper bounds."
+
+    bounds: tuple[float, ...] = DEFAULT_BUCKETS
+    "Upper bounds of the buckets, in increasing order."
+
+    counts: list[int] = field(init=False)
+    "Number of observations in each bucket; the last bucket is +Inf."
+
+    sum: float = 0.0
+    "Sum of all observed values."
+
+    def __post_init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+
+    @property
+    def count(self) -> int:
+        "Number of observations."
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        "Record an observation."
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def quantile(self, fraction: float) -> Optional[float]:
+        """Estimate the quantile at `fraction` (0 <= fraction <= 1).
+
+        The estimate interpolates linearly within a bucket, like Prometheus's
+        `histogram_quantile`. Return None if there are no observations.
+        """
+        total = self.count
+        if total == 0:
+            return None
+
+        rank = fraction * total
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if i == len(self.bounds):
+                    # Value is in the +Inf bucket; return the highest bound.
+                    return self.bounds[-1] if self.bounds else math.inf
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+
+        return None  # pragma: no cover
+
+    def cumulative_counts(self) -> list[tuple[float, int]]:
+        "Return a list of (upper bound, cumulative count), ending with +Inf."
+        result: list[tuple[float, int]] = []
+        cumulative = 0
+        for bound, count in zip((*self.bounds, math.inf), self.counts):
+            cumulative += count
+            result.append((bound, cumulative))
+        return result
+
+
+@dataclass
+class CommandMetrics:
+    "Metrics for all commands with the same name."
+
+    started: int = 0
+    "Number of commands started."
+
+    stopped: int = 0
+    "Number of commands stopped, including launch failures."
+
+    launch_failures: int = 0
+    "Number of commands that failed to launch."
+
+    timeouts: int = 0
+    "Number of commands cancelled because their `timeout` expired."
+
+    cancellations: int = 0
+    "Number of commands cancelled, not counting timeouts."
+
+    signals: int = 0
+    "Number of signals sent to commands."
+
+    input_bytes: int = 0
+    "Number of bytes of input provided by `stdin()`."
+
+    output_bytes: int = 0
+    "Number of bytes read from stdout and stderr pipes."
+
+    exit_codes: dict[int, int] = field(default_factory=dict[int, int])
+    "Number of commands that exited with each exit code."
+
+    spawn_latency: Histogram = field(default_factory=Histogram)
+    "Seconds spent launching the process."
+
+    wall_time: Histogram = field(default_factory=Histogram)
+    "Seconds from start to close, including any wait for a concurrency slot."
+
+    @property
+    def running(self) -> int:
+        "Number of commands currently running."
+        return self.started - self.stopped
+
+
+class MetricsRegistry:
+    """Aggregates per-command metrics from `audit_callback` events.
+
+    A MetricsRegistry is callable; use it as the audit callback:
+    `sh.set(audit_callback=registry)`. To use it alongside another audit
+    callback, call the registry from your own callback function.
+
+    Metrics are grouped by `Command.name`.
+    """
+
+    _buckets: tuple[float, ...]
+    _commands: dict[str, CommandMetrics]
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        self._commands = {}
+
+    def __call__(self, phase: str, info: "shellous.AuditEventInfo") -> None:
+        "Update metrics for an audit callback event."
+        runner = info["runner"]
+        metrics = self._metrics(runner.name)
+
+        if phase == "start":
+            metrics.started += 1
+        elif phase == "signal":
+            metrics.signals += 1
+        elif phase == "stop":
+            self._stopped(metrics, runner, info["failure"])
+
+    def snapshot(self) -> dict[str, CommandMetrics]:
+        "Return a copy of the current metrics, keyed by command name."
+        return copy.deepcopy(self._commands)
+
+    def reset(self) -> None:
+        "Discard all metrics."
+        self._commands.clear()
+
+    def export_prometheus(self) -> str:
+        "Return the current metrics in the Prometheus text exposition format."
+        lines: list[str] = []
+        commands = sorted(self._commands.items())
+
+        for name, attr, kind, help_text in _COUNTERS:
+            _header(lines, name, kind, help_text)
+            for cmd, metrics in commands:
+                value = getattr(metrics, attr)
+                lines.append(f"{name}{{command={_quote(cmd)}}} {value}")
+
+        name = "shellous_command_exits_total"
+        _header(lines, name, "counter", "Commands that exited, by exit code.")
+        for cmd, metrics in commands:
+            for code, value in sorted(metrics.exit_codes.items()):
+                labels = f"command={_quote(cmd)},exit_code={_quote(str(code))}"
+                lines.append(f"{name}{{{labels}}} {value}")
+
+        for name, attr, help_text in _HISTOGRAMS:
+            _header(lines, name, "histogram", help_text)
+            for cmd, metrics in commands:
+                hist: Histogram = getattr(metrics, attr)
+                label = f"command={_quote(cmd)}"
+                for bound, value in hist.cumulative_counts():
+                    lines.append(
+                        f'{name}_bucket{{{label},le="{_format_float(bound)}"}} {value}'
+                    )
+                lines.append(f"{name}_sum{{{label}}} {_format_float(hist.sum)}")
+                lines.append(f"{name}_count{{{label}}} {hist.count}")
+
+        return "\n".join(lines) + "\n"
+
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ) -> asyncio.AbstractServer:
+        """Serve the metrics over HTTP at `/metrics`.
+
+        The server listens on localhost by default. Use port 0 to pick an
+        unused port. Close the returned server to stop serving.
+        """
+        return await asyncio.start_server(self._handle_http, host, port)
+
+    def _metrics(self, name: str) -> CommandMetrics:
+        "Return the metrics for command `name`."
+        metrics = self._commands.get(name)
+        if metrics is None:
+            metrics = CommandMetrics(
+                spawn_latency=Histogram(self._buckets),
+                wall_time=Histogram(self._buckets),
+            )
+            self._commands[name] = metrics
+        return metrics
+
+    def _stopped(
+        self,
+        metrics: CommandMetrics,
+        runner: "shellous.Runner",
+        failure: str,
+    ) -> None:
+        "Update metrics when a command stops."
+        metrics.stopped += 1
+
+        if runner.timed_out:
+            metrics.timeouts += 1
+        elif runner.cancelled:
+            metrics.cancellations += 1
+        elif failure:
+            metrics.launch_failures += 1
+
+        code = runner.returncode
+        if code is not None and not failure:
+            metrics.exit_codes[code] = metrics.exit_codes.get(code, 0) + 1
+
+        timing = runner.timing
+        if timing.spawn_time is not None:
+            metrics.spawn_latency.observe(timing.spawn_time)
+        if timing.total_time is not None:
+            metrics.wall_time.observe(timing.total_time)
+
+        metrics.input_bytes += runner.input_size
+        metrics.output_bytes += runner.bytes_received
+
+    async def _handle_http(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        "Handle a single HTTP request."
+        try:
+            # Don't let a client that never finishes its request hold the
+            # connection open.
+            request = await asyncio.wait_for(
+                _read_request(reader),
+                _HTTP_READ_TIMEOUT,
+            )
+
+            parts = request.split()
+            if (
+                len(parts) >= 2
+                and parts[0] == b"GET"
+                and parts[1].split(b"?")[0] in _METRICS_PATHS
+            ):
+                status = "200 OK"
+                body = self.export_prometheus().encode()
+            else:
+                status = "404 Not Found"
+                body = b"Not Found\n"
+
+            header = (
+                f"HTTP/1.0 {status}\r\n"
+                f"Content-Type: {_CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(header.encode() + body)
+            await writer.drain()
+
+        except (ConnectionError, ValueError, asyncio.TimeoutError) as ex:
+            LOGGER.warning("MetricsRegistry http ex=%r", ex)
+
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError as ex:
+                LOGGER.warning("MetricsRegistry http ex=%r", ex)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> bytes:
+    "Read the HTTP request line, and skip the request headers."
+    request = await reader.readline()
+    while (await reader.readline()).strip():
+        pass
+    return request
+
+
+_COUNTERS = (
+    (
+        "shellous_command_started_total",
+        "started",
+        "counter",
+        "Commands started.",
+    ),
+    (
+        "shellous_command_running",
+        "running",
+        "gauge",
+        "Commands currently running.",
+    ),
+    (
+        "shellous_command_launch_failures_total",
+        "launch_failures",
+        "counter",
+        "Commands that failed to launch.",
+    ),
+    (
+        "shellous_command_timeouts_total",
+        "timeouts",
+        "counter",
+        "Commands cancelled because their timeout expired.",
+    ),
+    (
+        "shellous_command_cancelled_total",
+        "cancellations",
+        "counter",
+        "Commands cancelled.",
+    ),
+    (
+        "shellous_command_signals_total",
+        "signals",
+        "counter",
+        "Signals sent to commands.",
+    ),
+    (
+        "shellous_command_input_bytes_total",
+        "input_bytes",
+        "counter",
+        "Bytes of input written to commands.",
+    ),
+    (
+        "shellous_command_output_bytes_total",
+        "output_bytes",
+        "counter",
+        "Bytes read from command stdout and stderr.",
+    ),
+)
+
+_HISTOGRAMS = (
+    (
+        "shellous_command_spawn_seconds",
+        "spawn_latency",
+        "Seconds spent launching the process.",
+    ),
+    (
+        "shellous_command_duration_seconds",
+        "wall_time",
+        "Seconds from start to close.",
+    ),
+)
+
+
+def _header(lines: list[str], name: str, kind: str, help_text: str) -> None:
+    "Append the HELP and TYPE lines for a metric."
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _quote(value: str) -> str:
+    "Quote a Prometheus label value."
+    value = value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _format_float(value: Any) -> str:
+    "Format a float value for Prometheus."
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
@@ -0,0 +1,262 @@
+"Implements utilities to run a pipeline."
+
+import asyncio
+import os
+from types import TracebackType
+from typing import Any, Coroutine, Optional, TypeVar, Union
+
+import shellous
+from shellous.harvest import harvest_results
+from shellous.iterate import OutputIterator
+from shellous.log import LOG_DETAIL, LOGGER, log_method
+from shellous.result import Result, check_result, convert_output, convert_result_list
+from shellous.scheduler import ConcurrencyLimiter
+from shellous.util import close_fds
+
+_T = TypeVar("_T")
+
+
+class PipeRunner(OutputIterator):
+    """PipeRunner is an asynchronous context manager that runs a pipeline.
+
+    ```
+    async with pipe.run() as run:
+        # process run.stdin, run.stdout, run.stderr (if not None)
+    result = run.result()
+    ```
+    """
+
+    stdin: Optional[asyncio.StreamWriter] = None
+    "Pipeline standard input."
+
+    stdout: Optional[asyncio.StreamReader] = None
+    "Pipeline standard output."
+
+    stderr: Optional[asyncio.StreamReader] = None
+    "Pipeline standard error."
+
+    _pipe: "shellous.Pipeline[Any]"
+    _capturing: bool
+    _tasks: list[asyncio.Task[Any]]
+    _encoding: str
+    _cancelled: bool = False
+    _results: Optional[list[Union[BaseException, Result]]] = None
+    _limiter: Optional[ConcurrencyLimiter] = None
+
+    def __init__(self, pipe: "shellous.Pipeline[Any]", *, capturing: bool):
+        """`capturing=True` indicates we are within an `async with` block and
+        client needs to access `stdin` and `stderr` streams.
+        """
+        assert len(pipe.commands) > 1
+
+        self._pipe = pipe
+        self._cancelled = False
+        self._tasks = []
+        self._capturing = capturing
+        self._encoding = pipe.options.encoding
+
+    @property
+    def name(self) -> str:
+        "Return name of the pipeline."
+        return self._pipe.name
+
+    def result(self) -> Result:
+        "Return `Result` object for PipeRunner."
+        assert self._results is not None
+
+        return check_result(
+            convert_result_list(self._results, self._cancelled),
+            self._pipe.options,
+            self._cancelled,
+        )
+
+    def add_task(
+        self,
+        coro: Coroutine[Any, Any, _T],
+        tag: str = "",
+    ) -> asyncio.Task[_T]:
+        "Add a background task."
+        task_name = f"{self.name}#{tag}"
+        task = asyncio.create_task(coro, name=task_name)
+        self._tasks.append(task)
+        return task
+
+    @log_method(LOG_DETAIL)
+    async def _wait(self, *, kill: bool = False):
+        "Wait for pipeline to finish."
+        assert self._results is None
+
+        if kill:
+            LOGGER.debug("PipeRunner.wait killing pipe %r", self)
+            for task in self._tasks:
+                task.cancel()
+
+        cancelled, self._results = await harvest_results(*self._tasks, trustee=self)
+        if cancelled:
+            self._cancelled = True
+        self._tasks.clear()  # clear all tasks when done
+
+    @log_method(LOG_DETAIL)
+    async def __aenter__(self):
+        "Set up redirections and launch pipeline."
+        try:
+            # The whole pipeline uses a single concurrency slot.
+            limiter = self._pipe.options.max_concurrency
+            if limiter is not None:
+                await limiter.acquire(self._pipe.options.priority)
+                self._limiter = limiter
+            return await self._start()
+        except (Exception, asyncio.CancelledError) as ex:
+            LOGGER.warning("PipeRunner enter %r ex=%r", self, ex)
+            if isinstance(ex, asyncio.CancelledError):
+                self._cancelled = True
+            try:
+                await self._wait(kill=True)
+            finally:
+                self._release_slot()
+            raise
+
+    @log_method(LOG_DETAIL)
+    async def __aexit__(
+        self,
+        _exc_type: Union[type[BaseException], None],
+        exc_value: Union[BaseException, None],
+        _exc_tb: Optional[TracebackType],
+    ):
+        "Wait for pipeline to exit and handle cancellation."
+        suppress = False
+        try:
+            suppress = await self._finish(exc_value)
+        except asyncio.CancelledError:
+            LOGGER.warning("PipeRunner cancelled inside _finish %r", self)
+            self._cancelled = True
+        finally:
+            self._release_slot()
+        return suppress
+
+    def _release_slot(self):
+        "Release our concurrency slot, if we have one."
+        if self._limiter is not None:
+            self._limiter.release()
+            self._limiter = None
+
+    @log_method(LOG_DETAIL)
+    async def _finish(self, exc_value: Optional[BaseException]) -> bool:
+        "Wait for pipeline to exit and handle cancellation."
+        if exc_value is not None:
+            LOGGER.warning("PipeRunner._finish exc_value=%r", exc_value)
+            if isinstance(exc_value, asyncio.CancelledError):
+                self._cancelled = True
+            await self._wait(kill=True)
+            return self._cancelled
+
+        await self._wait()
+        return False
+
+    @log_method(LOG_DETAIL)
+    async def _start(self):
+        "Set up redirection and launch pipeline."
+        open_fds: list[int] = []
+
+        try:
+            stdin = None
+            stdout = None
+            stderr = None
+
+            cmds = self._setup_pipeline(open_fds)
+
+            if self._capturing:
+                stdin, stdout, stderr = await self._setup_capturing(cmds)
+            else:
+                for cmd in cmds:
+                    self.add_task(cmd.coro())
+
+            self.stdin = stdin
+            self.stdout = stdout
+            self.stderr = stderr
+
+            return self
+
+        except BaseException:  # pylint: disable=broad-except
+            # Clean up after any exception *including* CancelledError.
+            close_fds(open_fds)
+            raise
+
+    def _setup_pipeline(self, open_fds: list[int]):
+        """Return the pipeline stitched together with pipe fd's.
+
+        Each created open file descriptor is added to `open_fds` so it can
+        be closed if there's an exception later.
+        """
+        cmds = list(self._pipe.commands)
+
+        cmd_count = len(cmds)
+        for i in range(cmd_count - 1):
+            (read_fd, write_fd) = os.pipe()
+            open_fds.extend((read_fd, write_fd))
+
+            cmds[i] = cmds[i].stdout(write_fd, close=True)
+            cmds[i + 1] = cmds[i + 1].stdin(read_fd, close=True)
+
+        for i in range(cmd_count):
+            cmds[i] = cmds[i].set(
+                _return_result=True,
+                _catch_cancelled_error=True,
+                max_concurrency=None,
+            )
+
+        return cmds
+
+    @log_method(LOG_DETAIL)
+    async def _setup_capturing(self, cmds: "list[shellous.Command[Any]]"):
+        """Set up capturing and return (stdin, stdout, stderr) streams."""
+        loop = asyncio.get_event_loop()
+        first_fut = loop.create_future()
+        last_fut = loop.create_future()
+
+        first_coro = cmds[0].coro(_run_future=first_fut)
+        last_coro = cmds[-1].coro(_run_future=last_fut)
+        middle_coros = [cmd.coro() for cmd in cmds[1:-1]]
+
+        # Tag each task name with the index of the command in the pipe.
+        self.add_task(first_coro, "0")
+        for i, coro in enumerate(middle_coros):
+            self.add_task(coro, str(i + 1))
+        self.add_task(last_coro, str(len(cmds) - 1))
+
+        # When capturing, we need the first and last commands in the
+        # pipe to signal when they are ready.
+        first_ready, last_ready = await asyncio.gather(first_fut, last_fut)
+
+        stdin, stdout, stderr = (
+            first_ready.stdin,
+            last_ready.stdout,
+            last_ready.stderr,
+        )
+
+        return (stdin, stdout, stderr)
+
+    def __repr__(self) -> str:
+        "Return string representation of PipeRunner."
+        cancelled_info = ""
+        if self._cancelled:
+            cancelled_info = " cancelled"
+        result_info = ""
+        if self._results:
+            result_info = f" results={self._results!r}"
+        return f"<PipeRunner {self.name!r}{cancelled_info}{result_info}>"
+
+    def _iter_options(self) -> "tuple[str, shellous.Options]":
+        "Return the encoding and options used to read the output."
+        return self._encoding, self._pipe.options
+
+    @staticmethod
+    async def run_pipeline(
+        pipe: "shellous.Pipeline[Any]",
+    ) -> Union[str, bytes, Result]:
+        "Run a pipeline. This is the main entry point for PipeRunner."
+        run = PipeRunner(pipe, capturing=False)
+        async with run:
+            pass
+
+        return await convert_output(run.result(), pipe.options)
@@ -1,5 +1,6 @@
 "Implements support for Pipelines."
 
+import builtins
 import dataclasses
 from dataclasses import dataclass
 from types import TracebackType
@@ -17,6 +18,7 @@ from typing import (
 )
 
 import shellous
+from shellous.pipe_runner import PipeRunner
 from shellous.redirect import (
     STDIN_TYPES,
     STDOUT_TYPES,
@@ -24,12 +26,11 @@ from shellous.redirect import (
     StdoutType,
     aiter_preflight,
 )
-from shellous.runner import PipeRunner
 from shellous.util import context_aenter, context_aexit
 
-# Return type for a Command, CmdContext can be either `str` or `Result`.
-_RT = TypeVar("_RT", str, "shellous.Result")
-_T = TypeVar("_T", str, "shellous.Result")
+# Return type for a Command, CmdContext can be `str`, `bytes` or `Result`.
+_RT = TypeVar("_RT", str, bytes, "shellous.Result")
+_T = TypeVar("_T", str, bytes, "shellous.Result")
 
 
 @dataclass(frozen=True)
@@ -131,6 +132,12 @@ class Pipeline(Generic[_RT]):
     ) -> "Pipeline[str]":
         ...  # pragma: no cover
 
+    @overload
+    def __or__(
+        self, rhs: "Union[shellous.Command[builtins.bytes], Pipeline[builtins.bytes]]"
+    ) -> "Pipeline[builtins.bytes]":
+        ...  # pragma: no cover
+
     @overload
     def __or__(self, rhs: StdoutType) -> "Pipeline[_RT]":
         ...  # pragma: no cover
@@ -167,10 +174,14 @@ class Pipeline(Generic[_RT]):
 
     @property
     def result(self) -> "Pipeline[shellous.Result]":
-        "Set `_return_result` and `exit_codes`."
+        "Set `_return_result` and `exit_codes`, and clear `_return_bytes`."
         return cast(
             Pipeline[shellous.Result],
-            self._set(_return_result=True, exit_codes=range(-255, 256)),
+            self._set(
+                _return_result=True,
+                _return_bytes=False,
+                exit_codes=range(-255, 256),
+            ),
         )
 
     def __await__(self) -> "Generator[Any, None, _RT]":
@@ -198,3 +209,55 @@ class Pipeline(Generic[_RT]):
         async with PipeRunner(self, capturing=True) as run:
             async for line in run:
                 yield line
+
+    def lines(self, *, batch: Optional[int] = None) -> AsyncIterator[list[str]]:
+        """Return async iterator over lists of output lines.
+
+        See `Command.lines`.
+        """
+        return aiter_preflight(self)._readlines_batched(batch)
+
+    async def _readlines_batched(self, batch: Optional[int]):
+        "Async generator to iterate over lists of lines."
+        async with PipeRunner(self, capturing=True) as run:
+            async for lines in run.iter_lines_batched(batch):
+                yield lines
+
+    def records(
+        self,
+        sep: builtins.bytes = b"\n",
+    ) -> AsyncIterator[builtins.bytes]:
+        """Return async iterator over `sep`-terminated records of output.
+
+        See `Command.records`.
+        """
+        return aiter_preflight(self)._readrecords(sep)
+
+    async def _readrecords(self, sep: builtins.bytes):
+        "Async generator to iterate over records."
+        async with PipeRunner(self, capturing=True) as run:
+            async for record in run.iter_records(sep):
+                yield record
+
+    def chunks(self, size: int = 8192) -> AsyncIterator[builtins.bytes]:
+        """Return async iterator over fixed-size chunks of output.
+
+        See `Command.chunks`.
+        """
+        return aiter_preflight(self)._readchunks(size)
+
+    async def _readchunks(self, size: int):
+        "Async generator to iterate over chunks."
+        async with PipeRunner(self, capturing=True) as run:
+            async for chunk in run.iter_chunks(size):
+                yield chunk
+
+    @property
+    def bytes(self) -> "Pipeline[builtins.bytes]":
+        """Set `_return_bytes` and clear `_return_result` on last command.
+
+        See `Command.bytes`.
+        """
+        new_last = self.commands[-1].bytes
+        new_commands = self.commands[0:-1] + (new_last,)
+        return cast(Pipeline[bytes], dataclasses.replace(self, commands=new_commands))
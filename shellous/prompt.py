@@ -1,13 +1,16 @@
 "Implements the Prompt utility class."
 
 import asyncio
+import codecs
 import re
 from typing import Optional
 
 from shellous.harvest import harvest_results
+from shellous.iterate import read_until
 from shellous.log import LOG_DETAIL, LOGGER
+from shellous.redirect import LongLinesT
 from shellous.runner import Runner
-from shellous.util import decode_bytes, encode_bytes
+from shellous.util import decode_bytes, encode_bytes, incremental_decoder
 
 _EOL_REGEX = re.compile(rb"\r\n|\r")
 
@@ -17,6 +20,11 @@ class Prompt:
 
     This is an experimental API.
 
+    A response longer than the command's `stream_limit` is read according to
+    its `long_lines` option. By default, the whole response is buffered. With
+    "split", `receive` may return part of a response; call it again to read
+    the rest.
+
     Example:
     ```
     cmd = sh("sh").stdin(sh.CAPTURE).stdout(sh.CAPTURE).stderr(sh.STDOUT)
@@ -36,6 +44,9 @@ class Prompt:
     _encoding: str
     _prompt_bytes: bytes
     _default_timeout: Optional[float]
+    _limit: int
+    _long_lines: Optional[LongLinesT]
+    _decoder: Optional[codecs.IncrementalDecoder]
 
     def __init__(
         self,
@@ -49,7 +60,13 @@ class Prompt:
         assert runner.stdout is not None
 
         self._runner = runner
-        self._encoding = runner.command.options.encoding
+        options = runner.command.options
+        self._encoding = options.encoding
+        self._limit = options.stream_limit
+        self._long_lines = options.long_lines
+        self._decoder = None
+        if self._long_lines in ("split", "truncate"):
+            self._decoder = incremental_decoder(self._encoding)
         self._prompt_bytes = encode_bytes(prompt, self._encoding)
         self._default_timeout = default_timeout
         self._normalize_newlines = normalize_newlines
@@ -107,7 +124,12 @@ class Prompt:
         stdout = self._runner.stdout
         assert stdout is not None
 
-        buf = await _read_until(stdout, self._prompt_bytes)
+        buf = await read_until(
+            stdout,
+            self._prompt_bytes,
+            self._limit,
+            self._long_lines or "buffer",
+        )
         if LOG_DETAIL:
             LOGGER.debug("Prompt[pid=%s] receive: %r", self._runner.pid, buf)
 
@@ -119,28 +141,11 @@ class Prompt:
         if buf.endswith(self._prompt_bytes):
             buf = buf[0 : -len(self._prompt_bytes)]
 
-        return decode_bytes(buf, self._encoding)
-
-
-async def _read_until(stream: asyncio.StreamReader, separator: bytes) -> bytes:
-    "Read all data until the separator."
-    try:
-        # Most reads can complete without buffering.
-        return await stream.readuntil(separator)
-    except asyncio.IncompleteReadError as ex:
-        return ex.partial
-    except asyncio.LimitOverrunError as ex:
-        # Okay, we have to buffer.
-        buf = bytearray(await stream.read(ex.consumed))
-
-    while True:
-        try:
-            buf.extend(await stream.readuntil(separator))
-        except asyncio.IncompleteReadError as ex:
-            buf.extend(ex.partial)
-        except asyncio.LimitOverrunError as ex:
-            buf.extend(await stream.read(ex.consumed))
-            continue
-        break
-
-    return bytes(buf)
+        if self._decoder is None:
+            return decode_bytes(buf, self._encoding)
+
+        # The response may end with part of a code point.
+        text = self._decoder.decode(buf)
+        if self._long_lines == "truncate":
+            self._decoder.reset()
+        return text
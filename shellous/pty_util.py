@@ -54,9 +54,9 @@ class PtyFds(NamedTuple):
     writer: Optional[asyncio.StreamWriter] = None
 
     @log_method(LOG_DETAIL)
-    async def open_streams(self) -> "PtyFds":
+    async def open_streams(self, limit: int) -> "PtyFds":
         "Open pty reader/writer streams."
-        reader, writer = await _open_pty_streams(self.parent_fd, self.child_fd)
+        reader, writer = await _open_pty_streams(self.parent_fd, self.child_fd, limit)
         return PtyFds(
             self.parent_fd,
             self.child_fd,
@@ -146,10 +146,10 @@ class PtyStreamReaderProtocol(asyncio.StreamReaderProtocol):
         return super().eof_received()
 
 
-async def _open_pty_streams(parent_fd: int, child_fd: ChildFd):
+async def _open_pty_streams(parent_fd: int, child_fd: ChildFd, limit: int):
     "Open reader, writer streams for pty file descriptor."
     loop = asyncio.get_running_loop()
-    reader = asyncio.StreamReader(loop=loop)
+    reader = asyncio.StreamReader(limit, loop=loop)
     reader_protocol = PtyStreamReaderProtocol(reader, loop=loop)
 
     # Stick reference to child_fd into protocol so we can close it after the
@@ -3,13 +3,30 @@
 import asyncio
 import enum
 import io
+import mmap
+import os
+import tempfile
 from logging import Logger
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Optional, TypeVar, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    BinaryIO,
+    Callable,
+    Literal,
+    Optional,
+    TypeVar,
+    Union,
+)
 
 from shellous.log import LOG_DETAIL, log_method
 from shellous.pty_util import PtyAdapterOrBool
-from shellous.util import decode_bytes
+from shellous.util import (
+    decode_bytes,
+    encode_bytes_async,
+    incremental_decoder,
+    open_anonymous_file,
+)
 
 if TYPE_CHECKING:
     import shellous
@@ -21,6 +38,12 @@ _STDERR = 2
 
 _CT = TypeVar("_CT", "shellous.Command[Any]", "shellous.Pipeline[Any]")
 
+MaxOutputActionT = Literal["truncate", "cancel"]
+MAX_OUTPUT_ACTIONS: tuple[MaxOutputActionT, ...] = ("truncate", "cancel")
+
+LongLinesT = Literal["split", "truncate", "buffer"]
+LONG_LINES: tuple[Optional[LongLinesT], ...] = ("split", "truncate", "buffer", None)
+
 
 class Redirect(enum.IntEnum):
     "Redirection constants."
@@ -30,6 +53,7 @@ class Redirect(enum.IntEnum):
     CAPTURE = -10
     INHERIT = -11
     BUFFER = -12
+    MMAP = -13
     DEFAULT = -20
 
     def is_custom(self) -> bool:
@@ -38,6 +62,7 @@ class Redirect(enum.IntEnum):
             Redirect.CAPTURE,
             Redirect.INHERIT,
             Redirect.BUFFER,
+            Redirect.MMAP,
             Redirect.DEFAULT,
         }
 
@@ -121,7 +146,7 @@ async def _drain(stream: asyncio.StreamWriter):
 
 @log_method(LOG_DETAIL)
 async def write_stream(
-    input_bytes: bytes,
+    input_bytes: Union[bytes, bytearray],
     stream: asyncio.StreamWriter,
     eof: Optional[bytes] = None,
 ):
@@ -154,6 +179,19 @@ async def write_stream(
         await _drain(stream)
 
 
+@log_method(LOG_DETAIL)
+async def write_text(
+    text: str,
+    encoding: str,
+    stream: asyncio.StreamWriter,
+    eof: Optional[bytes] = None,
+    offload: Optional[int] = None,
+):
+    "Encode text and write it to stream."
+    input_bytes = await encode_bytes_async(text, encoding, offload)
+    await write_stream(input_bytes, stream, eof)
+
+
 @log_method(LOG_DETAIL)
 async def write_reader(
     reader: asyncio.StreamReader,
@@ -191,18 +229,17 @@ async def copy_stringio(
     encoding: str,
 ):
     "Copy bytes from source stream to dest StringIO."
-    # Collect partial reads into a BytesIO.
-    buf = io.BytesIO()
+    # Decode each chunk as it arrives. The incremental decoder holds on to a
+    # code point that is split between reads.
+    decoder = incremental_decoder(encoding)
     try:
         while True:
             data = await source.read(_CHUNK_SIZE)
             if not data:
                 break
-            buf.write(data)
+            dest.write(decoder.decode(data))
     finally:
-        # Only convert to string once all output is collected.
-        # (What if utf-8 code point is split between reads?)
-        dest.write(decode_bytes(buf.getvalue(), encoding))
+        dest.write(decoder.decode(b"", final=True))
 
 
 @log_method(LOG_DETAIL)
@@ -239,27 +276,262 @@ async def copy_bytearray(source: asyncio.StreamReader, dest: bytearray):
         dest.extend(data)
 
 
+class CaptureBuffer:
+    """Collects the output of a command for `Redirect.BUFFER`.
+
+    When the output is a pipe, the subprocess protocol calls `write` with each
+    chunk of data as it arrives; there is no StreamReader or copy task. The
+    chunks are kept as-is, and joined only once, by `getvalue`. A single chunk
+    is returned without a copy.
+
+    If `limit` is not negative, only the first `limit` bytes are kept. The
+    rest of the output is read and discarded. The `on_limit` function is
+    called the first time that output is discarded.
+
+    If `spill` is not negative, the buffer moves to a file created by
+    `spill_file` once it holds more than `spill` bytes. The file is
+    memory-mapped by `close`, and `getvalue` returns a read-only memoryview of
+    the mapping. The default `spill_file` is an unlinked temporary file.
+    """
+
+    __slots__ = (
+        "_chunks",
+        "_size",
+        "_limit",
+        "_spill",
+        "_spill_file",
+        "_file",
+        "_on_limit",
+    )
+
+    _chunks: list[Union[bytes, memoryview]]
+    _size: int
+    _limit: int
+    _spill: int
+    _spill_file: Callable[[], BinaryIO]
+    _file: Optional[BinaryIO]
+    _on_limit: Optional[Callable[[], None]]
+
+    def __init__(
+        self,
+        limit: int = -1,
+        spill: int = -1,
+        on_limit: Optional[Callable[[], None]] = None,
+        spill_file: Callable[[], BinaryIO] = tempfile.TemporaryFile,
+    ):
+        self._chunks = []
+        self._size = 0
+        self._limit = limit
+        self._spill = spill
+        self._spill_file = spill_file
+        self._file = None
+        self._on_limit = on_limit
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def spilled(self) -> bool:
+        "True if the buffer has moved to a temporary file."
+        return self._file is not None
+
+    def write(self, data: bytes) -> None:
+        "Append data to the buffer."
+        if self._limit >= 0:
+            room = self._limit - self._size
+            if len(data) > room:
+                self._limit_reached()
+                if room <= 0:
+                    return
+                data = data[:room]
+        self._size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if 0 <= self._spill < self._size:
+            self._spill_to_file()
+
+    def _limit_reached(self) -> None:
+        "Call the `on_limit` function, only the first time."
+        on_limit = self._on_limit
+        if on_limit is not None:
+            self._on_limit = None
+            on_limit()
+
+    def _spill_to_file(self) -> None:
+        "Move the contents of the buffer to a file."
+        file = self._spill_file()
+        try:
+            file.writelines(self._chunks)
+        except BaseException:
+            file.close()
+            raise
+        self._file = file
+        self._chunks = []
+
+    def close(self) -> None:
+        "Map the temporary file into memory, if the buffer spilled to one."
+        if self._file is None:
+            return
+        # Don't spill again if there is more data.
+        self._spill = -1
+        try:
+            self._file.flush()
+            self._chunks = [_map_file(self._file)]
+        finally:
+            self._file.close()
+            self._file = None
+
+    def getvalue(self) -> Union[bytes, memoryview]:
+        "Return the contents of the buffer."
+        self.close()
+        chunks = self._chunks
+        if len(chunks) == 1:
+            return chunks[0]
+        value = b"".join(chunks)
+        if value:
+            # Keep the joined value so we don't join again.
+            self._chunks = [value]
+        return value
+
+
+class HeadTailBuffer:
+    """Collects the start and end of a command's stderr for `Redirect.BUFFER`.
+
+    The first `head` bytes and the last `tail` bytes are kept; the output in
+    between is discarded. Memory use is bounded by about twice the tail size.
+    `size` counts all of the output, including discarded bytes. The `on_limit`
+    function is called the first time that output is discarded.
+    """
+
+    __slots__ = ("_head", "_tail", "_head_limit", "_tail_limit", "_size", "_on_limit")
+
+    _head: bytearray
+    _tail: bytearray
+    _head_limit: int
+    _tail_limit: int
+    _size: int
+    _on_limit: Optional[Callable[[], None]]
+
+    def __init__(
+        self,
+        head: int,
+        tail: int,
+        on_limit: Optional[Callable[[], None]] = None,
+    ):
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._head_limit = head
+        self._tail_limit = tail
+        self._size = 0
+        self._on_limit = on_limit
+
+    def __len__(self) -> int:
+        return len(self._head) + min(len(self._tail), self._tail_limit)
+
+    @property
+    def size(self) -> int:
+        "Total number of bytes written, including discarded bytes."
+        return self._size
+
+    def write(self, data: bytes) -> None:
+        "Append data to the buffer."
+        self._size += len(data)
+        on_limit = self._on_limit
+        if on_limit is not None and self._size > self._head_limit + self._tail_limit:
+            self._on_limit = None
+            on_limit()
+        room = self._head_limit - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            if len(data) <= room:
+                return
+            data = data[room:]
+        if self._tail_limit > 0:
+            tail = self._tail
+            tail += data
+            # Trim the tail only when it's twice as big as needed.
+            if len(tail) > 2 * self._tail_limit:
+                del tail[: -self._tail_limit]
+
+    def close(self) -> None:
+        "Does nothing; the buffer is always in memory."
+
+    def getvalue(self) -> bytes:
+        "Return the head of the output followed by its tail."
+        tail = self._tail
+        if len(tail) > self._tail_limit:
+            del tail[: -self._tail_limit]
+        return bytes(self._head + tail)
+
+
+class MappedBuffer:
+    """Collects the output of a command for `Redirect.MMAP`.
+
+    The output is written directly to an anonymous file, so the event loop
+    doesn't read anything while the process runs. After the process exits,
+    `close` maps the file into memory; `getvalue` returns a read-only
+    memoryview of the mapping.
+    """
+
+    __slots__ = ("_file", "_value")
+
+    _file: Optional[BinaryIO]
+    _value: Union[bytes, memoryview]
+
+    def __init__(self):
+        self._file = open_anonymous_file()
+        self._value = b""
+
+    def __len__(self) -> int:
+        if self._file is not None:
+            return os.fstat(self._file.fileno()).st_size
+        return len(self._value)
+
+    def fileno(self) -> int:
+        "Return the file descriptor that the process writes to."
+        assert self._file is not None
+        return self._file.fileno()
+
+    def close(self) -> None:
+        "Map the file's contents into memory, then close the file."
+        if self._file is None:
+            return
+        try:
+            self._value = _map_file(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def getvalue(self) -> Union[bytes, memoryview]:
+        "Return the contents of the buffer."
+        self.close()
+        return self._value
+
+
+def _map_file(file: BinaryIO) -> Union[bytes, memoryview]:
+    "Return a read-only memoryview of a file's contents."
+    size = os.fstat(file.fileno()).st_size
+    if not size:
+        # Can't map an empty file.
+        return b""
+    return memoryview(mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ))
+
+
 @log_method(LOG_DETAIL)
-async def copy_bytearray_limit(
+async def copy_buffer(
     source: asyncio.StreamReader,
-    dest: bytearray,
-    limit: int,
+    dest: Union[CaptureBuffer, HeadTailBuffer],
 ):
-    "Copy limited number of bytes from source stream to dest bytearray."
+    "Copy bytes from source stream to dest buffer."
+    # Always read to EOF, even if the buffer has a limit, to avoid possible
+    # blocking/deadlock inside the source program.
     while True:
         data = await source.read(_CHUNK_SIZE)
         if not data:
             break
-        dest.extend(data)
-        if len(dest) > limit:
-            del dest[limit:]
-            break
-
-    if data:
-        # After reaching the limit, continue to read and discard bytes from
-        # source to avoid possible blocking/deadlock inside the source program.
-        while await source.read(_CHUNK_SIZE):
-            pass
+        dest.write(data)
 
 
 @log_method(LOG_DETAIL)
@@ -276,13 +548,6 @@ async def copy_streamwriter(source: asyncio.StreamReader, dest: asyncio.StreamWr
     await dest.wait_closed()
 
 
-@log_method(LOG_DETAIL)
-async def read_lines(source: asyncio.StreamReader, encoding: str):
-    "Async iterator over lines in stream."
-    async for line in source:
-        yield decode_bytes(line, encoding)
-
-
 def aiter_preflight(cmd: _CT) -> _CT:
     "Fix up command or pipeline when iterating using __aiter__."
     if cmd.options.output == Redirect.DEFAULT:
@@ -2,13 +2,14 @@
 
 import asyncio
 import sys
-from dataclasses import dataclass
-from typing import Optional, Union
+from dataclasses import dataclass, field, fields
+from typing import Any, Optional, Union
 
 import shellous
-from shellous.util import decode_bytes
+from shellous.util import CODEC_OFFLOAD_SIZE, decode_bytes, decode_bytes_async
 
-# Limit number of bytes of stderr stored in Result object.
+# Default limit on number of bytes of stderr stored in Result object. Half of
+# the limit is used for the start of stderr, and half for the end.
 RESULT_STDERR_LIMIT = 1024
 
 
@@ -22,20 +23,183 @@ class ResultError(Exception):
 
 
 _KW_ONLY = {"kw_only": True} if sys.version_info >= (3, 10) else {}
+# Frozen dataclasses with slots can only be pickled in Python 3.11 and later.
+_SLOTS = {"slots": True} if sys.version_info >= (3, 11) else {}
 
+# `ru_maxrss` is in kilobytes on Linux and in bytes on MacOS.
+_MAXRSS_SCALE = 1 if sys.platform == "darwin" else 1024
 
-@dataclass(frozen=True, **_KW_ONLY)
-class Result:
-    "Concrete class for the result of a Command."
+
+@dataclass(frozen=True, **_SLOTS)
+class ResourceUsage:
+    "Resource usage of a child process, collected when it is reaped."
+
+    user_time: float
+    "User CPU time in seconds."
+
+    system_time: float
+    "System CPU time in seconds."
+
+    max_rss: int
+    "Maximum resident set size in bytes."
+
+    minor_faults: int
+    "Page faults serviced without any I/O."
+
+    major_faults: int
+    "Page faults that required I/O."
+
+    voluntary_switches: int
+    "Context switches because the process waited for a resource."
+
+    involuntary_switches: int
+    "Context switches because the process was preempted."
+
+    @staticmethod
+    def from_rusage(rusage: Any) -> "ResourceUsage":
+        "Convert a `os.struct_rusage` or `resource.struct_rusage` value."
+        return ResourceUsage(
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            max_rss=rusage.ru_maxrss * _MAXRSS_SCALE,
+            minor_faults=rusage.ru_minflt,
+            major_faults=rusage.ru_majflt,
+            voluntary_switches=rusage.ru_nvcsw,
+            involuntary_switches=rusage.ru_nivcsw,
+        )
+
+    def __add__(self, rhs: "ResourceUsage") -> "ResourceUsage":
+        "Combine the resource usage of two processes, e.g. in a pipeline."
+        return ResourceUsage(
+            user_time=self.user_time + rhs.user_time,
+            system_time=self.system_time + rhs.system_time,
+            max_rss=max(self.max_rss, rhs.max_rss),
+            minor_faults=self.minor_faults + rhs.minor_faults,
+            major_faults=self.major_faults + rhs.major_faults,
+            voluntary_switches=self.voluntary_switches + rhs.voluntary_switches,
+            involuntary_switches=self.involuntary_switches + rhs.involuntary_switches,
+        )
+
+
+@dataclass(frozen=True, **_SLOTS)
+class PhaseTiming:
+    """Timestamps for the phases of running a command.
+
+    Each timestamp is a `time.monotonic()` value. A timestamp is None if the
+    phase was not reached, or can't be observed (e.g. `first_output` when
+    stdout is not a pipe).
+    """
+
+    started: Optional[float] = None
+    "Runner started, before waiting for a concurrency slot."
+
+    setup: Optional[float] = None
+    "Runner began setting up arguments and redirections."
+
+    spawn: Optional[float] = None
+    "Runner began launching the process."
+
+    spawned: Optional[float] = None
+    "Process was launched."
+
+    first_output: Optional[float] = None
+    "First byte of stdout arrived."
+
+    exited: Optional[float] = None
+    "Process exited."
+
+    drained: Optional[float] = None
+    "Background I/O tasks finished."
+
+    closed: Optional[float] = None
+    "Runner closed the process's transport and streams."
+
+    @property
+    def queue_time(self) -> Optional[float]:
+        "Seconds spent waiting for a concurrency slot."
+        return _elapsed(self.started, self.setup)
+
+    @property
+    def setup_time(self) -> Optional[float]:
+        "Seconds spent setting up arguments and redirections."
+        return _elapsed(self.setup, self.spawn)
+
+    @property
+    def spawn_time(self) -> Optional[float]:
+        "Seconds spent launching the process."
+        return _elapsed(self.spawn, self.spawned)
+
+    @property
+    def first_output_time(self) -> Optional[float]:
+        "Seconds from launch until the first byte of stdout."
+        return _elapsed(self.spawned, self.first_output)
+
+    @property
+    def run_time(self) -> Optional[float]:
+        "Seconds from launch until the process exited."
+        return _elapsed(self.spawned, self.exited)
+
+    @property
+    def drain_time(self) -> Optional[float]:
+        "Seconds from process exit until the I/O tasks finished."
+        return _elapsed(self.exited, self.drained)
+
+    @property
+    def close_time(self) -> Optional[float]:
+        "Seconds spent closing the transport and streams."
+        return _elapsed(self.drained, self.closed)
+
+    @property
+    def total_time(self) -> Optional[float]:
+        "Seconds from start to close."
+        return _elapsed(self.started, self.closed)
+
+
+def _elapsed(begin: Optional[float], end: Optional[float]) -> Optional[float]:
+    "Return `end - begin`, or None if either timestamp is missing."
+    if begin is None or end is None:
+        return None
+    return end - begin
+
+
+class _DecodedCache:  # pylint: disable=too-few-public-methods
+    "Slots for the decoded output cached by `Result`; they aren't fields."
+
+    __slots__ = ("_output", "_error")
+
+    _output: Optional[str]
+    _error: Optional[str]
+
+
+@dataclass(frozen=True, **_KW_ONLY, **_SLOTS)
+class Result(_DecodedCache):
+    """Concrete class for the result of a Command.
+
+    The `output` and `error` strings are decoded when first accessed, then
+    cached.
+    """
 
     exit_code: int
     "Command's exit code."
 
     output_bytes: bytes
-    "Output of command as bytes. May be None if there is no output."
+    """Output of command as bytes. May be None if there is no output.
+
+    This is always `bytes` by default. Only when you opt in to mapped output,
+    by redirecting stdout to `sh.MMAP` or setting `buffer_spill`, can this be a
+    read-only memoryview of the memory-mapped output.
+    """
 
     error_bytes: bytes
-    "Limited standard error from command if not redirected."
+    """Limited standard error from command if not redirected.
+
+    This is the start of stderr followed by its end; see the `error_head` and
+    `error_tail` options. If `error_size` is larger than the length of
+    `error_bytes`, the output in between was discarded.
+
+    When stderr is redirected to `sh.MMAP`, this is a read-only memoryview of
+    the memory-mapped output.
+    """
 
     cancelled: bool
     "Command was cancelled."
@@ -43,20 +207,110 @@ class Result:
     encoding: str
     "Output encoding."
 
+    rusage: Optional[ResourceUsage] = field(default=None, compare=False, repr=False)
+    """Resource usage of the process, or None if it is not available.
+
+    Resource usage is available when shellous reaps the process itself: with
+    the "posix_spawn" or "forkserver" launchers, or with shellous's
+    `DefaultChildWatcher`. With the default "asyncio" launcher and asyncio's
+    own child watcher, asyncio reaps the process and this is always None.
+    For a pipeline, this is the combined usage of all commands; it is None if
+    any command's usage is unavailable.
+    """
+
+    timing: Optional[PhaseTiming] = field(default=None, compare=False, repr=False)
+    """Timestamps for the phases of running the command.
+
+    This is None for a pipeline.
+    """
+
+    error_size: Optional[int] = field(default=None, compare=False, repr=False)
+    "Total number of bytes written to stderr, or None if stderr is redirected."
+
+    truncated: bool = field(default=False, compare=False, repr=False)
+    """True if captured output was cut off at the `max_output` limit.
+
+    For a pipeline, this is true if the output of the last command was
+    truncated.
+    """
+
+    def __post_init__(self) -> None:
+        "Clear the cached output and error."
+        object.__setattr__(self, "_output", None)
+        object.__setattr__(self, "_error", None)
+
+    def __getstate__(self) -> dict[str, Any]:
+        "Pickle the fields only; the cached output and error are left out."
+        return {item.name: getattr(self, item.name) for item in fields(self)}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        "Restore the fields of a pickled Result."
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+        self.__post_init__()
+
     @property
     def output(self) -> str:
         "Output of command as a string."
-        return decode_bytes(self.output_bytes, self.encoding)
+        value = self._output
+        if value is None:
+            value = decode_bytes(self.output_bytes, self.encoding)
+            object.__setattr__(self, "_output", value)
+        return value
 
     @property
     def error(self) -> str:
         "Error from command as a string (if it is not redirected)."
-        return decode_bytes(self.error_bytes, self.encoding)
+        value = self._error
+        if value is None:
+            value = decode_bytes(self.error_bytes, self.encoding)
+            object.__setattr__(self, "_error", value)
+        return value
+
+    async def aoutput(self, offload: int = CODEC_OFFLOAD_SIZE) -> str:
+        """Output of command as a string.
+
+        If the output is at least `offload` bytes, it is decoded in a worker
+        thread so the event loop isn't blocked.
+        """
+        value = self._output
+        if value is None:
+            value = await decode_bytes_async(self.output_bytes, self.encoding, offload)
+            object.__setattr__(self, "_output", value)
+        return value
+
+    async def aerror(self, offload: int = CODEC_OFFLOAD_SIZE) -> str:
+        """Error from command as a string (if it is not redirected).
+
+        If the error is at least `offload` bytes, it is decoded in a worker
+        thread so the event loop isn't blocked.
+        """
+        value = self._error
+        if value is None:
+            value = await decode_bytes_async(self.error_bytes, self.encoding, offload)
+            object.__setattr__(self, "_error", value)
+        return value
 
     def __bool__(self) -> bool:
         "Return true if exit_code is 0."
         return self.exit_code == 0
 
+    def __repr__(self) -> str:
+        "Return the dataclass repr, showing memoryview contents as bytes."
+        args = ", ".join(
+            f"{item.name}={_repr_value(getattr(self, item.name))}"
+            for item in fields(self)
+            if item.repr
+        )
+        return f"{type(self).__qualname__}({args})"
+
+
+def _repr_value(value: Any) -> str:
+    "Return repr of a Result field; a memoryview is shown like bytes."
+    if isinstance(value, memoryview):
+        return repr(value.tobytes())
+    return repr(value)
+
 
 def convert_result_list(
     result_list: list[Union[BaseException, Result]],
@@ -84,11 +338,27 @@ def convert_result_list(
         exit_code=key_result.exit_code,
         output_bytes=last.output_bytes,
         error_bytes=key_result.error_bytes,
+        error_size=key_result.error_size,
         cancelled=cancelled,
         encoding=last.encoding,
+        rusage=_sum_rusage(result_list),
+        truncated=last.truncated,
     )
 
 
+def _sum_rusage(
+    result_list: list[Union[BaseException, Result]]
+) -> Optional[ResourceUsage]:
+    "Return the combined resource usage of a list of results."
+    total = None
+    for item in result_list:
+        rusage = _get_result(item).rusage
+        if rusage is None:
+            return None
+        total = rusage if total is None else total + rusage
+    return total
+
+
 def check_result(
     result: Result,
     options: "shellous.Options",
@@ -109,6 +379,25 @@ def check_result(
     return result
 
 
+async def convert_output(
+    result: Result,
+    options: "shellous.Options",
+) -> Union[str, bytes, Result]:
+    """Return the value of a command or pipeline run by `await`.
+
+    This is the `Result` itself, the output bytes, or the decoded output. Large
+    output is decoded in a thread if `codec_offload` is set.
+    """
+    if options._return_result:  # pyright: ignore[reportPrivateUsage]
+        return result
+    if options._return_bytes:  # pyright: ignore[reportPrivateUsage]
+        # A mapped memoryview is copied; `bytes` is returned as-is.
+        return bytes(result.output_bytes)
+    if options.codec_offload is None:
+        return result.output
+    return await result.aoutput(options.codec_offload)
+
+
 def _find_key_result(result_list: list[Union[Result, BaseException]]) -> Result:
     "Scan a result list and return the 'key' result."
     acc = None
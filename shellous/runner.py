@@ -1,32 +1,51 @@
 "Implements utilities to run a command."
 
 import asyncio
+import dataclasses
 import io
 import os
 import sys
+import time
 from logging import Logger
 from pathlib import Path
 from types import TracebackType
-from typing import Any, AsyncIterator, Coroutine, Optional, TextIO, TypeVar, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    NamedTuple,
+    Optional,
+    TextIO,
+    TypeVar,
+    Union,
+    cast,
+)
 
 import shellous
 import shellous.redirect as redir
-from shellous import pty_util
-from shellous.harvest import harvest, harvest_results
+from shellous import forkserver, pty_util, spawn
+from shellous.harvest import harvest
+from shellous.iterate import OutputIterator
 from shellous.log import LOG_DETAIL, LOGGER, log_method, log_timer
-from shellous.redirect import Redirect
+from shellous.redirect import CaptureBuffer, HeadTailBuffer, MappedBuffer, Redirect
 from shellous.result import (
-    RESULT_STDERR_LIMIT,
+    PhaseTiming,
+    ResourceUsage,
     Result,
     check_result,
-    convert_result_list,
+    convert_output,
 )
+from shellous.scheduler import ConcurrencyLimiter
 from shellous.util import (
     BSD_DERIVED,
+    CAN_MEMFD,
     SupportsClose,
     close_fds,
     encode_bytes,
+    encode_bytes_async,
+    make_memfd,
     poll_wait_pid,
+    pop_rusage,
     uninterrupted,
     verify_dev_fd,
 )
@@ -62,7 +81,54 @@ def _is_writable(cmd: "Union[shellous.Command[Any], shellous.Pipeline[Any]]"):
     return cmd.options._writable
 
 
-class _RunOptions:
+class LaunchPlan(NamedTuple):
+    """@private Precomputed settings for launching a Command.
+
+    See `Command.compile`.
+    """
+
+    pos_args: Optional[tuple[Union[str, bytes, os.PathLike[Any]], ...]]
+    "Command line with the executable already resolved (None if not static)."
+
+    input: Any
+    "Input redirection, with str input already encoded."
+
+    output: Any
+    "Output redirection."
+
+    error: Any
+    "Error redirection."
+
+
+def compile_plan(command: "shellous.Command[Any]") -> LaunchPlan:
+    "Return a launch plan for the command."
+    options = command.options
+
+    pos_args = None
+    if not _uses_process_substitution(command):
+        args = cast(list[Union[str, bytes, os.PathLike[Any]]], list(command.args))
+        executable = args[0]
+        if os.path.dirname(executable):  # type: ignore (path)
+            pos_args = tuple(args)
+        else:
+            found_executable = options.which(executable)
+            if found_executable is not None:
+                args[0] = found_executable
+                pos_args = tuple(args)
+
+    input_ = Redirect.from_default(options.input, 0, options.pty)
+    if isinstance(input_, str):
+        input_ = encode_bytes(input_, options.encoding)
+
+    return LaunchPlan(
+        pos_args,
+        input_,
+        Redirect.from_default(options.output, 1, options.pty),
+        Redirect.from_default(options.error, 2, options.pty),
+    )
+
+
+class _RunOptions:  # pylint: disable=too-many-instance-attributes
     """_RunOptions is context manager to assist in running a command.
 
     This class sets up low-level I/O redirection and helps close open file
@@ -78,54 +144,56 @@ class _RunOptions:
     command: "shellous.Command[Any]"
     encoding: str
     open_fds: list[Union[int, SupportsClose]]
-    input_bytes: Optional[bytes]
+    input_bytes: Optional[Union[bytes, bytearray]]
+    input_size: int
+    encoded_input: Optional[bytes] = None
     pos_args: list[Union[str, bytes, os.PathLike[Any]]]
     kwd_args: dict[str, Any]
     subcmds: "list[Union[shellous.Command[Any], shellous.Pipeline[Any]]]"
     pty_fds: Optional[pty_util.PtyFds]
-    output_bytes: Optional[bytearray]
-    error_bytes: Optional[bytearray]
+    output_bytes: Optional[Union[CaptureBuffer, MappedBuffer]]
+    error_bytes: Optional[Union[CaptureBuffer, HeadTailBuffer, MappedBuffer]]
+    sinks: spawn.SinkMap
+    on_truncate: Optional[Callable[[], None]] = None
     is_stderr_only: bool = False
+    truncated: bool = False
 
     def __init__(self, command: "shellous.Command[Any]"):
         self.command = command
         self.encoding = command.options.encoding
         self.open_fds = []
         self.input_bytes = None
+        self.input_size = 0
         self.pos_args = []
         self.kwd_args = {}
         self.subcmds = []
         self.pty_fds = None
         self.output_bytes = None
         self.error_bytes = None
+        self.sinks = {}
 
     def __enter__(self):
         "Set up I/O redirections."
         _cmd = self.command
 
+        plan = _cmd.launch_plan
+
         try:
-            if _uses_process_substitution(self.command):
-                self.pos_args = self._setup_process_substitution()
+            if plan is not None and plan.pos_args is not None:
+                # Executable was resolved when the command was compiled.
+                self.pos_args = list(plan.pos_args)
+                self._setup_redirects(plan)
+                self._setup_pass_fds()
             else:
-                self.pos_args = cast(
-                    list[Union[str, bytes, os.PathLike[Any]]], list(self.command.args)
-                )
-
-            self._setup_redirects()
-            self._setup_pass_fds()
-
-            # If executable does not include an absolute/relative directory,
-            # resolve it using PATH.
-            executable = self.pos_args[0]
-            if not os.path.dirname(executable):  # type: ignore (path)
-                found_executable = _cmd.options.which(executable)
-                if found_executable is None:
-                    raise FileNotFoundError(executable)
-                self.pos_args[0] = found_executable
+                self._setup_args()
+                self._setup_redirects(plan)
+                self._setup_pass_fds()
+                self._resolve_executable()
 
         except Exception as ex:
             if LOG_DETAIL:
                 LOGGER.debug("_RunOptions.enter %r ex=%r", self.command.name, ex)
+            self.close_buffers()
             _cleanup(self.command)
             raise
 
@@ -141,6 +209,7 @@ class _RunOptions:
         "Make sure those file descriptors are cleaned up."
         close_fds(self.open_fds)
         if exc_value:
+            self.close_buffers()
             if LOG_DETAIL:
                 LOGGER.debug(
                     "_RunOptions.exit %r exc_value=%r",
@@ -150,6 +219,54 @@ class _RunOptions:
             for subcmd in self.subcmds:
                 _cleanup(subcmd)
 
+    def select_launcher(self) -> spawn.LauncherT:
+        "Return the launcher to use, falling back to asyncio if necessary."
+        launcher = self.command.options.launcher
+        if launcher == "posix_spawn" and not spawn.can_posix_spawn(self.kwd_args):
+            return "asyncio"
+        if launcher == "forkserver" and not forkserver.can_forkserver(self.kwd_args):
+            return "asyncio"
+        return launcher
+
+    async def encode_input(self):
+        "Encode large `str` input in a worker thread if `codec_offload` is set."
+        options = self.command.options
+        input_ = options.input
+        if self.command.launch_plan is not None:
+            # Input was already encoded when the command was compiled.
+            return
+        if isinstance(input_, str) and options.codec_offload is not None:
+            self.encoded_input = await encode_bytes_async(
+                input_,
+                self.encoding,
+                options.codec_offload,
+            )
+
+    def close_buffers(self):
+        "Close output buffers that may be backed by a file."
+        for buffer in (self.output_bytes, self.error_bytes):
+            if buffer is not None:
+                buffer.close()
+
+    def _setup_args(self):
+        "Set up the command line arguments."
+        if _uses_process_substitution(self.command):
+            self.pos_args = self._setup_process_substitution()
+        else:
+            self.pos_args = cast(
+                list[Union[str, bytes, os.PathLike[Any]]], list(self.command.args)
+            )
+
+    def _resolve_executable(self):
+        """If executable does not include an absolute/relative directory,
+        resolve it using PATH."""
+        executable = self.pos_args[0]
+        if not os.path.dirname(executable):  # type: ignore (path)
+            found_executable = self.command.options.which(executable)
+            if found_executable is None:
+                raise FileNotFoundError(executable)
+            self.pos_args[0] = found_executable
+
     def _setup_process_substitution(self) -> list[Union[str, bytes, os.PathLike[Any]]]:
         """Set up process substitution.
 
@@ -176,6 +293,9 @@ class _RunOptions:
                 new_fds.append(read_fd)
                 subcmd = arg.stdout(write_fd, close=True)
 
+            # Process substitutions share the concurrency slot of the command.
+            subcmd = _without_limiter(subcmd)
+
             self.subcmds.append(subcmd)
 
         # We need to include `new_fds` in our `pass_fds` list. We also need
@@ -189,12 +309,20 @@ class _RunOptions:
 
         return new_args
 
-    def _setup_redirects(self):
+    def _setup_redirects(self, plan: Optional[LaunchPlan]):
         "Set up I/O redirections."
         options = self.command.options
 
+        if plan is None:
+            plan = LaunchPlan(
+                None,
+                Redirect.from_default(options.input, 0, options.pty),
+                Redirect.from_default(options.output, 1, options.pty),
+                Redirect.from_default(options.error, 2, options.pty),
+            )
+
         stdin, input_bytes = self._setup_input(
-            Redirect.from_default(options.input, 0, options.pty),
+            plan.input,
             options.input_close,
             self.encoding,
         )
@@ -204,14 +332,14 @@ class _RunOptions:
             self.is_stderr_only = True
 
         stdout = self._setup_output(
-            Redirect.from_default(options.output, 1, options.pty),
+            plan.output,
             options.output_append,
             options.output_close,
             sys.stdout,
         )
 
         stderr = self._setup_output(
-            Redirect.from_default(options.error, 2, options.pty),
+            plan.error,
             options.error_append,
             options.error_close,
             sys.stderr,
@@ -233,15 +361,53 @@ class _RunOptions:
 
         assert not preexec_fn or callable(preexec_fn)
 
+        if input_bytes is not None:
+            self.input_size = len(input_bytes)
+            if self._use_memfd(input_bytes):
+                stdin = make_memfd(input_bytes)
+                self.open_fds.append(stdin)
+                input_bytes = None
+
         self.input_bytes = input_bytes
         self.kwd_args.update(
             stdin=stdin,
             stdout=stdout,
             stderr=stderr,
-            env=options.runtime_env(),
+            env=options.launch_env(),
             start_new_session=start_session,
             preexec_fn=preexec_fn,
         )
+        self._setup_sinks()
+
+    def _use_memfd(self, input_bytes: Union[bytes, bytearray]) -> bool:
+        "Return true if `input_bytes` should be passed to stdin using a memfd."
+        options = self.command.options
+        threshold = options.input_memfd
+        return (
+            CAN_MEMFD
+            and bool(threshold)
+            and not options.pty
+            and len(input_bytes) >= threshold
+        )
+
+    def _setup_sinks(self):
+        """Set up output pipes that the subprocess protocol copies directly
+        into a buffer, without a StreamReader or a copy task."""
+        options = self.command.options
+
+        if self.kwd_args["stdout"] == asyncio.subprocess.PIPE:
+            output = self.output_bytes
+            if isinstance(output, CaptureBuffer):
+                self.sinks[1] = output.write
+            elif isinstance(options.output, bytearray):
+                self.sinks[1] = options.output.extend
+
+        if self.kwd_args["stderr"] == asyncio.subprocess.PIPE:
+            error = self.output_bytes if self.is_stderr_only else self.error_bytes
+            if isinstance(error, (CaptureBuffer, HeadTailBuffer)):
+                self.sinks[2] = error.write
+            elif isinstance(options.error, bytearray):
+                self.sinks[2] = options.error.extend
 
     def _setup_pass_fds(self):
         "Set up `pass_fds` and `close_fds` if pass_fds is configured."
@@ -274,7 +440,7 @@ class _RunOptions:
             # Custom support for Redirect constants.
             if input_ == Redirect.INHERIT:
                 stdin = sys.stdin
-            elif input_ == Redirect.BUFFER:
+            elif input_ in (Redirect.BUFFER, Redirect.MMAP):
                 raise TypeError(f"unsupported input type: {input_!r}")
             else:
                 # CAPTURE uses stdin == PIPE.
@@ -285,7 +451,9 @@ class _RunOptions:
             if close:
                 self.open_fds.append(stdin)
         elif isinstance(input_, str):
-            input_bytes = encode_bytes(input_, encoding)
+            input_bytes = self.encoded_input
+            if input_bytes is None:
+                input_bytes = encode_bytes(input_, encoding)
         elif isinstance(input_, (asyncio.StreamReader, io.BytesIO, io.StringIO)):
             # Shellous-supported input classes.
             assert stdin == asyncio.subprocess.PIPE
@@ -309,22 +477,11 @@ class _RunOptions:
             self.open_fds.append(stdout)
         elif self.is_stderr_only and sys_stream == sys.stderr:
             assert output == Redirect.STDOUT
-            self.output_bytes = bytearray()
+            self.output_bytes = self._capture_buffer()
             assert stdout == asyncio.subprocess.PIPE
         elif isinstance(output, Redirect) and output.is_custom():
             # Custom support for Redirect constants.
-            if output == Redirect.BUFFER:
-                if sys_stream == sys.stdout:
-                    self.output_bytes = bytearray()
-                else:
-                    self.error_bytes = bytearray()
-                assert stdout == asyncio.subprocess.PIPE
-            elif output == Redirect.INHERIT:
-                stdout = sys_stream
-            else:
-                # CAPTURE uses stdout == PIPE.
-                assert output == Redirect.CAPTURE
-                assert stdout == asyncio.subprocess.PIPE
+            stdout = self._setup_custom_output(output, sys_stream)
         elif isinstance(output, int):
             # File descriptor or magic constant (e.g. DEVNULL).
             stdout = output
@@ -345,6 +502,53 @@ class _RunOptions:
 
         return stdout
 
+    def _setup_custom_output(self, output: Redirect, sys_stream: TextIO) -> Any:
+        "Set up process output for a custom Redirect constant."
+        if output == Redirect.BUFFER:
+            if sys_stream == sys.stdout:
+                self.output_bytes = self._capture_buffer()
+            else:
+                self.error_bytes = self._error_buffer()
+            return asyncio.subprocess.PIPE
+
+        if output == Redirect.MMAP:
+            buffer = MappedBuffer()
+            if sys_stream == sys.stdout:
+                self.output_bytes = buffer
+            else:
+                self.error_bytes = buffer
+            return buffer.fileno()
+
+        if output == Redirect.INHERIT:
+            return sys_stream
+
+        # CAPTURE uses stdout == PIPE.
+        assert output == Redirect.CAPTURE
+        return asyncio.subprocess.PIPE
+
+    def _capture_buffer(self) -> CaptureBuffer:
+        "Return buffer for capturing stdout."
+        options = self.command.options
+        limit = -1 if options.max_output is None else options.max_output
+        on_limit = None if options.max_output is None else self._output_truncated
+        if options.buffer_spill is not None:
+            return CaptureBuffer(limit, options.buffer_spill, on_limit)
+        return CaptureBuffer(limit, -1, on_limit)
+
+    def _error_buffer(self) -> HeadTailBuffer:
+        "Return buffer for capturing the start and end of stderr."
+        options = self.command.options
+        max_output = options.max_output
+        if max_output is None or max_output >= options.error_head + options.error_tail:
+            return HeadTailBuffer(options.error_head, options.error_tail)
+        return HeadTailBuffer(max_output, 0, on_limit=self._output_truncated)
+
+    def _output_truncated(self) -> None:
+        "Called when captured output exceeds `max_output`."
+        self.truncated = True
+        if self.on_truncate is not None:
+            self.on_truncate()
+
     def _setup_pty1(
         self,
         stdin: Any,
@@ -383,7 +587,7 @@ class _RunOptions:
         return stdin, stdout, stderr, lambda: pty_util.set_ctty(ttyname)
 
 
-class Runner:
+class Runner(OutputIterator):  # pylint: disable=too-many-instance-attributes
     """Runner is an asynchronous context manager that runs a command.
 
     ```
@@ -408,11 +612,18 @@ class Runner:
     _cancelled: bool = False
     _timer: Optional[asyncio.TimerHandle] = None
     _timed_out: bool = False
+    _cancel_pending: bool = False
     _last_signal: Optional[int] = None
+    _limiter: Optional[ConcurrencyLimiter] = None
+    _rusage: Optional[ResourceUsage] = None
+    _phases: dict[str, float]
 
     def __init__(self, command: "shellous.Command[Any]"):
         self._options = _RunOptions(command)
         self._tasks = []
+        self._phases = {}
+        if command.options.max_output_action == "cancel":
+            self._options.on_truncate = self._cancel_truncated
 
     @property
     def name(self) -> str:
@@ -451,6 +662,56 @@ class Runner:
         "Return True if the command was cancelled."
         return self._cancelled
 
+    @property
+    def timed_out(self) -> bool:
+        "Return True if the command was cancelled because its `timeout` expired."
+        return self._timed_out
+
+    @property
+    def rusage(self) -> Optional[ResourceUsage]:
+        """Return the process's resource usage after it exits.
+
+        Return None if the resource usage is not available.
+        """
+        if self._rusage is None and self._proc and self._proc.returncode is not None:
+            rusage = pop_rusage(self._proc.pid, self._phases.get("spawn"))
+            if rusage is not None:
+                self._rusage = ResourceUsage.from_rusage(rusage)
+        return self._rusage
+
+    @property
+    def timing(self) -> PhaseTiming:
+        "Return the timestamps for the phases of the run so far."
+        phases = self._phases.copy()
+        protocol = self._stream_protocol()
+        if protocol is not None:
+            # Output can arrive before `_subprocess_exec` returns; use the
+            # time the pipes were connected as the spawned time.
+            if protocol.connected is not None:
+                phases["spawned"] = protocol.connected
+            if protocol.first_output is not None:
+                phases["first_output"] = protocol.first_output
+            # The protocol's exit time is more precise than our waiter's.
+            if protocol.exited is not None:
+                phases["exited"] = protocol.exited
+        return PhaseTiming(**phases)
+
+    @property
+    def input_size(self) -> int:
+        "Return the number of bytes of input provided by `stdin()`."
+        return self._options.input_size
+
+    @property
+    def bytes_received(self) -> int:
+        """Return the number of bytes read from the stdout and stderr pipes.
+
+        Output read from a pty or redirected to a file is not counted.
+        """
+        protocol = self._stream_protocol()
+        if protocol is None:
+            return 0
+        return protocol.bytes_received
+
     def result(self) -> Result:
         "Check process exit code and raise a ResultError if necessary."
         code = self.returncode
@@ -458,10 +719,14 @@ class Runner:
 
         result = Result(
             exit_code=code,
-            output_bytes=bytes(self._options.output_bytes or b""),
-            error_bytes=bytes(self._options.error_bytes or b""),
+            output_bytes=_getvalue(self._options.output_bytes),
+            error_bytes=_getvalue(self._options.error_bytes),
+            error_size=_getsize(self._options.error_bytes),
             cancelled=self._cancelled,
             encoding=self._options.encoding,
+            rusage=self.rusage,
+            timing=self.timing,
+            truncated=self._options.truncated,
         )
 
         return check_result(
@@ -492,6 +757,14 @@ class Runner:
         if self.returncode is None:
             self._signal(self.command.options.cancel_signal)
 
+    def _cancel_truncated(self) -> None:
+        "Cancel the process because its output exceeded `max_output`."
+        if self._proc is None:
+            # Output arrived before the launch returned; `_start` cancels.
+            self._cancel_pending = True
+        else:
+            self.cancel()
+
     def _is_bsd_pty(self) -> bool:
         "Return true if we're running a pty on BSD."
         return BSD_DERIVED and bool(self._options.pty_fds)
@@ -598,6 +871,7 @@ class Runner:
     @log_method(LOG_DETAIL)
     async def __aenter__(self):
         "Set up redirections and launch subprocess."
+        self._mark("started")
         self._audit_callback("start")
         try:
             return await self._start()
@@ -617,47 +891,19 @@ class Runner:
         assert not self._tasks
 
         try:
+            # Wait for a slot before allocating any resources.
+            await self._acquire_slot()
+            self._mark("setup")
+
             # Set up subprocess arguments and launch subprocess.
+            await self._options.encode_input()
             with self._options as opts:
                 await self._subprocess_spawn(opts)
 
-            assert self._proc is not None
-            stdin = self._proc.stdin
-            stdout = self._proc.stdout
-            stderr = self._proc.stderr
-
-            # Assign pty streams.
-            if opts.pty_fds:
-                assert (stdin, stdout) == (None, None)
-                stdin, stdout = opts.pty_fds.writer, opts.pty_fds.reader
-
-            if stderr is not None:
-                limit = -1
-                if opts.error_bytes is not None:
-                    error = opts.error_bytes
-                    limit = RESULT_STDERR_LIMIT
-                elif opts.is_stderr_only:
-                    assert stdout is None
-                    assert opts.output_bytes is not None
-                    error = opts.output_bytes
-                else:
-                    error = opts.command.options.error
-                stderr = self._setup_output_sink(
-                    stderr, error, opts.encoding, "stderr", limit
-                )
+            if self._cancel_pending:
+                self.cancel()
 
-            if stdout is not None:
-                limit = -1
-                if opts.output_bytes is not None:
-                    output = opts.output_bytes
-                else:
-                    output = opts.command.options.output
-                stdout = self._setup_output_sink(
-                    stdout, output, opts.encoding, "stdout", limit
-                )
-
-            if stdin is not None:
-                stdin = self._setup_input_source(stdin, opts)
+            stdin, stdout, stderr = self._setup_streams(opts)
 
         except (Exception, asyncio.CancelledError) as ex:
             LOGGER.debug("Runner._start %r ex=%r", self, ex)
@@ -665,6 +911,7 @@ class Runner:
                 self._set_cancelled()
             if self._proc:
                 await self._kill()
+            self._release_slot()
             raise
 
         # Make final streams available. These may be different from `self.proc`
@@ -682,6 +929,60 @@ class Runner:
 
         return self
 
+    def _setup_streams(self, opts: _RunOptions):
+        """Set up tasks to copy the process streams, and return the
+        (stdin, stdout, stderr) streams left for the caller."""
+        assert self._proc is not None
+        stdin = self._proc.stdin
+        stdout = self._proc.stdout
+        stderr = self._proc.stderr
+
+        # Assign pty streams.
+        if opts.pty_fds:
+            assert (stdin, stdout) == (None, None)
+            stdin, stdout = opts.pty_fds.writer, opts.pty_fds.reader
+
+        if stderr is not None:
+            if opts.error_bytes is not None:
+                error = opts.error_bytes
+            elif opts.is_stderr_only:
+                assert stdout is None
+                assert opts.output_bytes is not None
+                error = opts.output_bytes
+            else:
+                error = opts.command.options.error
+            stderr = self._setup_output_sink(stderr, error, opts.encoding, "stderr")
+
+        if stdout is not None:
+            if opts.output_bytes is not None:
+                output = opts.output_bytes
+            else:
+                output = opts.command.options.output
+            stdout = self._setup_output_sink(stdout, output, opts.encoding, "stdout")
+
+        if opts.sinks:
+            protocol = self._stream_protocol()
+            assert protocol is not None
+            self.add_task(protocol.wait_sinks(), "sinks")
+
+        if stdin is not None:
+            stdin = self._setup_input_source(stdin, opts)
+
+        return stdin, stdout, stderr
+
+    async def _acquire_slot(self):
+        "Wait for a slot if the command has a concurrency limit."
+        limiter = self.command.options.max_concurrency
+        if limiter is not None:
+            await limiter.acquire(self.command.options.priority)
+            self._limiter = limiter
+
+    def _release_slot(self):
+        "Release our concurrency slot, if we have one."
+        if self._limiter is not None:
+            self._limiter.release()
+            self._limiter = None
+
     @log_method(LOG_DETAIL)
     async def _subprocess_spawn(self, opts: _RunOptions):
         "Start the subprocess."
@@ -689,7 +990,9 @@ class Runner:
 
         # Second half of pty setup.
         if opts.pty_fds:
-            opts.pty_fds = await opts.pty_fds.open_streams()
+            opts.pty_fds = await opts.pty_fds.open_streams(
+                self.command.options.stream_limit
+            )
 
         # Check for task cancellation and yield right before exec'ing. If the
         # current task is already cancelled, this will raise a CancelledError,
@@ -707,15 +1010,36 @@ class Runner:
     @log_method(LOG_DETAIL)
     async def _subprocess_exec(self, opts: _RunOptions):
         "Start the subprocess and assign to `self.proc`."
+        self._mark("spawn")
         with log_timer("asyncio.create_subprocess_exec"):
             sys.audit(EVENT_SHELLOUS_EXEC, opts.pos_args[0])
-            with pty_util.set_ignore_child_watcher(
-                BSD_DERIVED and opts.pty_fds is not None
-            ):
-                self._proc = await asyncio.create_subprocess_exec(
+            launcher = opts.select_launcher()
+            limit = self.command.options.stream_limit
+            if launcher == "posix_spawn":
+                self._proc = await spawn.create_subprocess_spawn(
                     *opts.pos_args,
+                    sinks=opts.sinks,
+                    limit=limit,
                     **opts.kwd_args,
                 )
+            elif launcher == "forkserver":
+                self._proc = await forkserver.create_subprocess_forkserver(
+                    *opts.pos_args,
+                    sinks=opts.sinks,
+                    limit=limit,
+                    **opts.kwd_args,
+                )
+            else:
+                with pty_util.set_ignore_child_watcher(
+                    BSD_DERIVED and opts.pty_fds is not None
+                ):
+                    self._proc = await spawn.create_subprocess_exec(
+                        *opts.pos_args,
+                        sinks=opts.sinks,
+                        limit=limit,
+                        **opts.kwd_args,
+                    )
+        self._mark("spawned")
 
     @log_method(LOG_DETAIL)
     async def _waiter(self):
@@ -727,9 +1051,23 @@ class Runner:
                 await self._wait_pid()
             else:
                 await self._proc.wait()
+            self._mark("exited")
         finally:
             self._stop_timer()
 
+    def _mark(self, phase: str):
+        "Record the time when `phase` was reached."
+        self._phases[phase] = time.monotonic()
+
+    def _stream_protocol(self) -> Optional[spawn.StreamProtocol]:
+        "Return the process's `StreamProtocol`, or None if not running."
+        if self._proc is None:
+            return None
+        protocol = self._proc._protocol  # pyright: ignore
+        if not isinstance(protocol, spawn.StreamProtocol):
+            return None
+        return protocol
+
     def _set_cancelled(self):
         "Set the cancelled flag, and cancel any inflight timers."
         self._cancelled = True
@@ -781,8 +1119,13 @@ class Runner:
             return None
 
         if isinstance(source, io.StringIO):
-            input_bytes = encode_bytes(source.getvalue(), opts.encoding)
-            self.add_task(redir.write_stream(input_bytes, stream, eof), tag)
+            offload = opts.command.options.codec_offload
+            self.add_task(
+                redir.write_text(
+                    source.getvalue(), opts.encoding, stream, eof, offload
+                ),
+                tag,
+            )
             return None
 
         return stream
@@ -793,34 +1136,25 @@ class Runner:
         sink: Any,
         encoding: str,
         tag: str,
-        limit: int = -1,
     ) -> Optional[asyncio.StreamReader]:
         "Set up a task to write to custom output sink."
-        if isinstance(sink, io.StringIO):
-            self.add_task(redir.copy_stringio(stream, sink, encoding), tag)
-            return None
-
-        if isinstance(sink, io.BytesIO):
-            self.add_task(redir.copy_bytesio(stream, sink), tag)
-            return None
-
-        if isinstance(sink, bytearray):
-            # N.B. `limit` is only supported for bytearray.
-            if limit >= 0:
-                self.add_task(redir.copy_bytearray_limit(stream, sink, limit), tag)
-            else:
-                self.add_task(redir.copy_bytearray(stream, sink), tag)
-            return None
-
-        if isinstance(sink, Logger):
-            self.add_task(redir.copy_logger(stream, sink, encoding), tag)
-            return None
-
-        if isinstance(sink, asyncio.StreamWriter):
-            self.add_task(redir.copy_streamwriter(stream, sink), tag)
-            return None
+        if isinstance(sink, (CaptureBuffer, HeadTailBuffer)):
+            coro = redir.copy_buffer(stream, sink)
+        elif isinstance(sink, io.StringIO):
+            coro = redir.copy_stringio(stream, sink, encoding)
+        elif isinstance(sink, io.BytesIO):
+            coro = redir.copy_bytesio(stream, sink)
+        elif isinstance(sink, bytearray):
+            coro = redir.copy_bytearray(stream, sink)
+        elif isinstance(sink, Logger):
+            coro = redir.copy_logger(stream, sink, encoding)
+        elif isinstance(sink, asyncio.StreamWriter):
+            coro = redir.copy_streamwriter(stream, sink)
+        else:
+            return stream
 
-        return stream
+        self.add_task(coro, tag)
+        return None
 
     @log_method(LOG_DETAIL)
     async def __aexit__(
@@ -838,6 +1172,7 @@ class Runner:
             self._set_cancelled()
         finally:
             self._stop_timer()  # failsafe just in case
+            self._release_slot()
             self._audit_callback("stop")
         # If `timeout` expired, raise TimeoutError rather than CancelledError.
         if (
@@ -864,11 +1199,20 @@ class Runner:
             return False
 
         finally:
+            self._mark("drained")
             await self._close()
+            self._mark("closed")
 
     @log_method(LOG_DETAIL)
     async def _close(self):
         "Make sure that our resources are properly closed."
+        try:
+            await self._close_resources()
+        finally:
+            await self._cancel_tasks()
+
+    async def _close_resources(self):
+        "Close the pty, transport, buffers and stdin."
         assert self._proc is not None
 
         if self._options.pty_fds:
@@ -876,6 +1220,7 @@ class Runner:
 
         # Make sure the transport is closed (for asyncio and uvloop).
         self._proc._transport.close()  # pyright: ignore
+        self._options.close_buffers()
 
         # _close can be called when unwinding exceptions. We need to handle
         # the case that the process has not exited yet.
@@ -883,6 +1228,9 @@ class Runner:
             LOGGER.critical("Runner._close process still running %r", self._proc)
             return
 
+        # Claim the resource usage, so it doesn't linger in the registry.
+        _ = self.rusage
+
         try:
             # Make sure that original stdin is properly closed. `wait_closed`
             # will raise a BrokenPipeError if not all input was properly written.
@@ -898,6 +1246,19 @@ class Runner:
         except asyncio.TimeoutError:
             LOGGER.critical("Runner._close %r timeout stdin=%r", self, self._proc.stdin)
 
+    async def _cancel_tasks(self):
+        """Cancel and consume background tasks that are still pending.
+
+        This includes the task that waits for output sinks to close, which
+        doesn't finish if the process's pipes stay open.
+        """
+        pending = [task for task in self._tasks if not task.done()]
+        if pending:
+            LOGGER.debug("Runner._close %r cancel tasks=%r", self, pending)
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+
     def _audit_callback(
         self,
         phase: str,
@@ -925,23 +1286,16 @@ class Runner:
             procinfo = " pid=None"
         return f"<Runner {self.name!r}{cancelled}{procinfo}>"
 
-    async def _readlines(self):
-        "Iterate over lines in stdout/stderr"
-        stream = self.stdout or self.stderr
-        if stream:
-            async for line in redir.read_lines(stream, self._options.encoding):
-                yield line
-
-    def __aiter__(self) -> AsyncIterator[str]:
-        "Return asynchronous iterator over stdout/stderr."
-        return self._readlines()
+    def _iter_options(self) -> "tuple[str, shellous.Options]":
+        "Return the encoding and options used to read the output."
+        return self._options.encoding, self.command.options
 
     @staticmethod
     async def run_command(
         command: "shellous.Command[Any]",
         *,
         _run_future: Optional[asyncio.Future["Runner"]] = None,
-    ) -> Union[str, Result]:
+    ) -> Union[str, bytes, Result]:
         "Run a command. This is the main entry point for Runner."
         if not _run_future and _is_multiple_capture(command):
             LOGGER.warning("run_command: multiple capture requires 'async with'")
@@ -953,243 +1307,19 @@ class Runner:
                 # Return streams to caller in another task.
                 _run_future.set_result(run)
 
-        result = run.result()
-        if command.options._return_result:
-            return result
-        return result.output
-
-
-class PipeRunner:
-    """PipeRunner is an asynchronous context manager that runs a pipeline.
-
-    ```
-    async with pipe.run() as run:
-        # process run.stdin, run.stdout, run.stderr (if not None)
-    result = run.result()
-    ```
-    """
-
-    stdin: Optional[asyncio.StreamWriter] = None
-    "Pipeline standard input."
-
-    stdout: Optional[asyncio.StreamReader] = None
-    "Pipeline standard output."
-
-    stderr: Optional[asyncio.StreamReader] = None
-    "Pipeline standard error."
-
-    _pipe: "shellous.Pipeline[Any]"
-    _capturing: bool
-    _tasks: list[asyncio.Task[Any]]
-    _encoding: str
-    _cancelled: bool = False
-    _results: Optional[list[Union[BaseException, Result]]] = None
-
-    def __init__(self, pipe: "shellous.Pipeline[Any]", *, capturing: bool):
-        """`capturing=True` indicates we are within an `async with` block and
-        client needs to access `stdin` and `stderr` streams.
-        """
-        assert len(pipe.commands) > 1
-
-        self._pipe = pipe
-        self._cancelled = False
-        self._tasks = []
-        self._capturing = capturing
-        self._encoding = pipe.options.encoding
-
-    @property
-    def name(self) -> str:
-        "Return name of the pipeline."
-        return self._pipe.name
-
-    def result(self) -> Result:
-        "Return `Result` object for PipeRunner."
-        assert self._results is not None
-
-        return check_result(
-            convert_result_list(self._results, self._cancelled),
-            self._pipe.options,
-            self._cancelled,
-        )
-
-    def add_task(
-        self,
-        coro: Coroutine[Any, Any, _T],
-        tag: str = "",
-    ) -> asyncio.Task[_T]:
-        "Add a background task."
-        task_name = f"{self.name}#{tag}"
-        task = asyncio.create_task(coro, name=task_name)
-        self._tasks.append(task)
-        return task
-
-    @log_method(LOG_DETAIL)
-    async def _wait(self, *, kill: bool = False):
-        "Wait for pipeline to finish."
-        assert self._results is None
-
-        if kill:
-            LOGGER.debug("PipeRunner.wait killing pipe %r", self)
-            for task in self._tasks:
-                task.cancel()
-
-        cancelled, self._results = await harvest_results(*self._tasks, trustee=self)
-        if cancelled:
-            self._cancelled = True
-        self._tasks.clear()  # clear all tasks when done
-
-    @log_method(LOG_DETAIL)
-    async def __aenter__(self):
-        "Set up redirections and launch pipeline."
-        try:
-            return await self._start()
-        except (Exception, asyncio.CancelledError) as ex:
-            LOGGER.warning("PipeRunner enter %r ex=%r", self, ex)
-            if _is_cancelled(ex):
-                self._cancelled = True
-            await self._wait(kill=True)
-            raise
-
-    @log_method(LOG_DETAIL)
-    async def __aexit__(
-        self,
-        _exc_type: Union[type[BaseException], None],
-        exc_value: Union[BaseException, None],
-        _exc_tb: Optional[TracebackType],
-    ):
-        "Wait for pipeline to exit and handle cancellation."
-        suppress = False
-        try:
-            suppress = await self._finish(exc_value)
-        except asyncio.CancelledError:
-            LOGGER.warning("PipeRunner cancelled inside _finish %r", self)
-            self._cancelled = True
-        return suppress
+        return await convert_output(run.result(), command.options)
 
-    @log_method(LOG_DETAIL)
-    async def _finish(self, exc_value: Optional[BaseException]) -> bool:
-        "Wait for pipeline to exit and handle cancellation."
-        if exc_value is not None:
-            LOGGER.warning("PipeRunner._finish exc_value=%r", exc_value)
-            if _is_cancelled(exc_value):
-                self._cancelled = True
-            await self._wait(kill=True)
-            return self._cancelled
-
-        await self._wait()
-        return False
 
-    @log_method(LOG_DETAIL)
-    async def _start(self):
-        "Set up redirection and launch pipeline."
-        open_fds = []
-
-        try:
-            stdin = None
-            stdout = None
-            stderr = None
-
-            cmds = self._setup_pipeline(open_fds)
-
-            if self._capturing:
-                stdin, stdout, stderr = await self._setup_capturing(cmds)
-            else:
-                for cmd in cmds:
-                    self.add_task(cmd.coro())
-
-            self.stdin = stdin
-            self.stdout = stdout
-            self.stderr = stderr
-
-            return self
-
-        except BaseException:  # pylint: disable=broad-except
-            # Clean up after any exception *including* CancelledError.
-            close_fds(open_fds)
-            raise
-
-    def _setup_pipeline(self, open_fds: list[int]):
-        """Return the pipeline stitched together with pipe fd's.
-
-        Each created open file descriptor is added to `open_fds` so it can
-        be closed if there's an exception later.
-        """
-        cmds = list(self._pipe.commands)
-
-        cmd_count = len(cmds)
-        for i in range(cmd_count - 1):
-            (read_fd, write_fd) = os.pipe()
-            open_fds.extend((read_fd, write_fd))
-
-            cmds[i] = cmds[i].stdout(write_fd, close=True)
-            cmds[i + 1] = cmds[i + 1].stdin(read_fd, close=True)
-
-        for i in range(cmd_count):
-            cmds[i] = cmds[i].set(_return_result=True, _catch_cancelled_error=True)
-
-        return cmds
-
-    @log_method(LOG_DETAIL)
-    async def _setup_capturing(self, cmds: "list[shellous.Command[Any]]"):
-        """Set up capturing and return (stdin, stdout, stderr) streams."""
-        loop = asyncio.get_event_loop()
-        first_fut = loop.create_future()
-        last_fut = loop.create_future()
-
-        first_coro = cmds[0].coro(_run_future=first_fut)
-        last_coro = cmds[-1].coro(_run_future=last_fut)
-        middle_coros = [cmd.coro() for cmd in cmds[1:-1]]
-
-        # Tag each task name with the index of the command in the pipe.
-        self.add_task(first_coro, "0")
-        for i, coro in enumerate(middle_coros):
-            self.add_task(coro, str(i + 1))
-        self.add_task(last_coro, str(len(cmds) - 1))
-
-        # When capturing, we need the first and last commands in the
-        # pipe to signal when they are ready.
-        first_ready, last_ready = await asyncio.gather(first_fut, last_fut)
-
-        stdin, stdout, stderr = (
-            first_ready.stdin,
-            last_ready.stdout,
-            last_ready.stderr,
-        )
-
-        return (stdin, stdout, stderr)
-
-    def __repr__(self) -> str:
-        "Return string representation of PipeRunner."
-        cancelled_info = ""
-        if self._cancelled:
-            cancelled_info = " cancelled"
-        result_info = ""
-        if self._results:
-            result_info = f" results={self._results!r}"
-        return f"<PipeRunner {self.name!r}{cancelled_info}{result_info}>"
-
-    async def _readlines(self) -> AsyncIterator[str]:
-        "Iterate over lines in stdout/stderr"
-        stream = self.stdout or self.stderr
-        if stream:
-            async for line in redir.read_lines(stream, self._encoding):
-                yield line
-
-    def __aiter__(self) -> AsyncIterator[str]:
-        "Return asynchronous iterator over stdout/stderr."
-        return self._readlines()
-
-    @staticmethod
-    async def run_pipeline(pipe: "shellous.Pipeline[Any]") -> Union[str, Result]:
-        "Run a pipeline. This is the main entry point for PipeRunner."
-        run = PipeRunner(pipe, capturing=False)
-        async with run:
-            pass
-
-        result = run.result()
-        if pipe.options._return_result:
-            return result
-        return result.output
+def _without_limiter(
+    cmd: "Union[shellous.Command[Any], shellous.Pipeline[Any]]",
+) -> "Union[shellous.Command[Any], shellous.Pipeline[Any]]":
+    "Return the command or pipeline with its concurrency limit removed."
+    if isinstance(cmd, shellous.Command):
+        return cmd.set(max_concurrency=None)
+    return dataclasses.replace(
+        cmd,
+        commands=tuple(subcmd.set(max_concurrency=None) for subcmd in cmd.commands),
+    )
 
 
 def _uses_process_substitution(cmd: "shellous.Command[Any]") -> bool:
@@ -1236,6 +1366,28 @@ def _signame(signal: Any) -> str:
         return str(signal)
 
 
+def _getvalue(
+    buffer: Optional[Union[CaptureBuffer, HeadTailBuffer, MappedBuffer]]
+) -> bytes:
+    """Return contents of capture buffer, or empty bytes if there is no buffer.
+
+    The contents of a MappedBuffer, or a spilled CaptureBuffer, are a read-only
+    memoryview. This only happens when the caller opts in to mapped output.
+    """
+    if buffer is None:
+        return b""
+    return cast(bytes, buffer.getvalue())
+
+
+def _getsize(
+    buffer: Optional[Union[CaptureBuffer, HeadTailBuffer, MappedBuffer]]
+) -> Optional[int]:
+    "Return total size of output written to a stderr buffer, if it has one."
+    if isinstance(buffer, HeadTailBuffer):
+        return buffer.size
+    return None
+
+
 def _set_position(output: Any, append: bool):
     "Truncate/seek output stream object."
     if isinstance(output, bytearray):
@@ -0,0 +1,90 @@
+"Implements a concurrency limiter for running commands."
+
+import asyncio
+import heapq
+import itertools
+from typing import Any
+
+from shellous.log import LOG_DETAIL, LOGGER
+
+
+class ConcurrencyLimiter:
+    """Limits the number of commands running at the same time.
+
+    A command acquires a slot before its process is launched and releases it
+    after the process exits. Waiting commands are admitted in priority order;
+    a higher `priority` value runs first. Waiters with the same priority are
+    admitted in FIFO order.
+
+    A limiter is created by `sh.set(max_concurrency=N)` and shared by all
+    commands derived from that context. To share a limit across contexts, pass
+    the same ConcurrencyLimiter object to `set(max_concurrency=...)`.
+    """
+
+    _max_concurrency: int
+    _running: int
+    _waiters: list[tuple[int, int, "asyncio.Future[None]"]]
+
+    def __init__(self, max_concurrency: int):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self._max_concurrency = max_concurrency
+        self._running = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    @property
+    def max_concurrency(self) -> int:
+        "Maximum number of commands that can run at the same time."
+        return self._max_concurrency
+
+    @property
+    def running(self) -> int:
+        "Number of slots currently in use."
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        "Number of commands waiting for a slot."
+        return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+
+    async def acquire(self, priority: int = 0) -> None:
+        "Wait for a slot to become available."
+        if self._running < self._max_concurrency and not self._waiters:
+            self._running += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (-priority, next(self._sequence), waiter))
+        if LOG_DETAIL:
+            LOGGER.debug("ConcurrencyLimiter waiting %r", self)
+
+        try:
+            # When `release` wakes us, it hands its slot over to us.
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # We were given a slot, but we were cancelled before we could
+                # use it. Pass the slot on to the next waiter.
+                self.release()
+            raise
+
+    def release(self) -> None:
+        "Release a slot and wake the next waiter, if any."
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        assert self._running > 0
+        self._running -= 1
+
+    def __repr__(self) -> str:
+        return (
+            f"ConcurrencyLimiter(max_concurrency={self._max_concurrency}, "
+            f"running={self._running}, waiting={self.waiting})"
+        )
+
+    def __reduce__(self) -> Any:
+        # Only the configuration is pickled, not the current state.
+        return (ConcurrencyLimiter, (self._max_concurrency,))
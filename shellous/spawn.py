@@ -0,0 +1,511 @@
+"""Implements alternative process launchers used by Runner.
+
+The default launcher uses `asyncio.create_subprocess_exec`. The "posix_spawn"
+launcher calls `os.posix_spawn` directly. The "forkserver" launcher asks a
+helper process to launch the child (see forkserver.py). The child process is
+connected to the same asyncio pipe transports, so the `Runner` streams work as
+usual.
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import time
+import warnings
+from asyncio.base_subprocess import BaseSubprocessTransport
+from asyncio.subprocess import Process, SubprocessStreamProtocol
+from typing import Any, Awaitable, Callable, Literal, Optional, Union, cast
+
+from shellous.log import LOG_DETAIL, LOGGER
+from shellous.util import pop_rusage, wait_pid
+
+LauncherT = Literal["asyncio", "posix_spawn", "forkserver"]
+
+LAUNCHERS: tuple[LauncherT, ...] = ("asyncio", "posix_spawn", "forkserver")
+"Names of the supported process launchers."
+
+# Same as asyncio's default StreamReader limit.
+DEFAULT_LIMIT = 2**16
+
+# Names of the standard stream arguments, in file descriptor order.
+_STD_NAMES = ("stdin", "stdout", "stderr")
+
+# Signals that Python ignores; restore their default handlers in the child,
+# like `subprocess.Popen(restore_signals=True)`.
+RESTORE_SIGNALS: tuple[int, ...] = tuple(
+    getattr(signal, name)
+    for name in ("SIGPIPE", "SIGXFZ", "SIGXFSZ")
+    if hasattr(signal, name)
+)
+
+
+SinkMap = dict[int, Callable[[bytes], None]]
+"Map of file descriptor (1 or 2) to a function that consumes its output."
+
+
+class StreamProtocol(SubprocessStreamProtocol):
+    """Subprocess protocol used by all launchers.
+
+    Records the time when the process's pipes are connected, when the first
+    byte of stdout arrives, and when the process exits (`time.monotonic()`).
+    Also counts the bytes received from the process.
+
+    Output from a file descriptor in `sinks` is passed directly to the sink
+    function as it arrives, instead of being buffered in a StreamReader. Use
+    `wait_sinks()` to wait until all of these pipes are closed.
+    """
+
+    connected: Optional[float] = None
+    "Time when the process's pipes were connected."
+
+    first_output: Optional[float] = None
+    "Time when the first byte of stdout arrived."
+
+    exited: Optional[float] = None
+    "Time when the process exited."
+
+    bytes_received: int = 0
+    "Number of bytes received from stdout and stderr pipes."
+
+    _sinks: SinkMap
+    _open_sinks: set[int]
+    _sinks_closed: "asyncio.Future[None]"
+
+    def __init__(
+        self,
+        limit: int,
+        loop: asyncio.AbstractEventLoop,
+        sinks: Optional[SinkMap] = None,
+    ):
+        super().__init__(limit=limit, loop=loop)
+        self._sinks = dict(sinks) if sinks else {}
+        self._open_sinks = set()
+        self._sinks_closed = loop.create_future()
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        "Record the connect time, and drop StreamReaders replaced by sinks."
+        self.connected = time.monotonic()
+        super().connection_made(transport)
+
+        assert isinstance(transport, asyncio.SubprocessTransport)
+        for fdesc in self._sinks:
+            if transport.get_pipe_transport(fdesc) is not None:
+                self._open_sinks.add(fdesc)
+                # Drop the StreamReader; the sink consumes the output.
+                if fdesc == 1:
+                    self.stdout = None
+                else:
+                    self.stderr = None
+
+        if not self._open_sinks:
+            self._sinks_closed.set_result(None)
+
+    def pipe_data_received(self, fd: int, data: Union[bytes, str]) -> None:
+        "Pass data to the sink for `fd`, or to its StreamReader."
+        if fd == 1 and self.first_output is None:
+            self.first_output = time.monotonic()
+        self.bytes_received += len(data)
+
+        sink = self._sinks.get(fd)
+        if sink is not None:
+            # Pipe transports always deliver bytes.
+            sink(cast(bytes, data))
+        else:
+            super().pipe_data_received(fd, data)
+
+    def pipe_connection_lost(self, fd: int, exc: Optional[Exception]) -> None:
+        "Release the sink for `fd` when its pipe is closed."
+        super().pipe_connection_lost(fd, exc)
+
+        if fd in self._open_sinks:
+            if exc is not None:
+                LOGGER.warning("StreamProtocol sink fd=%r exc=%r", fd, exc)
+            # Release the sink. The protocol can be part of a reference cycle,
+            # and the sink may refer to a large buffer.
+            del self._sinks[fd]
+            self._open_sinks.remove(fd)
+            if not self._open_sinks:
+                self._sinks_closed.set_result(None)
+
+    def process_exited(self) -> None:
+        "Record the time when the process exited."
+        self.exited = time.monotonic()
+        super().process_exited()
+
+    async def wait_sinks(self) -> None:
+        "Wait until the pipes read by the sink functions are closed."
+        await asyncio.shield(self._sinks_closed)
+
+
+async def create_subprocess_exec(
+    *args: Any,
+    stdin: Any = None,
+    stdout: Any = None,
+    stderr: Any = None,
+    sinks: Optional[SinkMap] = None,
+    limit: int = DEFAULT_LIMIT,
+    **kwds: Any,
+) -> Process:
+    """Launch a process using the event loop's `subprocess_exec`.
+
+    This is the same as `asyncio.create_subprocess_exec`, except that it uses
+    `StreamProtocol`.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.subprocess_exec(
+        lambda: StreamProtocol(limit, loop, sinks),
+        *args,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=stderr,
+        **kwds,
+    )
+    return Process(transport, protocol, loop)
+
+
+def can_posix_spawn(kwd_args: dict[str, Any]) -> bool:
+    """Return true if the process described by `kwd_args` can be launched by
+    `os.posix_spawn`.
+
+    posix_spawn cannot run a `preexec_fn`, start a new session, or close/pass
+    arbitrary file descriptors. A pty always requires a `preexec_fn`.
+    """
+    if not hasattr(os, "posix_spawn"):
+        return False  # pragma: no cover
+
+    if (
+        kwd_args.get("preexec_fn") is not None
+        or kwd_args.get("start_new_session")
+        or kwd_args.get("close_fds")
+        or kwd_args.get("pass_fds")
+    ):
+        return False
+
+    return all(
+        _is_spawnable_fd(kwd_args.get(name), target)
+        for target, name in enumerate(_STD_NAMES)
+    )
+
+
+def _is_spawnable_fd(spec: Any, target: int) -> bool:
+    "Return true if `spec` can be mapped to `target` using file actions."
+    if spec is None or spec in (
+        subprocess.PIPE,
+        subprocess.DEVNULL,
+        subprocess.STDOUT,
+    ):
+        return True
+    fdesc = spec if isinstance(spec, int) else spec.fileno()
+    # Don't try to shuffle the standard file descriptors among themselves.
+    return fdesc == target or fdesc > 2
+
+
+class SpawnedProcess:
+    """Minimal `subprocess.Popen` look-alike for a process we launched.
+
+    `files` holds the parent's ends of the stdin, stdout and stderr pipes (or
+    None).
+    """
+
+    pid: int
+    returncode: Optional[int]
+    stdin: Any
+    stdout: Any
+    stderr: Any
+
+    def __init__(self, pid: int, files: list[Any]):
+        self.pid = pid
+        self.returncode = None
+        self.stdin, self.stdout, self.stderr = files
+
+    def poll(self) -> Optional[int]:
+        "Return the exit status if the child watcher has reported it."
+        return self.returncode
+
+    def send_signal(self, sig: int) -> None:
+        "Send a signal to the process if it has not been reaped."
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self) -> None:
+        "Terminate the process."
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self) -> None:
+        "Kill the process."
+        self.send_signal(signal.SIGKILL)
+
+    def watch(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        transport: "SpawnTransport",
+    ) -> None:
+        """Arrange for `transport` to be notified when the process exits.
+
+        On Linux, we add a reader for the process's pidfd to the event loop. On
+        other platforms, we use the asyncio child watcher.
+        """
+        pid = self.pid
+
+        if hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(pid)
+            except OSError as ex:
+                LOGGER.warning("os.pidfd_open failed pid=%r ex=%r", pid, ex)
+            else:
+                loop.add_reader(pidfd, _reap_pidfd, loop, pidfd, pid, transport)
+                return
+
+        with warnings.catch_warnings():
+            # The child watcher API is deprecated in Python 3.12.
+            warnings.simplefilter("ignore", DeprecationWarning)
+            watcher = asyncio.get_child_watcher()
+
+        watcher.add_child_handler(pid, _child_exited, loop, transport)
+
+
+def open_stdio(stdin: Any, stdout: Any, stderr: Any) -> tuple[list[Any], list[Any]]:
+    """Translate the standard stream arguments for a new child process.
+
+    Returns `(sources, parent_files)`. `sources[target]` is None to inherit the
+    parent's fd, an fd to duplicate into `target`, `subprocess.DEVNULL`, or
+    `subprocess.STDOUT`. When `sources[target]` is the child end of a new
+    pipe, the caller must close it after the child is launched (see
+    `close_pipe_ends`).
+    """
+    sources: list[Any] = []
+    parent_files: list[Any] = []
+
+    try:
+        for target, spec in enumerate((stdin, stdout, stderr)):
+            if spec == subprocess.PIPE:
+                read_fd, write_fd = os.pipe()
+                if target == 0:
+                    child_fd, parent_fd = read_fd, write_fd
+                else:
+                    child_fd, parent_fd = write_fd, read_fd
+                sources.append(_PipeEnd(child_fd))
+                mode = "wb" if target == 0 else "rb"
+                file = open(  # pylint: disable=consider-using-with
+                    parent_fd, mode, buffering=0
+                )
+                parent_files.append(file)
+                continue
+
+            if spec is None or spec in (subprocess.DEVNULL, subprocess.STDOUT):
+                sources.append(spec)
+            else:
+                sources.append(spec if isinstance(spec, int) else spec.fileno())
+            parent_files.append(None)
+
+    except BaseException:
+        close_pipe_ends(sources)
+        _close_files(parent_files)
+        raise
+
+    return sources, parent_files
+
+
+class _PipeEnd(int):
+    "Child end of a pipe created by `open_stdio`."
+
+
+def close_pipe_ends(sources: list[Any]) -> None:
+    "Close the child ends of any pipes created by `open_stdio`."
+    for source in sources:
+        if isinstance(source, _PipeEnd):
+            os.close(source)
+
+
+def _close_files(files: list[Any]) -> None:
+    "Close the parent's ends of any pipes created by `open_stdio`."
+    for file in files:
+        if file is not None:
+            file.close()
+
+
+def _posix_spawn(
+    args: list[Union[str, bytes, os.PathLike[Any]]],
+    sources: list[Any],
+    env: Optional[dict[Any, Any]],
+) -> int:
+    "Launch a process using `os.posix_spawn` and return its pid."
+    file_actions = [
+        action
+        for target, source in enumerate(sources)
+        if (action := _file_action(source, target)) is not None
+    ]
+    argv = [os.fspath(arg) for arg in args]
+    pid = os.posix_spawn(
+        argv[0],
+        argv,
+        os.environ if env is None else env,
+        file_actions=file_actions,
+        setsigdef=RESTORE_SIGNALS,
+    )
+
+    if LOG_DETAIL:
+        LOGGER.debug("os.posix_spawn %r pid=%r", argv[0], pid)
+
+    return pid
+
+
+def _file_action(source: Any, target: int) -> Optional[tuple[Any, ...]]:
+    "Return the posix_spawn file action that sets up the child's `target` fd."
+    if source is None:
+        return None  # inherit
+
+    if source == subprocess.DEVNULL:
+        flags = os.O_RDONLY if target == 0 else os.O_WRONLY
+        return (os.POSIX_SPAWN_OPEN, target, os.devnull, flags, 0)
+
+    if source == subprocess.STDOUT:
+        assert target == 2
+        return (os.POSIX_SPAWN_DUP2, 1, 2)
+
+    if source != target or isinstance(source, _PipeEnd):
+        return (os.POSIX_SPAWN_DUP2, source, target)
+    return None
+
+
+class SpawnTransport(BaseSubprocessTransport):
+    """Subprocess transport for a process that is already launched.
+
+    The process is passed using the `process` keyword argument.
+    """
+
+    # The process is a `SpawnedProcess`, not a `subprocess.Popen`.
+    _proc: Any
+
+    def _start(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self,
+        args: list[Any],
+        shell: bool,
+        stdin: Any,
+        stdout: Any,
+        stderr: Any,
+        bufsize: int,
+        **kwargs: Any,
+    ) -> None:
+        assert not shell
+        if bufsize != 0:
+            raise ValueError("bufsize must be 0")
+        self._proc = kwargs["process"]
+
+
+def _reap_pidfd(
+    loop: asyncio.AbstractEventLoop,
+    pidfd: int,
+    pid: int,
+    transport: SpawnTransport,
+) -> None:
+    "Called by the event loop when the pidfd becomes readable."
+    status = wait_pid(pid)
+    if status is None:
+        return  # pragma: no cover
+
+    loop.remove_reader(pidfd)
+    os.close(pidfd)
+    loop.call_soon(
+        transport._process_exited,  # pyright: ignore[reportPrivateUsage]
+        status,
+    )
+
+
+def _child_exited(
+    _pid: int,
+    returncode: int,
+    loop: asyncio.AbstractEventLoop,
+    transport: SpawnTransport,
+) -> None:
+    "Called by the child watcher (maybe from another thread) when process exits."
+    # Skip one iteration so pending pipe callbacks run first (like asyncio).
+    loop.call_soon_threadsafe(
+        loop.call_soon,
+        transport._process_exited,  # pyright: ignore[reportPrivateUsage]
+        returncode,
+    )
+
+
+async def create_subprocess_spawn(
+    *args: Any,
+    stdin: Any = None,
+    stdout: Any = None,
+    stderr: Any = None,
+    env: Optional[dict[Any, Any]] = None,
+    sinks: Optional[SinkMap] = None,
+    limit: int = DEFAULT_LIMIT,
+    **_kwds: Any,
+) -> Process:
+    """Launch a process using `os.posix_spawn`.
+
+    This is a drop-in replacement for `asyncio.create_subprocess_exec` when
+    `can_posix_spawn` returns True for the keyword arguments.
+    """
+
+    async def _launch(sources: list[Any], files: list[Any]) -> SpawnedProcess:
+        return SpawnedProcess(_posix_spawn(list(args), sources, env), files)
+
+    return await launch_process(
+        _launch, list(args), (stdin, stdout, stderr), sinks, limit
+    )
+
+
+LaunchFunc = Callable[[list[Any], list[Any]], Awaitable[SpawnedProcess]]
+"""Function that launches a child process.
+
+It is called with the `sources` and `parent_files` from `open_stdio`, and
+returns the launched process.
+"""
+
+
+async def launch_process(
+    launch: LaunchFunc,
+    args: list[Any],
+    stdio: tuple[Any, Any, Any],
+    sinks: Optional[SinkMap],
+    limit: int,
+) -> Process:
+    """Set up the standard streams, call `launch`, and return the asyncio
+    Process.
+
+    If `launch` fails, the parent's ends of any new pipes are closed. The
+    child's ends are always closed after `launch` returns.
+    """
+    sources, parent_files = open_stdio(*stdio)
+
+    try:
+        process = await launch(sources, parent_files)
+    except BaseException:
+        _close_files(parent_files)
+        raise
+    finally:
+        close_pipe_ends(sources)
+
+    loop = asyncio.get_running_loop()
+    protocol = StreamProtocol(limit, loop, sinks)
+    waiter = loop.create_future()
+    transport = SpawnTransport(
+        loop,
+        protocol,
+        args,
+        False,
+        *stdio,
+        0,
+        waiter=waiter,
+        process=process,
+    )
+
+    process.watch(loop, transport)
+
+    try:
+        await waiter
+    except BaseException:
+        transport.close()
+        await transport._wait()  # pyright: ignore[reportPrivateUsage]
+        # Nobody will claim the resource usage of the reaped process.
+        pop_rusage(process.pid)
+        raise
+
+    return Process(transport, protocol, loop)
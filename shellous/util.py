@@ -1,18 +1,24 @@
 "Implements various utility functions."
 
 import asyncio
+import codecs
 import contextvars
 import os
+import shutil
 import sys
+import tempfile
+import time
 from asyncio.subprocess import Process
 from collections import abc, defaultdict
 from types import TracebackType
 from typing import (
     Any,
     AsyncContextManager,
+    BinaryIO,
     Coroutine,
     Iterable,
     Iterator,
+    NamedTuple,
     Optional,
     Protocol,
     TypeVar,
@@ -34,8 +40,11 @@ BSD_FREEBSD = sys.platform.startswith("freebsd")
 BSD_DERIVED = BSD_FREEBSD or sys.platform == "darwin"
 
 
-def decode_bytes(data: bytes, encoding: str) -> str:
+def decode_bytes(data: Union[bytes, memoryview], encoding: str) -> str:
     "Utility function to decode byte strings."
+    if isinstance(data, memoryview):
+        # A memoryview has no `decode` method.
+        return str(data, *encoding.split(maxsplit=1))
     return data.decode(*encoding.split(maxsplit=1))
 
 
@@ -44,6 +53,147 @@ def encode_bytes(data: str, encoding: str) -> bytes:
     return data.encode(*encoding.split(maxsplit=1))
 
 
+# Default size at which `Result.aoutput` decodes in a worker thread.
+CODEC_OFFLOAD_SIZE = 1024 * 1024
+
+
+async def decode_bytes_async(
+    data: Union[bytes, memoryview],
+    encoding: str,
+    offload: Optional[int],
+) -> str:
+    "Decode bytes in a worker thread if there are at least `offload` bytes."
+    if offload is not None and len(data) >= offload:
+        return await asyncio.to_thread(decode_bytes, data, encoding)
+    return decode_bytes(data, encoding)
+
+
+async def encode_bytes_async(data: str, encoding: str, offload: Optional[int]) -> bytes:
+    "Encode a string in a worker thread if it is at least `offload` characters."
+    if offload is not None and len(data) >= offload:
+        return await asyncio.to_thread(encode_bytes, data, encoding)
+    return encode_bytes(data, encoding)
+
+
+def incremental_decoder(encoding: str) -> codecs.IncrementalDecoder:
+    "Return an incremental decoder for the given encoding."
+    name, *errors = encoding.split(maxsplit=1)
+    return codecs.getincrementaldecoder(name)(*errors)
+
+
+class WhichCacheInfo(NamedTuple):
+    "Statistics for the cache used to find commands in the search path."
+
+    hits: int
+    "Number of lookups answered from the cache."
+
+    misses: int
+    "Number of lookups that searched the file system."
+
+    invalidations: int
+    "Number of cached entries discarded because a search directory changed."
+
+    currsize: int
+    "Number of entries in the cache."
+
+
+# Directories modified within this many seconds are not trusted to have a
+# stable mtime. A second change could have the same timestamp.
+_WHICH_RACY_SECONDS = 2.0
+
+_DirStamps = tuple[tuple[str, Optional[int]], ...]
+
+
+class WhichCache:
+    """Cache the results of `shutil.which`.
+
+    A cached entry stays valid until the modification time of one of the
+    directories it depends on changes. An entry depends on each directory in
+    the search path up to and including the one where the command was found.
+    """
+
+    _entries: dict[tuple[str, str], tuple[Optional[str], _DirStamps]]
+    _maxsize: int
+    _hits: int = 0
+    _misses: int = 0
+    _invalidations: int = 0
+
+    def __init__(self, maxsize: int = 256):
+        self._entries = {}
+        self._maxsize = maxsize
+
+    def which(self, name: str, path: Optional[str]) -> Optional[str]:
+        "Find the command with the given name and return its path."
+        search_path = os.environ.get("PATH", os.defpath) if path is None else path
+        search_dirs = list(dict.fromkeys(search_path.split(os.pathsep)))
+        if (
+            sys.platform == "win32"
+            or os.path.dirname(name)
+            or not all(os.path.isabs(dirname) for dirname in search_dirs)
+        ):
+            # Results depend on the current directory. Don't cache them.
+            return shutil.which(name, path=path)
+
+        key = (name, search_path)
+        entry = self._entries.get(key)
+        if entry is not None:
+            result, stamps = entry
+            if stamps == _dir_stamps(dirname for dirname, _ in stamps):
+                self._hits += 1
+                return result
+            self._invalidations += 1
+            del self._entries[key]
+
+        # Stamp directories *before* searching them.
+        self._misses += 1
+        stamps = _dir_stamps(search_dirs)
+        result = shutil.which(name, path=path)
+
+        if result is not None:
+            for i, (dirname, _) in enumerate(stamps):
+                if os.path.join(dirname, name) == result:
+                    stamps = stamps[: i + 1]
+                    break
+
+        racy = time.time_ns() - int(_WHICH_RACY_SECONDS * 1e9)
+        if all(mtime is None or mtime < racy for _, mtime in stamps):
+            if len(self._entries) >= self._maxsize:
+                del self._entries[next(iter(self._entries))]
+            self._entries[key] = (result, stamps)
+
+        return result
+
+    def cache_info(self) -> WhichCacheInfo:
+        "Return cache statistics."
+        return WhichCacheInfo(
+            self._hits,
+            self._misses,
+            self._invalidations,
+            len(self._entries),
+        )
+
+    def cache_clear(self) -> None:
+        "Clear the cache and its statistics."
+        self._entries.clear()
+        self._hits = self._misses = self._invalidations = 0
+
+
+def _dir_stamps(dirnames: Iterable[str]) -> _DirStamps:
+    "Return the modification time of each directory (or None if missing)."
+    result: list[tuple[str, Optional[int]]] = []
+    for dirname in dirnames:
+        try:
+            mtime = os.stat(dirname).st_mtime_ns
+        except OSError:
+            mtime = None
+        result.append((dirname, mtime))
+    return tuple(result)
+
+
+WHICH_CACHE = WhichCache()
+"Process-wide cache used to find commands."
+
+
 def coerce_env(env: dict[str, Any]) -> dict[str, str]:
     """Utility function to coerce environment variables to string."""
     return {str(key): str(value) for key, value in env.items()}
@@ -83,17 +233,110 @@ def verify_dev_fd(fdesc: int) -> None:
         )
 
 
+def _can_memfd() -> bool:
+    "Return true if OS supports `memfd_create` with file sealing (Linux)."
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError:  # pragma: no cover
+        # No fcntl on Windows.
+        return False
+    return hasattr(os, "memfd_create") and hasattr(fcntl, "F_ADD_SEALS")
+
+
+CAN_MEMFD = _can_memfd()
+
+
+def make_memfd(data: Union[bytes, bytearray], name: str = "shellous") -> int:
+    """Return a sealed, read-only memfd containing `data`.
+
+    The file offset is positioned at the start of the file. The caller is
+    responsible for closing the file descriptor.
+    """
+    # Only called when CAN_MEMFD is true, so fcntl is available.
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    fdesc = os.memfd_create(name, os.MFD_CLOEXEC | os.MFD_ALLOW_SEALING)
+    try:
+        with memoryview(data) as view:
+            while view:
+                written = os.write(fdesc, view)
+                view = view[written:]
+        fcntl.fcntl(
+            fdesc,
+            fcntl.F_ADD_SEALS,
+            fcntl.F_SEAL_SHRINK
+            | fcntl.F_SEAL_GROW
+            | fcntl.F_SEAL_WRITE
+            | fcntl.F_SEAL_SEAL,
+        )
+        os.lseek(fdesc, 0, os.SEEK_SET)
+    except BaseException:
+        os.close(fdesc)
+        raise
+    return fdesc
+
+
+def open_anonymous_file(name: str = "shellous") -> BinaryIO:
+    """Return a new, empty file that has no name in the file system.
+
+    Use an anonymous memory file (`memfd_create`) where it is supported;
+    otherwise, use an unlinked temporary file.
+    """
+    if CAN_MEMFD:
+        fdesc = os.memfd_create(name, os.MFD_CLOEXEC)
+        return open(fdesc, "w+b")  # pylint: disable=consider-using-with
+    return tempfile.TemporaryFile()  # pylint: disable=consider-using-with
+
+
+_HAS_WAIT4 = hasattr(os, "wait4")
+
+# Maximum number of unclaimed entries in `_CHILD_RUSAGE`.
+_CHILD_RUSAGE_LIMIT = 1024
+
+# Resource usage of reaped child processes, by pid, with the time when each
+# process was reaped. Entries are removed by `pop_rusage` after the process's
+# Runner finishes, or when a launch fails or is cancelled.
+_CHILD_RUSAGE: dict[int, tuple[float, Any]] = {}
+
+
+def record_rusage(pid: int, rusage: Any) -> None:
+    "Save the resource usage (os.struct_rusage) of a reaped child process."
+    if len(_CHILD_RUSAGE) >= _CHILD_RUSAGE_LIMIT:
+        # Discard the oldest entry.
+        _CHILD_RUSAGE.pop(next(iter(_CHILD_RUSAGE)), None)
+    _CHILD_RUSAGE[pid] = (time.monotonic(), rusage)
+
+
+def pop_rusage(pid: int, since: Optional[float] = None) -> Optional[Any]:
+    """Return the resource usage of a reaped child process.
+
+    Return None if the process was reaped by a child watcher that doesn't
+    record resource usage. If `since` is set, ignore an entry recorded before
+    that time (`time.monotonic()`). A pid can only be reused after the earlier
+    process is reaped, so such an entry belongs to an earlier process.
+    """
+    entry = _CHILD_RUSAGE.pop(pid, None)
+    if entry is None or (since is not None and entry[0] < since):
+        return None
+    return entry[1]
+
+
 def wait_pid(pid: int, *, block: bool = False) -> Optional[int]:
     """Call os.waitpid and return exit status.
 
-    Return None if process is still running.
+    Return None if process is still running. If `os.wait4` is available, the
+    resource usage is saved for `pop_rusage`.
     """
     assert pid > 0
 
+    rusage = None
     try:
         # os.WNOHANG is not available on Windows.
         options = 0 if block else os.WNOHANG  # type: ignore
-        result_pid, status = os.waitpid(pid, options)
+        if _HAS_WAIT4:
+            result_pid, status, rusage = os.wait4(pid, options)  # type: ignore
+        else:
+            result_pid, status = os.waitpid(pid, options)  # pragma: no cover
     except ChildProcessError as ex:
         # Set status to 255 if process not found.
         LOGGER.warning("wait_pid(%r) status not found (255) ex=%r", pid, ex)
@@ -105,6 +348,9 @@ def wait_pid(pid: int, *, block: bool = False) -> Optional[int]:
     if result_pid != pid:
         return None
 
+    if rusage is not None:
+        record_rusage(pid, rusage)
+
     # Convert os.waitpid status to an exit status.
     try:
         status = os.waitstatus_to_exitcode(status)  # type: ignore
@@ -186,36 +432,189 @@ async def context_aexit(
     return await ctxt_manager.__aexit__(exc_type, exc_value, exc_tb)
 
 
+def environ_data() -> dict[Any, Any]:
+    """Return the raw data dictionary behind `os.environ`.
+
+    On POSIX, the keys and values are bytes. The result must not be modified.
+    """
+    return os.environ._data  # type: ignore  # pylint: disable=protected-access
+
+
+def encode_env(env: dict[str, str]) -> dict[Any, Any]:
+    """Encode environment variables the way subprocess does on POSIX.
+
+    On Windows, the environment is returned unchanged.
+    """
+    if sys.platform == "win32":
+        return env  # pragma: no cover
+    return {os.fsencode(key): os.fsencode(value) for key, value in env.items()}
+
+
+class _MergedEnv(NamedTuple):
+    "Cached result of merging an `EnvironmentDict` with `os.environ`."
+
+    environ: Optional[dict[Any, Any]]  # snapshot of `environ_data()`
+    merged: dict[str, str]
+    encoded: dict[Any, Any]
+
+
+# Maximum number of unflattened layers in an `EnvironmentDict` chain.
+_ENV_MAX_DEPTH = 8
+
+
 class EnvironmentDict(abc.Mapping[str, str]):
-    "Read-only, hashable dictionary that stores environment variables."
+    """Read-only, hashable dictionary that stores environment variables.
 
-    _data: dict[str, str]
+    An EnvironmentDict stores only its own updates and a reference to its base.
+    Deriving a new EnvironmentDict costs O(len(updates)). The hash is
+    the XOR of the item hashes, so it is also derived from the base's hash
+    incrementally. The full dictionary is built lazily, when needed.
+    """
+
+    _base: Optional["EnvironmentDict"]
+    _updates: dict[str, str]
+    _depth: int
+    _len: int
+    _hash: int
+    _flat: Optional[dict[str, str]] = None
+    _merged: Optional[_MergedEnv] = None
 
     def __init__(self, base: Optional["EnvironmentDict"], updates: dict[str, Any]):
+        updates = coerce_env(updates)
+
+        if base is not None and base._depth >= _ENV_MAX_DEPTH:
+            # Cache the base's full dictionary so lookups stop there.
+            base.flatten()
+
+        self._base = base
+        self._updates = updates
+
         if base is None:
-            self._data = {}
+            self._depth = 0
+            self._len = len(updates)
+            self._hash = _hash_items(updates)
+            return
+
+        # Depth counts the layers above the nearest flattened layer.
+        self._depth = 1 if base._flat is not None else base._depth + 1
+        length = base._len
+        hash_ = base._hash
+        for key, value in updates.items():
+            old_value = base.get(key)
+            if old_value is None:
+                length += 1
+            else:
+                hash_ ^= hash((key, old_value))
+            hash_ ^= hash((key, value))
+        self._len = length
+        self._hash = hash_
+
+    def flatten(self) -> dict[str, str]:
+        "Return the full dictionary of environment variables; don't modify it."
+        flat = self._flat
+        if flat is None:
+            base = self._base
+            if base is None:
+                flat = self._updates
+            else:
+                flat = base.flatten() | self._updates
+            self._flat = flat
+        return flat
+
+    def merged_env(self, inherit_env: bool) -> _MergedEnv:
+        """Return this environment merged with `os.environ`.
+
+        If `inherit_env` is False, don't include `os.environ`. The result is
+        cached until `os.environ` changes. The caller must not modify it.
+        """
+        # Stop at the nearest flattened layer (or the root). Only that layer
+        # checks whether `os.environ` has changed.
+        base = self._base
+        if base is None or self._flat is not None:
+            return self._merged_flat(inherit_env)
+
+        # Derive this layer's result from the one below it.
+        result = base.merged_env(inherit_env)
+        cached = self._merged
+        if cached is None or cached.environ is not result.environ:
+            cached = _MergedEnv(
+                result.environ,
+                result.merged | self._updates,
+                result.encoded | encode_env(self._updates),
+            )
+            self._merged = cached
+        return cached
+
+    def _merged_flat(self, inherit_env: bool) -> _MergedEnv:
+        "Return the full dictionary merged with `os.environ`."
+        cached = self._merged
+        updates = self.flatten()
+
+        if inherit_env:
+            data = environ_data()
+            if cached is not None and cached.environ == data:
+                return cached
+            snapshot = data.copy()
+            merged = os.environ | updates
+            if sys.platform == "win32":
+                encoded = merged  # pragma: no cover
+            else:
+                encoded = snapshot | encode_env(updates)
+            result = _MergedEnv(snapshot, merged, encoded)
+
         else:
-            self._data = base._data.copy()
-        self._data.update(**coerce_env(updates))
+            if cached is not None and cached.environ is None:
+                return cached
+            result = _MergedEnv(None, updates, encode_env(updates))
+
+        self._merged = result
+        return result
+
+    def __getstate__(self) -> dict[str, Any]:
+        # Pickle the flattened dictionary without any cached values.
+        return {"_updates": self.flatten()}
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__init__(None, state["_updates"])
 
     def __getitem__(self, key: str) -> str:
-        return self._data[key]
+        env = self
+        while env._flat is None:
+            value = env._updates.get(key)
+            if value is not None:
+                return value
+            if env._base is None:
+                raise KeyError(key)
+            env = env._base
+        return env._flat[key]
 
     def __len__(self) -> int:
-        return len(self._data)
+        return self._len
 
     def __iter__(self) -> Iterator[str]:
-        return iter(self._data)
+        return iter(self.flatten())
 
     def __hash__(self) -> int:
-        return hash(tuple((key, value) for key, value in self._data.items()))
+        return self._hash
 
     def __eq__(self, rhs: object) -> bool:
         if isinstance(rhs, dict):
-            return self._data == rhs
+            return self.flatten() == rhs
         if not isinstance(rhs, EnvironmentDict):
             return False
-        return self._data == rhs._data
+        if self is rhs:
+            return True
+        if self._hash != rhs._hash or self._len != rhs._len:
+            return False
+        return self.flatten() == rhs.flatten()
 
     def __repr__(self) -> str:
-        return repr(self._data)
+        return repr(self.flatten())
+
+
+def _hash_items(items: dict[str, str]) -> int:
+    "Return the order-independent hash of a dictionary's items."
+    result = 0
+    for item in items.items():
+        result ^= hash(item)
+    return result
@@ -0,0 +1,24 @@
+"Smoke tests for the benchmark suite."
+
+from benchmarks.bench import Measurement, bench_copy_bytearray, compare
+
+
+async def test_bench_copy_bytearray():
+    "Test running a benchmark with a small workload."
+    result = await bench_copy_bytearray(2**20, repeat=2)
+    assert result.key == "copy_bytearray[]"
+    assert len(result.samples) == 2
+    assert result.to_json()["ops_per_sec"] > 0
+
+
+def test_bench_compare():
+    "Test comparing benchmark results against a baseline."
+    result = Measurement("spawn", {"launcher": "asyncio"}, "spawn", 10, [2.0, 3.0])
+    baseline = {
+        "benchmarks": [
+            {"key": "spawn[launcher=asyncio]", "median": 2.0},
+            {"key": "other[]", "median": 1.0},
+        ]
+    }
+    assert compare([result], baseline, 0.5) == []
+    assert compare([result], baseline, 0.1) == ["spawn[launcher=asyncio]: +25.0%"]
@@ -264,6 +264,73 @@ def test_command_pickle():
     assert result == cmd
 
 
+def test_command_compile():
+    "Test compiling a command into a launch plan."
+    cmd = sh("echo", "hello").stdin("abc")
+    assert cmd.launch_plan is None
+
+    compiled = cmd.compile()
+    assert compiled == cmd
+    plan = compiled.launch_plan
+    assert plan is not None
+    assert plan.pos_args is not None
+    assert plan.pos_args[0] == str(sh.find_command("echo"))
+    assert plan.input == b"abc"
+
+    # A derived command keeps the plan, or is compiled again.
+    assert compiled.env(A=1).launch_plan is plan
+    more = compiled("more").launch_plan
+    assert more is not None and more.pos_args == (*plan.pos_args, "more")
+
+    # The plan is not pickled.
+    result = pickle.loads(pickle.dumps(compiled))
+    assert result == cmd
+    assert result.launch_plan is None
+
+    # An executable that isn't found is resolved at run time.
+    assert sh("/no/such/command").compile().launch_plan.pos_args == (
+        "/no/such/command",
+    )
+    assert sh("no_such_command").compile().launch_plan.pos_args is None
+
+
+def test_command_template():
+    "Test binding arguments to a command template."
+    tmpl = sh("grep", sh.ARG, "file", sh.ARG).template()
+    assert tmpl.arity == 2
+    assert repr(tmpl) == "CommandTemplate(args=('grep', sh.ARG, 'file', sh.ARG))"
+
+    cmd = tmpl("a", b"b")
+    assert cmd == sh("grep", "a", "file", b"b")
+
+    # Other values are coerced, and sequences are flattened.
+    cmd = tmpl(1, ["x", Path("y")])
+    assert cmd == sh("grep", "1", "file", "x", Path("y"))
+
+    with pytest.raises(TypeError, match="expects 2 arguments, got 1"):
+        tmpl("a")
+
+    with pytest.raises(ValueError, match="placeholder"):
+        sh("echo").template()
+
+    # Templates keep the command's options.
+    tmpl = sh.env(A=1)(sh.ARG).template()
+    assert tmpl("echo") == sh.env(A=1)("echo")
+
+    # Bound values go through a custom `coerce_arg`.
+    def _upper(arg):
+        return arg.upper() if isinstance(arg, str) else arg
+
+    sh_upper = sh.set(coerce_arg=_upper)
+    tmpl = sh_upper("grep", sh.ARG, sh.ARG).template()
+    assert tmpl("abc", ["x"]) == sh_upper("grep", "abc", ["x"])
+    assert tmpl("abc", ["x"]).args == ("GREP", "ABC", "x")
+
+    # The placeholder can be pickled.
+    cmd = sh("echo", sh.ARG)
+    assert pickle.loads(pickle.dumps(cmd)) == cmd
+
+
 def test_command_pickle_callback():
     "Test that some settings can't be pickled."
 
@@ -291,31 +358,44 @@ def test_dataclasses():
     assert sorted(opt_fields) == [
         "_catch_cancelled_error",
         "_preexec_fn",
+        "_return_bytes",
         "_return_result",
         "_start_new_session",
         "_writable",
         "alt_name",
         "audit_callback",
+        "buffer_spill",
         "cancel_signal",
         "cancel_timeout",
         "close_fds",
+        "codec_offload",
         "coerce_arg",
         "encoding",
         "env",
         "error",
         "error_append",
         "error_close",
+        "error_head",
+        "error_tail",
         "exit_codes",
         "inherit_env",
         "input",
         "input_close",
+        "input_memfd",
+        "launcher",
+        "long_lines",
+        "max_concurrency",
+        "max_output",
+        "max_output_action",
         "output",
         "output_append",
         "output_close",
         "pass_fds",
         "pass_fds_close",
         "path",
+        "priority",
         "pty",
+        "stream_limit",
         "timeout",
     ]
 
@@ -326,6 +406,7 @@ def test_context_enums():
     assert sh.DEVNULL.name == "DEVNULL"
     assert sh.INHERIT.name == "INHERIT"
     assert sh.STDOUT.name == "STDOUT"
+    assert sh.MMAP.name == "MMAP"
 
 
 def test_context_result():
@@ -335,6 +416,33 @@ def test_context_result():
     assert ctxt.options.exit_codes == range(-255, 256)
 
 
+def test_context_bytes():
+    "Test that `sh` supports the .bytes modifier."
+    ctxt = sh.bytes
+    assert ctxt.options._return_bytes
+    assert ctxt.options.exit_codes is None
+
+    # Exit codes set by `.result` are cleared; others are kept.
+    assert sh.result.bytes.options.exit_codes is None
+    assert sh("echo").result.bytes.options.exit_codes is None
+    ctxt = sh.set(exit_codes={0, 1})
+    assert ctxt.bytes.options.exit_codes == {0, 1}
+    assert ctxt("echo").bytes.options.exit_codes == {0, 1}
+
+
+def test_command_long_lines():
+    "Test the `stream_limit` and `long_lines` options."
+    cmd = sh("echo").set(stream_limit=100, long_lines="split")
+    assert cmd.options.stream_limit == 100
+    assert cmd.options.long_lines == "split"
+
+    with pytest.raises(ValueError, match="unknown long_lines"):
+        sh("echo").set(long_lines="skip")  # pyright: ignore[reportGeneralTypeIssues]
+
+    with pytest.raises(ValueError, match="stream_limit"):
+        sh("echo").set(stream_limit=0)
+
+
 def test_command_invalid_encoding():
     "Test the empty encoding is invalid."
     with pytest.raises(TypeError, match="invalid encoding"):
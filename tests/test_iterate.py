@@ -0,0 +1,113 @@
+"Unit tests for the iterate module."
+
+import asyncio
+
+import pytest
+
+from shellous import iterate
+
+
+async def test_read_line_batches():
+    "Test `read_line_batches` with lines split between reads."
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"ab")
+    reader.feed_data(b"c\nd\n\ne")
+    reader.feed_data(b"f\xc3")
+    reader.feed_data(b"\xa9\n")
+    reader.feed_eof()
+    batches = [lines async for lines in iterate.read_line_batches(reader, "utf-8", 2)]
+    assert batches == [["abc\n", "d\n"], ["\n", "ef\u00e9\n"]]
+
+
+def _reader(*chunks, limit=8):
+    "Return a StreamReader with the given data."
+    reader = asyncio.StreamReader(limit)
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+async def test_read_until_long_lines():
+    "Test `read_until` with each policy for records longer than the limit."
+    data = (b"0123456789abc\n", b"xy\n", b"z")
+
+    async def _read_all(long_lines):
+        reader = _reader(*data)
+        records = []
+        while record := await iterate.read_until(reader, b"\n", 8, long_lines):
+            records.append(record)
+        return records
+
+    assert await _read_all("split") == [b"01234567", b"89abc\n", b"xy\n", b"z"]
+    assert await _read_all("truncate") == [b"01234567\n", b"xy\n", b"z"]
+    assert await _read_all("buffer") == [b"0123456789abc\n", b"xy\n", b"z"]
+
+    with pytest.raises(ValueError, match="Separator"):
+        await _read_all(None)
+
+
+async def test_read_lines_long_lines():
+    "Test `read_lines` splitting or truncating lines within a code point."
+    data = b"abcdefg\xc3\xa9hij\n\xc3\xa9\n"
+
+    lines = [
+        line async for line in iterate.read_lines(_reader(data), "utf-8", 8, "split")
+    ]
+    assert lines == ["abcdefg", "\u00e9hij\n", "\u00e9\n"]
+
+    lines = [
+        line async for line in iterate.read_lines(_reader(data), "utf-8", 8, "truncate")
+    ]
+    assert lines == ["abcdefg\n", "\u00e9\n"]
+
+    records = [
+        rec async for rec in iterate.read_records(_reader(data), b"\n", 8, "split")
+    ]
+    assert b"".join(records) == data
+
+
+async def test_read_line_batches_long_lines():
+    "Test `read_line_batches` with lines longer than the limit."
+
+    async def _batches(data, long_lines):
+        reader = _reader(*data, limit=2**16)
+        batches = iterate.read_line_batches(reader, "utf-8", None, 8, long_lines)
+        return [line async for lines in batches for line in lines]
+
+    # A long line split between reads.
+    data = (b"abcdefg\xc3", b"\xa9hij\nxy\n", b"z")
+    assert await _batches(data, "split") == ["abcdefg", "\u00e9hij\n", "xy\n", "z"]
+    assert await _batches(data, "truncate") == ["abcdefg\n", "xy\n", "z"]
+    assert await _batches(data, "buffer") == ["abcdefg\u00e9hij\n", "xy\n", "z"]
+    with pytest.raises(ValueError, match="Separator is found"):
+        await _batches(data, None)
+
+    # A long line with no trailing newline.
+    data = (b"0123", b"456789", b"abcdefghijk")
+    assert await _batches(data, "split") == ["01234567", "89abcdef", "ghijk"]
+    assert await _batches(data, "truncate") == ["01234567"]
+    assert await _batches(data, "buffer") == ["0123456789abcdefghijk"]
+    with pytest.raises(ValueError, match="Separator is not found"):
+        await _batches(data, None)
+
+
+async def test_read_records_chunks():
+    "Test `read_records` and `read_chunks` with data split between reads."
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"ab")
+    reader.feed_data(b"c\0d\0\0e")
+    reader.feed_eof()
+    records = [rec async for rec in iterate.read_records(reader, b"\0")]
+    assert records == [b"abc\0", b"d\0", b"\0", b"e"]
+
+    reader = asyncio.StreamReader()
+    reader.feed_data(b"abcd")
+    reader.feed_data(b"efg")
+    reader.feed_eof()
+    chunks = [chunk async for chunk in iterate.read_chunks(reader, 3)]
+    assert chunks == [b"abc", b"def", b"g"]
+
+    with pytest.raises(ValueError, match="size"):
+        async for _ in iterate.read_chunks(reader, 0):
+            pass
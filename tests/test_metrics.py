@@ -0,0 +1,151 @@
+"Unit tests for the metrics module."
+
+import asyncio
+import sys
+
+import pytest
+
+import shellous.metrics
+from shellous import MetricsRegistry, sh
+from shellous.metrics import Histogram
+
+_PY_ECHO = "import sys; sys.stdout.write(sys.stdin.read())"
+
+
+def test_histogram():
+    "Test the Histogram class."
+    hist = Histogram((1.0, 2.0, 4.0))
+    assert hist.count == 0
+    assert hist.quantile(0.5) is None
+
+    for value in (0.5, 1.5, 1.5, 3.0, 10.0):
+        hist.observe(value)
+
+    assert hist.count == 5
+    assert hist.sum == 16.5
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.cumulative_counts() == [(1.0, 1), (2.0, 3), (4.0, 4), (float("inf"), 5)]
+    assert hist.quantile(0.2) == 1.0
+    assert hist.quantile(0.5) == 1.75
+    assert hist.quantile(0.99) == 4.0
+
+
+async def test_metrics_registry():
+    "Test collecting metrics using the audit callback."
+    metrics = MetricsRegistry()
+    xsh = sh.set(audit_callback=metrics)
+
+    for _ in range(3):
+        result = await xsh(sys.executable, "-c", _PY_ECHO).stdin("abc")
+        assert result == "abc"
+
+    with pytest.raises(asyncio.TimeoutError):
+        await xsh(sys.executable, "-c", "import time; time.sleep(5)").set(timeout=0.2)
+
+    with pytest.raises(FileNotFoundError):
+        await xsh("__does_not_exist__")
+
+    snapshot = metrics.snapshot()
+    assert set(snapshot) == {xsh(sys.executable).name, "__does_not_exist__"}
+    py = snapshot[xsh(sys.executable).name]
+    assert py.started == 4
+    assert py.stopped == 4
+    assert py.running == 0
+    assert py.timeouts == 1
+    assert py.cancellations == 0
+    assert py.signals >= 1
+    assert py.input_bytes == 9
+    assert py.output_bytes == 9
+    assert py.exit_codes[0] == 3
+    assert py.spawn_latency.count == 4
+    assert py.wall_time.count == 4
+    assert py.wall_time.quantile(0.99) is not None
+
+    missing = snapshot["__does_not_exist__"]
+    assert missing.launch_failures == 1
+    assert missing.exit_codes == {}
+
+    # The snapshot is a copy.
+    metrics.reset()
+    assert not metrics.snapshot()
+    assert py.started == 4
+
+
+async def test_metrics_output_bytes():
+    "Test that output bytes are counted with the default asyncio launcher."
+    metrics = MetricsRegistry()
+    xsh = sh.set(audit_callback=metrics)
+    cmd = xsh(sys.executable, "-c", _PY_ECHO).stdin("abcd")
+    assert cmd.options.launcher == "asyncio"
+
+    async with cmd.stdout(sh.CAPTURE) as run:
+        assert run.input_size == 4
+        output = await run.stdout.read()
+
+    assert output == b"abcd"
+    assert run.bytes_received == 4
+
+    py = metrics.snapshot()[cmd.name]
+    assert py.input_bytes == 4
+    assert py.output_bytes == 4
+
+
+async def test_metrics_prometheus():
+    "Test the Prometheus export and HTTP endpoint."
+    metrics = MetricsRegistry(buckets=[1.0, 10.0])
+    xsh = sh.set(audit_callback=metrics, alt_name='py"thon')
+    await xsh(sys.executable, "-c", "pass")
+
+    text = metrics.export_prometheus()
+    assert "# TYPE shellous_command_started_total counter\n" in text
+    assert 'shellous_command_started_total{command="py\\"thon"} 1\n' in text
+    assert 'shellous_command_running{command="py\\"thon"} 0\n' in text
+    assert 'shellous_command_exits_total{command="py\\"thon",exit_code="0"} 1\n' in text
+    assert "# TYPE shellous_command_duration_seconds histogram\n" in text
+    assert (
+        'shellous_command_duration_seconds_bucket{command="py\\"thon",le="+Inf"} 1\n'
+        in text
+    )
+    assert 'shellous_command_spawn_seconds_count{command="py\\"thon"} 1\n' in text
+
+    server = await metrics.serve()
+    try:
+        port = server.sockets[0].getsockname()[1]
+
+        async def _get(path):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            await writer.wait_closed()
+            return response.decode()
+
+        response = await _get("/metrics")
+        assert response.startswith("HTTP/1.0 200 OK\r\n")
+        assert response.endswith("\r\n\r\n" + text)
+
+        response = await _get("/other")
+        assert response.startswith("HTTP/1.0 404 Not Found\r\n")
+
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def test_metrics_serve_read_timeout(monkeypatch):
+    "Test that the metrics server closes a connection with an idle client."
+    monkeypatch.setattr(shellous.metrics, "_HTTP_READ_TIMEOUT", 0.1)
+    server = await MetricsRegistry().serve()
+    try:
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # Send a partial request, then wait for the server to give up.
+        writer.write(b"GET /metrics HTTP/1.1\r\n")
+        response = await asyncio.wait_for(reader.read(), 5.0)
+        assert response == b""
+        writer.close()
+        await writer.wait_closed()
+
+    finally:
+        server.close()
+        await server.wait_closed()
@@ -90,6 +90,7 @@ def test_parse_readme():
         'def exclaim(word: str) -> Command[str]:\n  return sh("echo", "-n", f"{word}!!")\n',
         'await exclaim("Oh")',
         'await echo.result("abc")',
+        'await sh.bytes("echo", "abc")',
         'await sh("cat", "does_not_exist")',
         'await sh("cat", "does_not_exist").set(exit_codes={0,1})',
         '[line async for line in echo("hi\\n", "there")]',
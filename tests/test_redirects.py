@@ -1,13 +1,22 @@
 "Test shellous output redirect behavior."
 
+import asyncio
+import gc
 import io
+import os
+import pickle
+import sys
 from io import BytesIO, StringIO
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
 import pytest
 
-from shellous import sh
+import shellous.redirect as redir
+from shellous import ResultError, sh
+from shellous.redirect import CaptureBuffer, HeadTailBuffer, MappedBuffer
+from shellous.result import RESULT_STDERR_LIMIT
+from shellous.util import open_anonymous_file
 
 # For Path, bytearray, and io.Base subclasses, writing to a sink should first
 # truncate the sink. Appending to a sink, should leave the original contents
@@ -217,3 +226,283 @@ async def test_redirect_int_append():
 
 
 # TODO: Logger and StreamWriter
+
+
+def test_capture_buffer():
+    "Test the CaptureBuffer class."
+    buf = CaptureBuffer()
+    assert buf.getvalue() == b""
+
+    chunk = b"abc"
+    buf.write(chunk)
+    # A single chunk is returned without copying.
+    assert buf.getvalue() is chunk
+
+    buf.write(b"def")
+    assert len(buf) == 6
+    value = buf.getvalue()
+    assert value == b"abcdef"
+    assert buf.getvalue() is value
+
+
+def test_capture_buffer_limit():
+    "Test the CaptureBuffer class with a limit."
+    buf = CaptureBuffer(4)
+    buf.write(b"ab")
+    buf.write(b"cdef")
+    buf.write(b"gh")
+    assert len(buf) == 4
+    assert buf.getvalue() == b"abcd"
+
+
+def test_capture_buffer_on_limit():
+    "Test the CaptureBuffer `on_limit` callback."
+    calls = []
+    buf = CaptureBuffer(4, on_limit=lambda: calls.append(len(buf)))
+    buf.write(b"abc")
+    assert not calls
+    buf.write(b"def")
+    buf.write(b"ghi")
+    assert calls == [3]
+    assert buf.getvalue() == b"abcd"
+
+
+def test_capture_buffer_spill():
+    "Test the CaptureBuffer class when it spills to a temporary file."
+    buf = CaptureBuffer(spill=5)
+    buf.write(b"abc")
+    assert not buf.spilled
+    buf.write(b"def")
+    assert buf.spilled
+    buf.write(b"ghi")
+    assert len(buf) == 9
+
+    value = buf.getvalue()
+    assert isinstance(value, memoryview)
+    assert value == b"abcdefghi"
+    assert not buf.spilled
+    assert buf.getvalue() is value
+
+
+def test_capture_buffer_spill_anonymous():
+    "Test the CaptureBuffer class when it spills to an anonymous file."
+    buf = CaptureBuffer(spill=5, spill_file=open_anonymous_file)
+    buf.write(b"abc")
+    buf.write(b"def")
+    assert buf.spilled
+
+    value = buf.getvalue()
+    assert isinstance(value, memoryview)
+    assert value == b"abcdef"
+
+
+def test_head_tail_buffer():
+    "Test the HeadTailBuffer class."
+    buf = HeadTailBuffer(3, 4)
+    buf.write(b"ab")
+    assert buf.getvalue() == b"ab"
+    buf.write(b"cdef")
+    assert buf.getvalue() == b"abcdef"
+    for i in range(10):
+        buf.write(b"%d" % i)
+    assert buf.getvalue() == b"abc6789"
+    assert len(buf) == 7
+    assert buf.size == 16
+
+    calls = []
+    buf = HeadTailBuffer(3, 0, on_limit=lambda: calls.append(buf.size))
+    buf.write(b"abc")
+    assert not calls
+    buf.write(b"def")
+    buf.write(b"ghi")
+    assert calls == [6]
+    assert buf.getvalue() == b"abc"
+
+
+async def test_redirect_buffer_stderr_limit():
+    "Test that Redirect.BUFFER keeps only the start and end of stderr."
+    script = (
+        "import sys; sys.stderr.write('s' * 1000 + 'e' * 5000 + 'x'); print('done')"
+    )
+    result = await sh(sys.executable, "-c", script).result
+    assert result.output == "done\n"
+    half = RESULT_STDERR_LIMIT // 2
+    assert result.error == "s" * half + "e" * (half - 1) + "x"
+    assert result.error_size == 6001
+
+    cmd = sh(sys.executable, "-c", script).set(error_head=10, error_tail=5)
+    result = await cmd.result
+    assert result.error == "s" * 10 + "eeeex"
+    assert result.error_size == 6001
+
+    result = await cmd.stderr(sh.DEVNULL).result
+    assert result.error == ""
+    assert result.error_size is None
+
+
+def test_mapped_buffer():
+    "Test the MappedBuffer class."
+    buf = MappedBuffer()
+    assert len(buf) == 0
+    os.write(buf.fileno(), b"abc")
+    assert len(buf) == 3
+    value = buf.getvalue()
+    assert isinstance(value, memoryview)
+    assert value.readonly
+    assert value == b"abc"
+    assert len(buf) == 3
+
+    # An empty buffer returns empty bytes.
+    assert MappedBuffer().getvalue() == b""
+
+
+async def test_redirect_mmap():
+    "Test capturing stdout and stderr with Redirect.MMAP."
+    size = 10 * 1024 * 1024
+    script = (
+        f"import sys; sys.stdout.buffer.write(b'x' * {size}); "
+        "sys.stderr.write('e' * 5000)"
+    )
+    cmd = sh(sys.executable, "-c", script).stdout(sh.MMAP).stderr(sh.MMAP)
+    result = await cmd.result
+    assert isinstance(result.output_bytes, memoryview)
+    assert result.output_bytes == b"x" * size
+    assert result.output == "x" * size
+    # Stderr captured with MMAP isn't limited.
+    assert result.error == "e" * 5000
+    assert hash(result)
+
+    result = await sh(sys.executable, "-c", "pass").stdout(sh.MMAP).result
+    assert result.output_bytes == b""
+
+
+async def test_redirect_mmap_error():
+    "Test the ResultError from a failing command with Redirect.MMAP."
+    script = (
+        "import sys; sys.stdout.buffer.write(b'out'); "
+        "sys.stderr.buffer.write(b'fail'); sys.exit(1)"
+    )
+    cmd = sh(sys.executable, "-c", script).stdout(sh.MMAP).stderr(sh.MMAP)
+    with pytest.raises(ResultError) as exc_info:
+        await cmd
+
+    result = exc_info.value.result
+    assert isinstance(result.error_bytes, memoryview)
+    assert result.error == "fail"
+    assert repr(exc_info.value) == (
+        "ResultError(Result(exit_code=1, output_bytes=b'out', "
+        "error_bytes=b'fail', cancelled=False, encoding='utf-8'))"
+    )
+
+    # The traceback keeps the mapped files open until it is collected.
+    del exc_info, result
+    gc.collect()
+
+
+async def test_redirect_mmap_invalid():
+    "Test Redirect.MMAP with stdin and with a launch failure."
+    with pytest.raises(TypeError, match="unsupported input type"):
+        await sh(sys.executable, "-c", "pass").stdin(sh.MMAP)
+
+    with pytest.raises(FileNotFoundError):
+        await sh("__does_not_exist__").stdout(sh.MMAP)
+
+
+async def test_redirect_buffer_spill():
+    "Test Redirect.BUFFER with the `buffer_spill` option."
+    size = 10 * 1024 * 1024
+    script = f"import sys; sys.stdout.buffer.write(b'x' * {size})"
+    cmd = sh(sys.executable, "-c", script).set(buffer_spill=2**20)
+    result = await cmd.result
+    assert isinstance(result.output_bytes, memoryview)
+    assert result.output_bytes == b"x" * size
+
+    # Output below the threshold stays in memory.
+    result = await cmd.set(buffer_spill=size).result
+    assert isinstance(result.output_bytes, bytes)
+    assert len(result.output_bytes) == size
+
+
+async def test_redirect_buffer_large():
+    "Test Redirect.BUFFER with large output and the default `buffer_spill`."
+    size = 10 * 1024 * 1024
+    script = f"import sys; sys.stdout.buffer.write(b'x' * {size})"
+    result = await sh(sys.executable, "-c", script).result
+    assert isinstance(result.output_bytes, bytes)
+    assert result.output_bytes == b"x" * size
+    assert result.output_bytes.startswith(b"xxx")
+    assert pickle.loads(pickle.dumps(result)) == result
+
+
+async def test_redirect_max_output():
+    "Test the `max_output` option with the default truncate action."
+    script = "import sys; print('x' * 10000); sys.stderr.write('e' * 500)"
+    cmd = sh(sys.executable, "-c", script)
+
+    result = await cmd.set(max_output=100).result
+    assert result.output == "x" * 100
+    assert result.error == "e" * 100
+    assert result.truncated
+
+    result = await cmd.set(max_output=20000).result
+    assert len(result.output) == 10001
+    assert result.error == "e" * 500
+    assert not result.truncated
+
+    # Output redirected elsewhere is not limited.
+    buf = bytearray()
+    cmd = sh(sys.executable, "-c", "print('x' * 10000)")
+    result = await (cmd.set(max_output=100) | buf).result
+    assert len(buf) == 10001
+    assert not result.truncated
+
+    # A pipeline reports truncation of the last command.
+    result = await (sh(sys.executable, "-c", "pass") | cmd.set(max_output=100)).result
+    assert result.truncated
+
+
+def test_redirect_max_output_invalid():
+    "Test setting an unknown `max_output_action`."
+    with pytest.raises(ValueError, match="unknown max_output_action"):
+        sh.set(max_output_action="kill")  # pyright: ignore[reportGeneralTypeIssues]
+
+
+async def test_copy_stringio_split_code_point():
+    "Test that `copy_stringio` decodes a code point split between reads."
+    reader = asyncio.StreamReader()
+    dest = StringIO()
+    data = "aé€\U0001f600".encode()
+    for i in range(len(data)):
+        reader.feed_data(data[i : i + 1])
+    reader.feed_eof()
+    await redir.copy_stringio(reader, dest, "utf-8")
+    assert dest.getvalue() == "aé€\U0001f600"
+
+    # A code point that is cut off is an error, unless errors are replaced.
+    for encoding, expected in [("utf-8", None), ("utf-8 replace", "a�")]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"a\xe2\x82")
+        reader.feed_eof()
+        dest = StringIO()
+        if expected is None:
+            with pytest.raises(UnicodeDecodeError):
+                await redir.copy_stringio(reader, dest, encoding)
+        else:
+            await redir.copy_stringio(reader, dest, encoding)
+            assert dest.getvalue() == expected
+
+
+async def test_codec_offload():
+    "Test encoding and decoding in a worker thread with `codec_offload`."
+    text = "é" * 100000
+    script = "import sys; sys.stdout.write(sys.stdin.read())"
+    cmd = sh(sys.executable, "-c", script).set(codec_offload=1000)
+
+    assert await cmd.stdin(text) == text
+    assert await cmd.stdin(StringIO(text)) == text
+    assert await (cmd.stdin(text) | sh(sys.executable, "-c", script)) == text
+
+    result = await cmd.stdin(text).result
+    assert await result.aoutput() == text
+    assert await result.aoutput(offload=1) == text
+    assert await result.aerror(offload=1) == ""
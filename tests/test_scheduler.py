@@ -0,0 +1,78 @@
+"Unit tests for the scheduler module."
+
+import asyncio
+import pickle
+
+import pytest
+
+from shellous import ConcurrencyLimiter
+
+
+def test_limiter_invalid():
+    "Test creating a limiter with an invalid limit."
+    with pytest.raises(ValueError, match="at least 1"):
+        ConcurrencyLimiter(0)
+
+
+def test_limiter_pickle():
+    "Test that a limiter pickles its configuration only."
+    limiter = pickle.loads(pickle.dumps(ConcurrencyLimiter(3)))
+    assert repr(limiter) == (
+        "ConcurrencyLimiter(max_concurrency=3, running=0, waiting=0)"
+    )
+
+
+async def test_limiter_priority_order():
+    "Test that waiters are admitted by priority, then FIFO."
+    limiter = ConcurrencyLimiter(1)
+    await limiter.acquire()
+    order = []
+
+    async def _task(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+        limiter.release()
+
+    tasks = [
+        asyncio.create_task(_task("a", 0)),
+        asyncio.create_task(_task("b", 5)),
+        asyncio.create_task(_task("c", 0)),
+        asyncio.create_task(_task("d", 5)),
+    ]
+    await asyncio.sleep(0)
+    assert limiter.running == 1
+    assert limiter.waiting == 4
+
+    limiter.release()
+    await asyncio.gather(*tasks)
+    assert order == ["b", "d", "a", "c"]
+    assert limiter.running == 0
+
+
+async def test_limiter_cancel():
+    "Test cancelling a waiter."
+    limiter = ConcurrencyLimiter(1)
+    await limiter.acquire()
+
+    task1 = asyncio.create_task(limiter.acquire())
+    task2 = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    task1.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task1
+    assert limiter.waiting == 1
+
+    # Release hands the slot to task2.
+    limiter.release()
+    await task2
+    assert limiter.running == 1
+
+    # A waiter cancelled after it's given a slot passes the slot on.
+    task3 = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    limiter.release()
+    task3.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task3
+    assert limiter.running == 0
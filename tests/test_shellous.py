@@ -3,10 +3,12 @@
 # pylint: disable=redefined-outer-name,invalid-name
 
 import asyncio
+import dataclasses
 import hashlib
 import io
 import logging
 import os
+import pickle
 import sys
 from pathlib import Path
 
@@ -156,6 +158,25 @@ async def test_bulk_prompt(bulk_cmd, _limit_logging):
         )
 
 
+async def test_bulk_prompt_long_lines(bulk_cmd, _limit_logging):
+    "Test the Prompt class with bulk output and a long line policy."
+    cmd = bulk_cmd().set(encoding="latin1", long_lines="truncate")
+
+    async with cmd.stdin(sh.CAPTURE).stdout(sh.CAPTURE) as run:
+        prompt = Prompt(run, ">>> ")
+        result = await prompt.receive(timeout=10.0)
+        assert result == "1234" * 2**14
+
+    cmd = cmd.set(long_lines="split")
+    async with cmd.stdin(sh.CAPTURE).stdout(sh.CAPTURE) as run:
+        prompt = Prompt(run, ">>> ")
+        pieces = []
+        while piece := await prompt.receive(timeout=10.0):
+            pieces.append(piece)
+        assert {len(piece) for piece in pieces[:-1]} == {2**16}
+        assert "".join(pieces) == "1234" * (1024 * 1024 + 1)
+
+
 async def test_count(count_cmd):
     result = await count_cmd(5)
     assert result == "1\n2\n3\n4\n5\n"
@@ -166,9 +187,10 @@ async def test_error(error_cmd):
 
     assert result.exit_code == 0
     assert result.output_bytes == b""
-    assert result.error_bytes == b"1" * 1024
+    assert result.error_bytes == b"1" * 512 + b"4" * 512
     assert result.output == ""
-    assert result.error == "1" * 1024
+    assert result.error == "1" * 512 + "4" * 512
+    assert result.error_size == 4096
 
 
 async def test_error_bulk(error_cmd):
@@ -177,9 +199,10 @@ async def test_error_bulk(error_cmd):
 
     assert result.exit_code == 13
     assert result.output_bytes == b""
-    assert result.error_bytes == b"1" * 1024
+    assert result.error_bytes == b"1" * 512 + b"1234" * 128
     assert result.output == ""
-    assert result.error == "1" * 1024
+    assert result.error == "1" * 512 + "1234" * 128
+    assert result.error_size == 4096 + 4 * (1024 * 1024 + 1)
 
 
 async def test_error_result():
@@ -189,6 +212,36 @@ async def test_error_result():
     assert result.error == ""
 
 
+async def test_result_cached_output():
+    "Test that Result caches its decoded output and error."
+    result = await sh.result(sys.executable, "-c", "print('hello')")
+    output = result.output
+    assert output == "hello\n"
+    assert result.output is output
+    assert result.error is result.error
+    assert await result.aoutput() is output
+
+    # The cached values don't affect equality, hashing, or repr.
+    other = dataclasses.replace(result)
+    assert other == result
+    assert hash(other) == hash(result)
+    assert repr(other) == repr(result)
+    assert "_output" not in repr(result)
+
+    # The cached values aren't fields, so they aren't pickled either.
+    names = {item.name for item in dataclasses.fields(result)}
+    assert not names & {"_output", "_error"}
+    assert "_output" not in dataclasses.asdict(result)
+    assert set(result.__getstate__()) == names
+    unpickled = pickle.loads(pickle.dumps(result))
+    assert unpickled == result
+    assert unpickled.output == output
+
+    # A Result has no instance dictionary on Python 3.11+.
+    if sys.version_info >= (3, 11):
+        assert not hasattr(result, "__dict__")
+
+
 async def test_error_only():
     "Test standard error output only (STDOUT + DEVNULL)."
     cmd = (
@@ -343,6 +396,29 @@ async def test_echo_result(echo_cmd):
     assert not result2
 
 
+async def test_echo_bytes(echo_cmd, cat_cmd, tr_cmd):
+    "Test the .bytes modifier."
+    output = await echo_cmd.bytes("abc")
+    assert output == b"abc"
+
+    output = await cat_cmd().stdin(b"\xff\x00\xfe").bytes
+    assert output == b"\xff\x00\xfe"
+
+    pipe = echo_cmd("abc") | tr_cmd
+    assert await pipe.bytes == b"ABC"
+
+    with pytest.raises(ResultError):
+        await echo_cmd.env(SHELLOUS_EXIT_CODE=3).bytes("abc")
+
+    # `.bytes` after `.result` clears the exit codes set by `.result`.
+    with pytest.raises(ResultError):
+        await echo_cmd.env(SHELLOUS_EXIT_CODE=3).result.bytes("abc")
+    with pytest.raises(ResultError):
+        await (echo_cmd.env(SHELLOUS_EXIT_CODE=3)("abc") | tr_cmd).result.bytes
+    with pytest.raises(ResultError):
+        await echo_cmd.result.bytes.env(SHELLOUS_EXIT_CODE=3)("abc")
+
+
 async def test_pipe_result_1(echo_cmd, tr_cmd):
     "Test the .result modifier with a pipe."
     echo = echo_cmd.env(SHELLOUS_EXIT_SLEEP=0.5, SHELLOUS_EXIT_CODE=17)
@@ -992,6 +1068,55 @@ async def test_command_iterator_api(echo_cmd):
     assert len(asyncio.all_tasks()) == 1
 
 
+async def test_command_lines_batched(count_cmd, cat_cmd):
+    "Test iterating over batches of lines."
+    expected = [f"{i}\n" for i in range(1, 20001)]
+
+    batches = [lines async for lines in count_cmd(20000).lines(batch=300)]
+    assert all(0 < len(lines) <= 300 for lines in batches)
+    assert sum(batches, []) == expected
+
+    batches = [lines async for lines in count_cmd(20000).lines()]
+    assert sum(batches, []) == expected
+
+    # Last line has no line ending.
+    cmd = cat_cmd().stdin("a\nb\n\nc")
+    batches = [lines async for lines in cmd.lines()]
+    assert batches == [["a\n", "b\n", "\n"], ["c"]]
+
+    pipe = count_cmd(5) | cat_cmd()
+    batches = [lines async for lines in pipe.lines(batch=2)]
+    assert all(0 < len(lines) <= 2 for lines in batches)
+    assert sum(batches, []) == ["1\n", "2\n", "3\n", "4\n", "5\n"]
+
+    async with count_cmd(3).stdout(sh.CAPTURE) as run:
+        batches = [lines async for lines in run.iter_lines_batched()]
+    assert sum(batches, []) == ["1\n", "2\n", "3\n"]
+
+
+async def test_command_records_chunks(count_cmd, cat_cmd):
+    "Test iterating over undecoded records and chunks."
+    records = [rec async for rec in count_cmd(3).records()]
+    assert records == [b"1\n", b"2\n", b"3\n"]
+
+    cmd = cat_cmd().stdin(b"a\0bc\0\xff")
+    records = [rec async for rec in cmd.records(b"\0")]
+    assert records == [b"a\0", b"bc\0", b"\xff"]
+
+    chunks = [chunk async for chunk in cmd.chunks(2)]
+    assert chunks == [b"a\0", b"bc", b"\0\xff"]
+
+    pipe = count_cmd(5) | cat_cmd()
+    chunks = [chunk async for chunk in pipe.chunks(4)]
+    assert chunks == [b"1\n2\n", b"3\n4\n", b"5\n"]
+    records = [rec async for rec in pipe.records()]
+    assert b"".join(records) == b"1\n2\n3\n4\n5\n"
+
+    with pytest.raises(ValueError, match="sep"):
+        async for _ in count_cmd(1).records(b""):
+            pass
+
+
 async def test_command_iterator_api_interrupted(echo_cmd):
     "Test running a command's async iterator directly."
 
@@ -1193,7 +1318,7 @@ async def test_pipe_fail_stderr(error_cmd, cat_cmd):
         await pipe
     except ResultError as ex:
         assert ex.result.exit_code == 19
-        assert ex.result.error_bytes == b"1" * 1024
+        assert ex.result.error_bytes == b"1" * 512 + b"4" * 512
 
 
 async def test_command_with_timeout_expiring(sleep_cmd):
@@ -1504,6 +1629,28 @@ async def test_bulk_line_limit(bulk_cmd):
             assert False  # never reached
 
 
+async def test_bulk_long_lines(bulk_cmd):
+    "Test line iteration with bulk command and a long line policy."
+    size = 4 * (1024 * 1024 + 1)
+
+    cmd = bulk_cmd.set(stream_limit=2**20, long_lines="split")
+    lines = [line async for line in cmd]
+    assert [len(line) for line in lines] == [2**20] * 4 + [4]
+
+    lines = [line async for line in cmd.set(long_lines="truncate")]
+    assert lines == ["1234" * 2**18]
+
+    lines = [line async for line in cmd.set(long_lines="buffer")]
+    assert [len(line) for line in lines] == [size]
+
+    batched = [line async for batch in cmd.lines() for line in batch]
+    assert [len(line) for line in batched] == [2**20] * 4 + [4]
+
+    pipe = bulk_cmd | cmd.env(SHELLOUS_CMD="cat")
+    lines = [line async for line in pipe]
+    assert sum(len(line) for line in lines) == size
+
+
 def _run(cmd):
     "Run command in process pool executor."
 
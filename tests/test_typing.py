@@ -13,6 +13,7 @@ async def test_cmdcontext():
     assert_type(sh.result, CmdContext[Result])
     assert_type(sh.set(inherit_env=False), CmdContext[str])
     assert_type(sh.result.set(inherit_env=False), CmdContext[Result])
+    assert_type(sh.bytes, CmdContext[bytes])
 
 
 async def test_command():
@@ -46,6 +47,57 @@ async def test_command():
     assert isinstance(out, Result)
 
 
+async def test_command_bytes():
+    "Test typing with the bytes modifier."
+    out = await sh.bytes("echo", "abc")
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+
+    cmd = sh("echo").bytes
+    assert_type(cmd, Command[bytes])
+    out = await cmd("abc")
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+
+    pipe = sh("echo", "abc") | sh("cat").bytes
+    assert_type(pipe, Pipeline[bytes])
+    out = await pipe
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+
+    out = await (sh("echo", "abc") | sh("cat")).bytes
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+
+    # The last of `.result` and `.bytes` wins.
+    out = await sh("echo", "abc").result.bytes
+    assert_type(out, bytes)
+    assert out == b"abc\n"
+
+    out = await sh.result.bytes("echo", "abc")
+    assert_type(out, bytes)
+    assert out == b"abc\n"
+
+    out = await (sh("echo", "abc") | sh("cat")).result.bytes
+    assert_type(out, bytes)
+    assert out == b"abc\n"
+
+    res = await sh("echo", "abc").bytes.result
+    assert_type(res, Result)
+    assert isinstance(res, Result)
+
+    # Output captured in a memory-mapped file is still returned as bytes.
+    out = await sh("echo", "abc").stdout(sh.MMAP).bytes
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+    assert out == b"abc\n"
+
+    out = await (sh("echo", "abc") | sh("cat").stdout(sh.MMAP)).bytes
+    assert_type(out, bytes)
+    assert isinstance(out, bytes)
+    assert out == b"abc\n"
+
+
 async def test_command_redirect():
     "Test typing when redirecting commands."
     tmp = Path("/tmp")
@@ -2,16 +2,25 @@
 
 import asyncio
 import contextlib
+import os
+import pickle
+import sys
+import time
 
 import pytest
 
+from shellous import sh
 from shellous.util import (
     EnvironmentDict,
+    WhichCache,
+    WhichCacheInfo,
     close_fds,
     coerce_env,
     context_aenter,
     context_aexit,
     decode_bytes,
+    pop_rusage,
+    record_rusage,
     uninterrupted,
     verify_dev_fd,
 )
@@ -108,6 +117,64 @@ def test_environment_dict():
         d1["b"] = "2"  # pyright: ignore[reportGeneralTypeIssues]
 
 
+def test_environment_dict_layers():
+    "Test an EnvironmentDict derived through many layers."
+    base = EnvironmentDict(None, {"a": 1, "b": 2})
+    env = base
+    for i in range(20):
+        env = EnvironmentDict(env, {"a": i, f"k{i}": i})
+
+    expected = {"a": "19", "b": "2"} | {f"k{i}": str(i) for i in range(20)}
+    assert len(env) == len(expected)
+    assert env["b"] == "2"
+    assert env["k0"] == "0"
+    assert "missing" not in env
+    assert env == expected
+    assert list(env) == list(expected)
+
+    # Equal dictionaries have the same hash, regardless of layering.
+    flat = EnvironmentDict(None, expected)
+    assert env == flat
+    assert hash(env) == hash(flat)
+
+    # Overriding a value with the same value doesn't change the hash.
+    same = EnvironmentDict(base, {"b": 2})
+    assert same == base
+    assert hash(same) == hash(base)
+
+    # The base is unchanged.
+    assert base == {"a": "1", "b": "2"}
+
+
+def test_environment_dict_long_chain():
+    "Test a very long chain of `.env()` calls."
+    cmd = sh("echo")
+    for i in range(3000):
+        cmd = cmd.env(SHELLOUS_A=i)
+    env = cmd.options.env
+    assert env is not None
+    assert env["SHELLOUS_A"] == "2999"
+    assert env.merged_env(True).merged["SHELLOUS_A"] == "2999"
+    assert env.merged_env(False).merged == {"SHELLOUS_A": "2999"}
+
+    # Deriving from a deep base doesn't change the base.
+    deep = EnvironmentDict(EnvironmentDict(None, {"a": 1}), {"b": 2})
+    for i in range(20):
+        deep = EnvironmentDict(deep, {"a": i})
+    depth = deep._depth
+    EnvironmentDict(deep, {"c": 3})
+    assert deep._depth == depth
+
+
+def test_environment_dict_pickle():
+    "Test pickling an EnvironmentDict."
+    env = EnvironmentDict(EnvironmentDict(None, {"a": 1}), {"b": 2})
+    result = pickle.loads(pickle.dumps(env))
+    assert result == env
+    assert hash(result) == hash(env)
+    assert result._base is None
+
+
 class _TestContextHelpers:
     def __init__(self):
         self.idx = 0
@@ -157,3 +224,130 @@ async def test_context_helpers_overlapping_tasks():
     # We are storing state in a contextvar, which is shared between parent
     # task and child task.
     assert tc.log == ["enter 1", "enter 2", "exit 1", "exit 2"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix")
+def test_which_cache(tmp_path):
+    "Test the WhichCache class."
+    dir1 = tmp_path / "dir1"
+    dir2 = tmp_path / "dir2"
+    dir1.mkdir()
+    dir2.mkdir()
+    search_path = f"{dir1}{os.pathsep}{dir2}"
+
+    stamp = 1000000000
+
+    def _make_old(*paths):
+        "Set a new mtime in the past so the cache trusts it."
+        nonlocal stamp
+        stamp += 1
+        for path in paths:
+            os.utime(path, (stamp, stamp))
+
+    def _make_exe(path):
+        path.write_text("#!/bin/sh\n")
+        path.chmod(0o755)
+
+    cache = WhichCache()
+    _make_old(dir1, dir2)
+
+    assert cache.which("foo", search_path) is None
+    assert cache.which("foo", search_path) is None
+    assert cache.cache_info() == WhichCacheInfo(1, 1, 0, 1)
+
+    # Adding a command to a directory invalidates the entry.
+    _make_exe(dir2 / "foo")
+    _make_old(dir2)
+    assert cache.which("foo", search_path) == str(dir2 / "foo")
+    assert cache.which("foo", search_path) == str(dir2 / "foo")
+    assert cache.cache_info() == WhichCacheInfo(2, 2, 1, 1)
+
+    # The result depends on the earlier directory also.
+    _make_exe(dir1 / "foo")
+    _make_old(dir1)
+    assert cache.which("foo", search_path) == str(dir1 / "foo")
+    assert cache.cache_info() == WhichCacheInfo(2, 3, 2, 1)
+
+    # Recently modified directories are not cached.
+    (dir1 / "foo").unlink()
+    assert cache.which("foo", search_path) == str(dir2 / "foo")
+    assert cache.which("foo", search_path) == str(dir2 / "foo")
+    assert cache.cache_info() == WhichCacheInfo(2, 5, 3, 0)
+
+    # Names with a directory part are not cached.
+    assert cache.which(str(dir2 / "foo"), None) == str(dir2 / "foo")
+    assert cache.cache_info() == WhichCacheInfo(2, 5, 3, 0)
+
+    cache.cache_clear()
+    assert cache.cache_info() == WhichCacheInfo(0, 0, 0, 0)
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Unix")
+def test_which_cache_maxsize(tmp_path):
+    "Test that the WhichCache class evicts the oldest entry."
+    os.utime(tmp_path, (1000000000, 1000000000))
+    cache = WhichCache(maxsize=2)
+    for name in ("a", "b", "c"):
+        assert cache.which(name, str(tmp_path)) is None
+    assert cache.cache_info().currsize == 2
+
+    assert cache.which("a", str(tmp_path)) is None
+    assert cache.cache_info() == WhichCacheInfo(0, 4, 0, 2)
+
+
+def test_environment_dict_merged_env(monkeypatch):
+    "Test the EnvironmentDict `merged_env` cache."
+    d1 = EnvironmentDict(None, {"SHELLOUS_A": 1})
+    env1 = d1.merged_env(True)
+    assert env1.merged["SHELLOUS_A"] == "1"
+    assert "PATH" in env1.merged
+    assert d1.merged_env(True) is env1
+
+    # Changing os.environ invalidates the cache.
+    monkeypatch.setenv("SHELLOUS_B", "2")
+    env2 = d1.merged_env(True)
+    assert env2 is not env1
+    assert env2.merged["SHELLOUS_B"] == "2"
+    assert d1.merged_env(True) is env2
+
+    env3 = d1.merged_env(False)
+    assert env3.merged == {"SHELLOUS_A": "1"}
+    assert d1.merged_env(False) is env3
+
+    if sys.platform != "win32":
+        assert env2.encoded[b"SHELLOUS_A"] == b"1"
+        assert env2.encoded[b"SHELLOUS_B"] == b"2"
+        assert env3.encoded == {b"SHELLOUS_A": b"1"}
+
+
+def test_environment_dict_merged_env_layers(monkeypatch):
+    "Test `merged_env` for a derived EnvironmentDict."
+    d1 = EnvironmentDict(None, {"SHELLOUS_A": 1})
+    d2 = EnvironmentDict(d1, {"SHELLOUS_C": 3})
+    env1 = d2.merged_env(True)
+    assert env1.merged["SHELLOUS_A"] == "1"
+    assert env1.merged["SHELLOUS_C"] == "3"
+    assert d2.merged_env(True) is env1
+
+    monkeypatch.setenv("SHELLOUS_B", "2")
+    env2 = d2.merged_env(True)
+    assert env2 is not env1
+    assert env2.merged["SHELLOUS_B"] == "2"
+
+    assert d2.merged_env(False).merged == {"SHELLOUS_A": "1", "SHELLOUS_C": "3"}
+
+
+def test_pop_rusage():
+    "Test that `pop_rusage` ignores an entry left by an earlier process."
+    pid = 2**31 - 1
+    record_rusage(pid, "usage1")
+    assert pop_rusage(pid) == "usage1"
+    assert pop_rusage(pid) is None
+
+    # An unclaimed entry recorded before the process was spawned is stale.
+    record_rusage(pid, "stale")
+    assert pop_rusage(pid, time.monotonic() + 1.0) is None
+
+    spawned = time.monotonic()
+    record_rusage(pid, "usage2")
+    assert pop_rusage(pid, spawned) == "usage2"
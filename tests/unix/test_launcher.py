@@ -0,0 +1,293 @@
+"Unit tests for alternative process launchers (Linux and MacOS)."
+
+import asyncio
+import io
+import sys
+
+import pytest
+
+from shellous import PhaseTiming, ResourceUsage, sh
+from shellous.forkserver import can_forkserver, close_forkserver, get_forkserver
+from shellous.spawn import can_posix_spawn
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Unix")
+
+_LAUNCHERS = ["posix_spawn", "forkserver"]
+
+
+@pytest.fixture(params=_LAUNCHERS)
+async def xsh(request):
+    "Return a context that uses the launcher under test."
+    yield sh.set(launcher=request.param)
+    close_forkserver()
+
+
+def test_launcher_invalid():
+    "Test setting an unknown launcher."
+    with pytest.raises(ValueError, match="unknown launcher"):
+        sh.set(launcher="fork")  # pyright: ignore[reportGeneralTypeIssues]
+
+
+def test_can_posix_spawn():
+    "Test the `can_posix_spawn` eligibility check."
+    assert can_posix_spawn({"stdin": -1, "stdout": -1, "stderr": -2})
+    assert can_posix_spawn({"stdin": 0, "stdout": 7, "stderr": -3})
+    assert not can_posix_spawn({"preexec_fn": print})
+    assert not can_posix_spawn({"start_new_session": True})
+    assert not can_posix_spawn({"close_fds": True})
+    assert not can_posix_spawn({"pass_fds": [5]})
+    assert not can_posix_spawn({"stdout": 0})
+
+
+def test_can_forkserver():
+    "Test the `can_forkserver` eligibility check."
+    assert can_forkserver({"stdin": -1, "stdout": 0, "stderr": -2})
+    assert can_forkserver({"close_fds": True, "pass_fds": [5]})
+    assert not can_forkserver({"preexec_fn": print})
+    assert not can_forkserver({"start_new_session": True})
+
+
+async def test_launcher_echo(xsh):
+    "Test running echo with the launcher."
+    result = await xsh("echo", "-n", "hello")
+    assert result == "hello"
+
+
+async def test_launcher_input(xsh):
+    "Test feeding input to the subprocess."
+    result = await xsh("cat").stdin("abc")
+    assert result == "abc"
+
+
+async def test_launcher_bytes_received(xsh):
+    "Test counting the input and output bytes."
+    async with xsh("cat").stdin("abcd").stdout(sh.CAPTURE) as run:
+        assert run.input_size == 4
+        assert await run.stdout.read() == b"abcd"
+    assert run.bytes_received == 4
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux")
+async def test_launcher_input_memfd(xsh):
+    "Test feeding input to the subprocess using a memfd."
+    data = "abc" * 2**20
+    result = await xsh("cat").stdin(data).set(input_memfd=True)
+    assert result == data
+
+
+async def test_launcher_stderr(xsh):
+    "Test reading stderr."
+    cmd = xsh(sys.executable, "-c", "import sys; sys.stderr.write('err')")
+    result = await cmd.result
+    assert result.exit_code == 0
+    assert result.error == "err"
+
+    result = await cmd.stderr(sh.STDOUT)
+    assert result == "err"
+
+    result = await cmd.stderr(sh.DEVNULL).result
+    assert result.error == ""
+
+
+async def test_launcher_exit_code(xsh):
+    "Test the exit code of a failing process."
+    result = await xsh("sh", "-c", "exit 7").result
+    assert result.exit_code == 7
+
+
+async def test_launcher_env(xsh):
+    "Test passing environment variables."
+    result = await xsh("sh", "-c", "echo $SHELLOUS_X").env(SHELLOUS_X="y")
+    assert result == "y\n"
+
+    result = await xsh("env").set(inherit_env=False).env(A=1)
+    assert result == "A=1\n"
+
+
+async def test_launcher_redirect_file(xsh, tmp_path):
+    "Test redirecting output to a file."
+    out = tmp_path / "out.txt"
+    await (xsh("echo", "file") | out)
+    assert out.read_text() == "file\n"
+
+    result = await (out | xsh("cat"))
+    assert result == "file\n"
+
+
+async def test_launcher_stringio(xsh):
+    "Test redirecting output to a StringIO."
+    buf = io.StringIO()
+    await (xsh("echo", "buf") | buf)
+    assert buf.getvalue() == "buf\n"
+
+
+async def test_launcher_not_found(xsh):
+    "Test launching a command that does not exist."
+    with pytest.raises(FileNotFoundError):
+        await xsh("/there/is/no/command")
+
+
+async def test_launcher_capture(xsh):
+    "Test using the launcher with stdin/stdout capture."
+    cmd = xsh("cat").stdin(sh.CAPTURE).stdout(sh.CAPTURE)
+    async with cmd as run:
+        assert run.stdin is not None
+        assert run.stdout is not None
+        run.stdin.write(b"abc\n")
+        await run.stdin.drain()
+        line = await run.stdout.readline()
+        run.stdin.close()
+
+    assert line == b"abc\n"
+    assert run.result().exit_code == 0
+
+
+async def test_launcher_iterate(xsh):
+    "Test iterating over lines of output."
+    lines = [line async for line in xsh("printf", "a\\nb\\n")]
+    assert lines == ["a\n", "b\n"]
+
+
+async def test_launcher_timeout(xsh):
+    "Test a timeout with the launcher."
+    with pytest.raises(asyncio.TimeoutError):
+        await xsh("sleep", 5).set(timeout=0.1)
+
+
+async def test_launcher_cancel(xsh):
+    "Test cancelling a process started by the launcher."
+    result = await xsh("sleep", 5).set(timeout=0.1, _catch_cancelled_error=True).result
+    assert result.cancelled
+    assert result.exit_code == -15
+
+
+async def test_launcher_pipeline(xsh):
+    "Test a pipeline of commands started by the launcher."
+    result = await (xsh("echo", "pipe") | xsh("tr", "a-z", "A-Z"))
+    assert result == "PIPE\n"
+
+
+async def test_launcher_fallback(xsh):
+    "Test that commands unsupported by the launcher still run."
+    result = await xsh("echo", "pty").set(pty=True)
+    assert result == "pty\r\n"
+
+    result = await xsh("echo", "session").set(_start_new_session=True)
+    assert result == "session\n"
+
+
+async def test_launcher_process_substitution(xsh):
+    "Test process substitution, which uses `pass_fds`."
+    cmd = xsh("diff", xsh("echo", "a"), xsh("echo", "b")).set(exit_codes={0, 1})
+    result = await cmd
+    assert result == "1c1\n< a\n---\n> b\n"
+
+
+async def test_launcher_pass_fds(xsh, tmp_path):
+    "Test the pass_fds option."
+    out = tmp_path / "test_pass_fds"
+    script = "import os, sys; os.write(int(sys.argv[1]), b'hello')"
+
+    with open(out, "w") as fp:
+        fd = fp.fileno()
+        await xsh(sys.executable, "-c", script, fd).set(pass_fds=[fd])
+
+    assert out.read_bytes() == b"hello"
+
+
+async def test_forkserver_reuse():
+    "Test that the fork server is shared by commands in the same event loop."
+    xsh = sh.set(launcher="forkserver")
+    try:
+        results = await asyncio.gather(*[xsh("echo", i) for i in range(20)])
+        assert results == [f"{i}\n" for i in range(20)]
+
+        server = get_forkserver()
+        await xsh("echo")
+        assert get_forkserver() is server
+        assert (await xsh("sh", "-c", "echo $PPID")) == f"{server.pid}\n"
+
+    finally:
+        close_forkserver()
+
+
+async def test_forkserver_cancel_spawn():
+    "Test cancelling a command while the fork server is launching it."
+    xsh = sh.set(launcher="forkserver")
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(xsh("sleep", 5), 0.001)
+        # The next command still runs normally.
+        assert (await xsh("echo", "ok")) == "ok\n"
+
+    finally:
+        close_forkserver()
+
+
+async def test_forkserver_large_request():
+    "Test sending a launch request larger than the socket buffer."
+    xsh = sh.set(launcher="forkserver")
+    env = {f"BIG_{i}": str(i) * 100000 for i in range(10)}
+    script = "import os; print(sum(len(os.environ[f'BIG_{i}']) for i in range(10)))"
+    try:
+        # The request is queued and sent as the helper reads it.
+        result = await xsh(sys.executable, "-c", script).env(**env)
+        assert result == "1000000\n"
+
+    finally:
+        close_forkserver()
+
+
+async def test_launcher_rusage(xsh):
+    "Test that the launcher records resource usage."
+    script = "sum(range(2000000))"
+    async with xsh(sys.executable, "-c", script) as run:
+        pass
+    rusage = run.rusage
+    assert rusage is not None
+    assert rusage.user_time + rusage.system_time > 0.0
+    assert rusage.max_rss > 1024 * 1024
+
+    result = await xsh(sys.executable, "-c", script).result
+    assert result.rusage is not None
+    assert result.rusage.minor_faults > 0
+
+    result = await (xsh("echo", "a") | xsh("cat")).result
+    assert result.rusage is not None
+
+
+def test_resource_usage_add():
+    "Test combining ResourceUsage values."
+    usage1 = ResourceUsage(1.0, 2.0, 100, 1, 2, 3, 4)
+    usage2 = ResourceUsage(0.5, 0.5, 200, 1, 1, 1, 1)
+    assert usage1 + usage2 == ResourceUsage(1.5, 2.5, 200, 2, 3, 4, 5)
+
+
+async def test_launcher_timing(xsh):
+    "Test that the launcher records the phase timestamps."
+    result = await xsh("echo", "hello").result
+    timing = result.timing
+    assert timing is not None
+    assert timing.first_output is not None
+    assert timing.exited is not None
+    assert (
+        timing.started
+        <= timing.setup
+        <= timing.spawn
+        <= timing.spawned
+        <= timing.first_output
+        <= timing.drained
+        <= timing.closed
+    )
+    assert timing.spawned <= timing.exited <= timing.drained
+
+
+def test_phase_timing_elapsed():
+    "Test the PhaseTiming elapsed time properties."
+    timing = PhaseTiming(started=1.0, setup=1.5, spawn=2.0, spawned=4.0)
+    assert timing.queue_time == 0.5
+    assert timing.setup_time == 0.5
+    assert timing.spawn_time == 2.0
+    assert timing.first_output_time is None
+    assert timing.run_time is None
+    assert timing.total_time is None
@@ -12,7 +12,7 @@ from pathlib import Path
 
 import pytest
 
-from shellous import Result, ResultError, cbreak, cooked, raw, sh
+from shellous import Options, Result, ResultError, Runner, cbreak, cooked, raw, sh
 from shellous.harvest import harvest, harvest_results
 
 pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="Unix")
@@ -538,6 +538,93 @@ async def test_pipeline_with_env():
     assert result == "XYZ"
 
 
+async def test_phase_timing():
+    "Test the phase timestamps recorded by Runner."
+    cmd = sh("sh", "-c", "sleep 0.1; echo hello")
+    async with cmd.set(max_concurrency=1) as run:
+        assert run.timing.spawned is not None
+        assert run.timing.closed is None
+    timing = run.timing
+    assert run.result().timing == timing
+    assert timing.first_output_time is not None
+    assert timing.first_output_time >= 0.05
+    assert timing.run_time is not None
+    assert timing.run_time >= timing.first_output_time
+    assert timing.drain_time is not None
+    assert timing.close_time is not None
+    assert timing.total_time is not None
+
+    # Output redirected to a file has no `first_output`.
+    result = await sh("echo").stdout(sh.DEVNULL).result
+    assert result.timing is not None
+    assert result.timing.first_output is None
+    assert result.timing.exited is not None
+
+    # A pipeline has no timing.
+    result = await (sh("echo") | sh("cat")).result
+    assert result.timing is None
+
+
+_PY_SEEK_STDIN = """\
+import sys
+stdin = sys.stdin.buffer
+if stdin.seekable():
+    size = stdin.seek(0, 2)
+    stdin.seek(0)
+    print(size, stdin.read() == b"x" * size)
+else:
+    print("pipe", len(stdin.read()))
+"""
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux")
+async def test_input_memfd():
+    "Test passing large input using a memfd."
+    data = b"x" * (4 * 2**20)
+    cmd = sh(sys.executable, "-c", _PY_SEEK_STDIN).stdin(data)
+
+    result = await cmd.set(input_memfd=True)
+    assert result == f"{len(data)} True\n"
+
+    # Input below the threshold uses a pipe.
+    result = await cmd.set(input_memfd=len(data) + 1)
+    assert result == f"pipe {len(data)}\n"
+
+    result = await cmd.stdin("xxx").set(input_memfd=2)
+    assert result == "3 True\n"
+
+    result = await cmd.stdin(bytearray(b"xxx")).set(input_memfd=2)
+    assert result == "3 True\n"
+
+    # The memfd is sealed against writes.
+    script = "import os; os.write(0, b'abc')"
+    result = (
+        await sh(sys.executable, "-c", script)
+        .stdin(data)
+        .set(input_memfd=True, exit_codes={1})
+        .result
+    )
+    assert "Operation not permitted" in result.error
+
+
+async def test_max_output_cancel():
+    "Test that `max_output_action` 'cancel' stops the process."
+    script = "import sys\nwhile True: sys.stdout.write('x' * 1000); sys.stdout.flush()"
+    cmd = sh(sys.executable, "-c", script).set(
+        max_output=10000,
+        max_output_action="cancel",
+    )
+
+    with pytest.raises(ResultError) as exc_info:
+        await cmd
+
+    result = exc_info.value.result
+    assert result.exit_code == _CANCELLED_EXIT_CODE
+    assert not result.cancelled
+    assert result.truncated
+    assert result.output_bytes == b"x" * 10000
+
+
 async def test_pipeline_with_result():
     "Test a simple pipeline with `_return_result` set to True."
     echo = sh("echo", "-n", "xyz")
@@ -1795,3 +1882,213 @@ os.write(fd, b"hello")
         await sh(sys.executable, "-c", script, fd).set(pass_fds=[fd])
 
     assert out.read_bytes() == b"hello"
+
+
+def test_context_find_command_cache_info():
+    "Test the context's `find_command_cache_info` method."
+    sh.find_command("echo")
+    info1 = sh.find_command_cache_info()
+    sh.find_command("echo")
+    info2 = sh.find_command_cache_info()
+    assert info2.hits + info2.misses == info1.hits + info1.misses + 1
+    assert info2.currsize >= 1
+
+
+async def test_compiled_command(tmp_path):
+    "Test running a compiled command repeatedly."
+    cmd = sh("cat").stdin("abc").compile()
+    for _ in range(3):
+        assert await cmd == "abc"
+
+    out = tmp_path / "compiled"
+    cmd = sh("echo", "file").stdout(out, append=True).compile()
+    await cmd
+    await cmd
+    assert out.read_text() == "file\nfile\n"
+
+    cmd = sh("sh", "-c", "echo err >&2; exit 3").compile()
+    result = await cmd.result
+    assert result.exit_code == 3
+    assert result.error == "err\n"
+
+    cmd = sh("diff", sh("echo", "a"), sh("echo", "a")).compile()
+    assert await cmd == ""
+
+    with pytest.raises(FileNotFoundError):
+        await sh("no_such_command").compile()
+
+
+async def test_compiled_command_plan(monkeypatch):
+    "Test that commands derived from a compiled command use its launch plan."
+    cmd = sh("echo", "abc").compile()
+    plan = cmd.launch_plan
+    assert plan is not None
+    assert cmd.result.launch_plan is plan
+    assert cmd.bytes.launch_plan is plan
+    assert cmd.env(A="1").set(timeout=5.0).launch_plan is plan
+
+    # Changing the redirections or arguments compiles the command again.
+    devnull = cmd.stdout(sh.DEVNULL)
+    assert devnull.launch_plan not in (None, plan)
+    assert cmd("def").launch_plan not in (None, plan)
+    assert sh("echo").stdout(sh.DEVNULL).launch_plan is None
+
+    # A compiled command doesn't look up its executable again.
+    def _which(*_args):
+        raise AssertionError("which")
+
+    monkeypatch.setattr(Options, "which", _which)
+    assert await cmd == "abc\n"
+    assert (await cmd.result).output == "abc\n"
+    assert await cmd.bytes == b"abc\n"
+    assert (await devnull.result).output == ""
+    with pytest.raises(AssertionError, match="which"):
+        await sh("echo", "abc")
+
+
+async def test_command_template():
+    "Test running commands created from a template."
+    tmpl = sh("echo", sh.ARG, "-", sh.ARG).template()
+    assert await tmpl("a", "b") == "a - b\n"
+
+    with pytest.raises(TypeError, match="not bound"):
+        await sh("echo", sh.ARG)
+
+
+async def test_max_concurrency():
+    "Test the `max_concurrency` option."
+    xsh = sh.set(max_concurrency=2)
+    limiter = xsh.options.max_concurrency
+    assert limiter is not None
+    assert xsh("echo").options.max_concurrency is limiter
+
+    script = "import os, sys, time; print(time.monotonic()); time.sleep(0.2)"
+    cmds = [xsh(sys.executable, "-c", script, i) for i in range(4)]
+    results = await asyncio.gather(*cmds)
+    starts = sorted(float(result) for result in results)
+    # The 3rd and 4th commands wait for a slot.
+    assert starts[2] - starts[0] >= 0.15
+    assert limiter.running == 0
+
+
+async def test_max_concurrency_pipeline():
+    "Test that a pipeline and process substitutions use a single slot."
+    xsh = sh.set(max_concurrency=1)
+    result = await (xsh("echo", "abc") | xsh("cat") | xsh("tr", "a-z", "A-Z"))
+    assert result == "ABC\n"
+
+    result = await xsh("cat", xsh("echo", "a") | xsh("cat"), xsh("echo", "b"))
+    assert result == "a\nb\n"
+    assert xsh.options.max_concurrency.running == 0
+
+
+async def test_max_concurrency_cancel():
+    "Test cancelling commands that are waiting for a slot."
+    xsh = sh.set(max_concurrency=1)
+    limiter = xsh.options.max_concurrency
+    task1 = asyncio.create_task(xsh("sleep", 5).coro())
+    task2 = asyncio.create_task(xsh("echo").coro())
+    await asyncio.sleep(0.1)
+    assert limiter.running == 1
+    assert limiter.waiting == 1
+
+    task2.cancel()
+    task1.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task1
+    with pytest.raises(asyncio.CancelledError):
+        await task2
+    assert limiter.running == 0
+    assert limiter.waiting == 0
+
+
+async def test_command_map():
+    "Test running a command for each item with `Command.map`."
+    cmd = sh("echo")
+    results = [result async for result in cmd.map(range(10), limit=3)]
+    assert results == [f"{i}\n" for i in range(10)]
+
+    async def _items():
+        for i in ("a", "b"):
+            yield i
+
+    results = [result async for result in sh("cat").map(_items(), stdin=True)]
+    assert results == ["a", "b"]
+
+
+async def test_command_map_unordered():
+    "Test yielding results as they complete."
+    cmd = sh("sh", "-c", 'sleep "$0"; echo "$0"')
+    results = [
+        result async for result in cmd.map(["0.3", "0.0"], limit=2, ordered=False)
+    ]
+    assert results == ["0.0\n", "0.3\n"]
+
+
+async def test_context_map_template():
+    "Test `sh.map` with a template."
+    tmpl = sh("echo", sh.ARG, sh.ARG).template()
+    results = [result async for result in sh.map(tmpl, [("a", 1), ("b", 2)])]
+    assert results == ["a 1\n", "b 2\n"]
+
+    tmpl = sh("echo", sh.ARG).template()
+    results = [result async for result in sh.map(tmpl, ["x"])]
+    assert results == ["x\n"]
+
+
+async def test_command_map_fail_fast():
+    "Test that the first error cancels the other commands."
+    cmd = sh("env")
+    items = [["sleep", 5], ["sh", "-c", "exit 3"], ["sleep", 5]]
+    with pytest.raises(ResultError) as exc_info:
+        async for _ in cmd.map(items):
+            pass
+    assert exc_info.value.result.exit_code == 3
+
+    results = [result async for result in cmd.map(items[1:2], fail_fast=False)]
+    assert isinstance(results[0], ResultError)
+
+
+@pytest.mark.parametrize("fail_fast", [True, False])
+async def test_command_map_ordered_wait(fail_fast, monkeypatch):
+    "Test ordered results when later items finish before the first one."
+    wait_calls = 0
+    real_wait = asyncio.wait
+
+    async def _wait(*args, **kwds):
+        nonlocal wait_calls
+        if sys._getframe(1).f_globals["__name__"] == "shellous.fanout":
+            wait_calls += 1
+        return await real_wait(*args, **kwds)
+
+    monkeypatch.setattr(asyncio, "wait", _wait)
+
+    cmd = sh("sh", "-c", 'sleep "$0"; echo "$0"')
+    items = ["0.5", "0", "0", "0"]
+    results = [result async for result in cmd.map(items, limit=4, fail_fast=fail_fast)]
+    assert results == [f"{item}\n" for item in items]
+    assert wait_calls <= len(items)
+
+
+async def test_command_map_break():
+    "Test that stopping the iteration early cancels the other commands."
+    agen = sh("env").map([["echo", "done"], ["sleep", 5], ["sleep", 5]])
+    async for result in agen:
+        assert result == "done\n"
+        break
+    await agen.aclose()
+
+
+async def test_close_cancels_sinks_waiter():
+    "Test that closing a runner cancels a sinks waiter that is still pending."
+    run = Runner(sh("sleep", 5))
+    await run._start()
+    sinks = [task for task in run._tasks if task.get_name().endswith("#sinks")]
+    assert len(sinks) == 1 and not sinks[0].done()
+
+    # Close while the process is still running; its stdout is still open.
+    await run._close()
+    assert sinks[0].cancelled()
+
+    assert run._proc is not None
+    await run._proc.wait()